@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+#
+# Flat array-backed AST for Mini Triangle
+
+import array
+import struct
+import sys
+
+import ast
+import scanner
+
+
+# Node kinds, in the order of their kind index, see ast.KINDS.
+KINDS = ast.KINDS
+
+# Fields holding a name, operator or literal rather than nodes. A node
+# has at most one; it is stored as a symbol ID in Arena.values.
+VALUE_FIELDS = frozenset(['identifier', 'name', 'value', 'operator', 'oper'])
+
+# Kinds whose only field is a list of nodes.
+LIST_KINDS = frozenset([ast.BlockCommand.kind,
+                        ast.BlockArgrExpression.kind,
+                        ast.BlockDeclaration.kind,
+                        ast.BlockArgr.kind])
+
+# Serialized header: magic, version, byte order, node, child and
+# symbol table sizes. The symbol table is the NUL terminated names.
+MAGIC = 'MTAR'
+VERSION = 2
+
+# Number of columns with one item per node.
+NODE_COLUMNS = 7
+HEADER = struct.Struct('<4sBBxxIII')
+
+
+class ArenaError(Exception):
+    """ Raised when loading a malformed or incompatible arena """
+
+    def __init__(self, msg):
+        self.msg = msg
+
+    def __str__(self):
+        return 'ArenaError: %s' % self.msg
+
+
+class Arena(object):
+    """ A whole tree stored in parallel array('i') columns.
+
+        A node is an integer handle indexing the columns: its kind
+        (index in KINDS), its value (symbol ID of its name, operator or
+        literal, or -1), its position in the source text (or -1), its
+        span (span_starts[h], span_stops[h], or -1, -1), and the slice
+        children[first[h]:first[h] + counts[h]] of child handles. Child
+        handles are -1 for missing subtrees, and -2 - sym for a field
+        holding the string symbols.names[sym] instead of a node.
+
+        from_ast() numbers the nodes in preorder, so the root is handle
+        0 and walking a subtree forwards reads the columns in order.
+    """
+    __slots__ = ('kinds', 'values', 'positions', 'span_starts', 'span_stops', 'first',
+                 'counts', 'children', 'symbols')
+
+    def __init__(self, symbols=None):
+        self.kinds = array.array('i')
+        self.values = array.array('i')
+        self.positions = array.array('i')
+        self.span_starts = array.array('i')
+        self.span_stops = array.array('i')
+        self.first = array.array('i')
+        self.counts = array.array('i')
+        self.children = array.array('i')
+        self.symbols = symbols or scanner.SymbolTable()
+
+    def add(self, kind, value, pos, count, span=(-1, -1)):
+        """Append a node with count child slots, initially -1, and
+        return its handle.
+        """
+
+        handle = len(self.kinds)
+        self.kinds.append(kind)
+        self.values.append(value)
+        self.positions.append(pos)
+        self.span_starts.append(span[0])
+        self.span_stops.append(span[1])
+        self.first.append(len(self.children))
+        self.counts.append(count)
+        self.children.extend([-1] * count)
+        return handle
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def kind(self, h):
+        return self.kinds[h]
+
+    def value(self, h):
+        """Return the name, operator or literal of node h, or None."""
+
+        sym = self.values[h]
+        if sym < 0:
+            return None
+        return self.symbols.names[sym]
+
+    def pos(self, h):
+        return self.positions[h]
+
+    def span(self, h):
+        """Return the span of node h, or None."""
+
+        if self.span_starts[h] < 0:
+            return None
+        return self.span_starts[h], self.span_stops[h]
+
+    def child(self, h, i):
+        return self.children[self.first[h] + i]
+
+    def child_handles(self, h):
+        first = self.first[h]
+        return self.children[first:first + self.counts[h]]
+
+    @classmethod
+    def from_ast(cls, tree, symbols=None):
+        """Return an Arena holding tree, with tree as handle 0."""
+
+        arena = cls(symbols)
+        children = arena.children
+        intern = arena.symbols.intern
+        # (node, slot in children that receives its handle)
+        stack = [(tree, -1)]
+        while stack:
+            node, slot = stack.pop()
+            if node is None:
+                continue
+            if not isinstance(node, ast.AST):
+                children[slot] = -2 - intern(node)
+                continue
+            kind = node.kind
+            value = -1
+            nodes = []
+            if kind in LIST_KINDS:
+                nodes = getattr(node, node._fields[0])
+            else:
+                for name in node._fields:
+                    if name in VALUE_FIELDS:
+                        value = intern(str(getattr(node, name)))
+                    else:
+                        nodes.append(getattr(node, name))
+            pos = node.pos
+            if pos is None:
+                pos = -1
+            handle = arena.add(kind, value, pos, len(nodes), node.span or (-1, -1))
+            if slot >= 0:
+                children[slot] = handle
+            first = arena.first[handle]
+            # Push in reverse so the first child is numbered next.
+            for i in range(len(nodes) - 1, -1, -1):
+                stack.append((nodes[i], first + i))
+        return arena
+
+    def to_ast(self, handle=0):
+        """Return the subtree rooted at handle as ast nodes."""
+
+        # Collect the subtree in preorder; children come after their
+        # parent, so building it backwards finds them already built.
+        order = []
+        stack = [handle]
+        while stack:
+            h = stack.pop()
+            order.append(h)
+            first = self.first[h]
+            for c in reversed(self.children[first:first + self.counts[h]]):
+                if c >= 0:
+                    stack.append(c)
+
+        built = {}
+        names = self.symbols.names
+        for h in reversed(order):
+            cls = KINDS[self.kinds[h]]
+            first = self.first[h]
+            nodes = []
+            for c in self.children[first:first + self.counts[h]]:
+                if c < -1:
+                    nodes.append(names[-2 - c])
+                else:
+                    nodes.append(built.pop(c, None))
+            if self.kinds[h] in LIST_KINDS:
+                node = cls(nodes)
+            else:
+                args = []
+                for name in cls._fields:
+                    if name == 'value':
+                        args.append(int(names[self.values[h]]))
+                    elif name in VALUE_FIELDS:
+                        args.append(names[self.values[h]])
+                    else:
+                        args.append(nodes.pop(0))
+                node = cls(*args)
+            if self.positions[h] >= 0:
+                node.pos = self.positions[h]
+            if self.span_starts[h] >= 0:
+                node.span = (self.span_starts[h], self.span_stops[h])
+            built[h] = node
+        return built[handle]
+
+    def tostring(self):
+        """Return the arena serialized as one string."""
+
+        # Every name ends with a NUL, so that an empty name survives.
+        names = ''.join([name + '\0' for name in self.symbols.names])
+        header = HEADER.pack(MAGIC, VERSION, sys.byteorder == 'little',
+                             len(self.kinds), len(self.children), len(names))
+        return ''.join([header,
+                        self.kinds.tostring(),
+                        self.values.tostring(),
+                        self.positions.tostring(),
+                        self.span_starts.tostring(),
+                        self.span_stops.tostring(),
+                        self.first.tostring(),
+                        self.counts.tostring(),
+                        self.children.tostring(),
+                        names])
+
+    @classmethod
+    def fromstring(cls, data):
+        """Return the Arena serialized in the string data."""
+
+        if len(data) < HEADER.size:
+            raise ArenaError('truncated header')
+        magic, version, little, nodes, nchildren, nnames = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ArenaError('not a version %d arena' % VERSION)
+        itemsize = array.array('i').itemsize
+        if len(data) != HEADER.size + (NODE_COLUMNS * nodes + nchildren) * itemsize + nnames:
+            raise ArenaError('size mismatch')
+
+        arena = cls()
+        offset = HEADER.size
+        for column, count in [(arena.kinds, nodes), (arena.values, nodes),
+                              (arena.positions, nodes), (arena.span_starts, nodes),
+                              (arena.span_stops, nodes), (arena.first, nodes),
+                              (arena.counts, nodes), (arena.children, nchildren)]:
+            column.fromstring(data[offset:offset + count * itemsize])
+            if bool(little) != (sys.byteorder == 'little'):
+                column.byteswap()
+            offset += count * itemsize
+        for name in data[offset:].split('\0')[:-1]:
+            arena.symbols.intern(name)
+        return arena
+
+    def dump(self, f):
+        """Write the arena to the file object f in a single write."""
+
+        f.write(self.tostring())
+
+    @classmethod
+    def load(cls, f):
+        return cls.fromstring(f.read())
+
+
+if __name__ == '__main__':
+    src = """
+let
+    var x: Integer;
+    const c ~ 3;
+    func three(): Integer
+        begin
+            return c;
+        end
+in
+    begin
+        x := c * (2 + -x);
+        while x > 0 do x := x - 1;
+        putint(x);
+    end
+"""
+    tree = __import__('parser').Parser(scanner.Scanner(src).scan()).parse()
+    arena = Arena.from_ast(tree)
+    for h in xrange(len(arena)):
+        print h, KINDS[arena.kind(h)].__name__, arena.value(h), list(arena.child_handles(h))
+    copy = Arena.fromstring(arena.tostring()).to_ast()
+    print str(copy) == str(tree)
@@ -1,241 +1,441 @@
 # ast.py - Abstract Syntax Tree for Mini Triangle
 
+import cStringIO as StringIO
+
+
+def fold_left(cls, items):
+    """Fold a list of nodes into a left-nested chain of binary cls nodes."""
+
+    node = items[0]
+    for item in items[1:]:
+        node = cls(node, item)
+    return node
+
+
+def iter_fields(node):
+    """Yield (name, value) for every field of node."""
+
+    for name in node._fields:
+        yield name, getattr(node, name)
+
 
 class AST(object):
+    """Base class of all nodes.
 
-    def __init__(self):
-        pass
+    Nodes have no __dict__. Every class lists its fields in _fields, in
+    constructor argument order, and uses them as its __slots__.
+    """
 
+    # pos: position of the node in the source text, set by the parser.
+    # span: token indices (start, stop) the node was parsed from. Only
+    # set for single commands and single declarations, see
+    # parser.reparse().
+    __slots__ = ('pos', 'span')
 
-class Program(AST):
+    _fields = ()
 
-    def __init__(self, command):
-        self.command = command
+    # Index of the class in KINDS, for table driven dispatch.
+    kind = -1
+
+    def __init__(self, *values):
+        if len(values) != len(self._fields):
+            raise TypeError('%s takes %d arguments (%d given)' %
+                            (type(self).__name__, len(self._fields), len(values)))
+        for name, value in zip(self._fields, values):
+            setattr(self, name, value)
+        self.pos = None
+        self.span = None
 
     def __str__(self):
-        return 'Program(%s)' % (str(self.command))
+        out = StringIO.StringIO()
+        dump(self, out)
+        return out.getvalue()
+
+
+class Program(AST):
+
+    _fields = ('command',)
+    __slots__ = _fields
 
 
 class Command(AST):
-    pass
+    __slots__ = ()
 
 
 class AssignCommand(Command):
 
-    def __init__(self, variable, expression):
-        self.variable = variable
-        self.expression = expression
-
-    def __str__(self):
-        return 'AssignCommand(%s,%s)' % (str(self.variable), str(self.expression))
+    _fields = ('variable', 'expression')
+    __slots__ = _fields
 
 
 class CallCommand(Command):
 
-    def __init__(self, identifier, expression):
-        self.identifier = identifier
-        self.expression = expression
-
-    def __str__(self):
-        return 'CallCommand(%s,%s)' % (str(self.identifier), str(self.expression))
+    _fields = ('identifier', 'expression')
+    # function: the FunctionDeclaration called, None for getint and
+    # putint, set by resolver.Resolver.
+    __slots__ = _fields + ('function',)
 
 
 class SequentialCommand(Command):
 
-    def __init__(self, command1, command2):
-        self.command1 = command1
-        self.command2 = command2
+    _fields = ('command1', 'command2')
+    __slots__ = _fields
 
-    def __str__(self):
-        return 'SequentialCommand(%s,%s)' % (str(self.command1), str(self.command2))
 
+class BlockCommand(Command):
+    """A sequence of commands kept in a list.
 
-class IfCommand(Command):
+    The parser builds it instead of a chain of SequentialCommands; code
+    that walks the old binary nodes can use as_sequential().
+    """
 
-    def __init__(self, expression, command1, command2):
-        self.expression = expression
-        self.command1 = command1
-        self.command2 = command2
+    _fields = ('commands',)
+    __slots__ = _fields
 
-    def __str__(self):
-        return 'IfCommand(%s,%s,%s)' % (str(self.expression), str(self.command1), str(self.command2))
+    def as_sequential(self):
+        return fold_left(SequentialCommand, self.commands)
 
 
-class WhileCommand(Command):
+class IfCommand(Command):
 
-    def __init__(self, expression, command):
-        self.expression = expression
-        self.command = command
+    _fields = ('expression', 'command1', 'command2')
+    __slots__ = _fields
 
-    def __str__(self):
-        return 'WhileCommand(%s,%s)' % (str(self.expression), str(self.command))
 
+class WhileCommand(Command):
 
-class LetCommand(Command):
+    _fields = ('expression', 'command')
+    __slots__ = _fields
 
-    def __init__(self, declaration, command):
-        self.declaration = declaration
-        self.command = command
 
-    def __str__(self):
-        return 'LetCommand(%s,%s)' % (str(self.declaration), str(self.command))
+class LetCommand(Command):
 
+    _fields = ('declaration', 'command')
+    # size: number of slots in its frame, set by resolver.Resolver.
+    __slots__ = _fields + ('size',)
 
-class ReturnCommand(Command):
-    def __init__(self, expression):
-        self.expression = expression
 
-    def __str__(self):
-        return 'ReturnCommand(%s)' % (str(self.expression))
+class ReturnCommand(Command):
+    _fields = ('expression',)
+    __slots__ = _fields
 
 
 class Expression(AST):
-    pass
+    # Structural hash, only set on nodes shared by a HashConsTable.
+    __slots__ = ('hash',)
 
 
 class IntegerExpression(Expression):
 
-    def __init__(self, value):
-        self.value = value
-
-    def __str__(self):
-        return 'IntegerExpression(%s)' % (str(self.value))
+    _fields = ('value',)
+    __slots__ = _fields
 
 
 class VnameExpression(Expression):
 
-    def __init__(self, variable):
-        self.variable = variable
-
-    def __str__(self):
-        return 'VnameExpression(%s)' % (str(self.variable))
+    _fields = ('variable',)
+    __slots__ = _fields
 
 
 class CallExpression(Expression):
 
-    def __init__(self, identifier, expression):
-        self.identifier = identifier
-        self.expression = expression
-
-    def __str__(self):
-        return 'CallExpression(%s,%s)' % (str(self.identifier), str(self.expression))
+    _fields = ('identifier', 'expression')
+    # function: the FunctionDeclaration called, set by resolver.Resolver.
+    __slots__ = _fields + ('function',)
 
 
 class UnaryExpression(Expression):
 
-    def __init__(self, operator, expression):
-        self.operator = operator
-        self.expression = expression
-
-    def __str__(self):
-        return 'UnaryExpression(%s,%s)' % (str(self.operator), str(self.expression))
+    _fields = ('operator', 'expression')
+    __slots__ = _fields
 
 
 class BinaryExpression(Expression):
 
-    def __init__(self, expr1, oper, expr2):
-        self.expr1 = expr1
-        self.oper  = oper
-        self.expr2 = expr2
-
-    def __str__(self):
-        return 'BinaryExpression(%s,%s,%s)' % (str(self.expr1), self.oper, str(self.expr2))
+    _fields = ('expr1', 'oper', 'expr2')
+    __slots__ = _fields
 
 
 class Vname(AST):
 
-    def __init__(self, identifier):
-        self.identifier = identifier
-
-    def __str__(self):
-        return 'Vname(%s)' % (str(self.identifier))
+    _fields = ('identifier',)
+    # depth, slot: address of the declaration it names, set by
+    # resolver.Resolver.
+    __slots__ = _fields + ('hash', 'depth', 'slot')
 
 
 class Declaration(AST):
-    pass
+    __slots__ = ()
 
 
 class ConstDeclaration(Declaration):
 
-    def __init__(self, identifier, expression):
-        self.identifier = identifier
-        self.expression = expression
-
-    def __str__(self):
-        return 'ConstDeclaration(%s,%s)' % (str(self.identifier), str(self.expression))
+    _fields = ('identifier', 'expression')
+    # slot: its index in the frame of its let, set by resolver.Resolver.
+    __slots__ = _fields + ('slot',)
 
 
 class VarDeclaration(Declaration):
 
-    def __init__(self, identifier, type_denoter):
-        self.identifier = identifier
-        self.type_denoter = type_denoter
-
-    def __str__(self):
-        return 'VarDeclaration(%s,%s)' % (str(self.identifier), str(self.type_denoter))
+    _fields = ('identifier', 'type_denoter')
+    __slots__ = _fields + ('slot',)
 
 class FunctionDeclaration(Declaration):
 
-    def __init__(self, name, args, return_type_denoter, command):
-        self.name = name
-        #self.argname = argname
-        #self.arg_type_denoter = arg_type_denoter
-        self.args = args
-        self.return_type_denoter = return_type_denoter
-        self.command = command
-
-    def __str__(self):
-        return 'FunctionDeclaration(%s,%s,%s,%s)' % (str(self.name),
-                                                     str(self.args),
-                                                     #str(self.arg_type_denoter),
-                                                     str(self.return_type_denoter),
-                                                     str(self.command))
+    _fields = ('name', 'args', 'return_type_denoter', 'command')
+    # depth, size: depth and number of slots of the frame holding its
+    # parameters; index: its number in the program. All set by
+    # resolver.Resolver.
+    __slots__ = _fields + ('depth', 'size', 'index')
 
 class Argr(AST):
-    pass
+    __slots__ = ()
 
 class SingleArgr(Argr):
-    def __init__(self, name, type_denoter):
-        self.name = name
-        self.type_denoter = type_denoter
-
-    def __str__(self):
-        return 'SingleArgr(%s,%s)' % (str(self.name),
-                                      str(self.type_denoter))
+    _fields = ('name', 'type_denoter')
+    __slots__ = _fields
 
 class SequentialArgr(Argr):
-    def __init__(self, argr1, argr2):
-        self.argr1 = argr1
-        self.argr2 = argr2
+    _fields = ('argr1', 'argr2')
+    __slots__ = _fields
 
-    def __str__(self):
-        return 'SequentialArgr(%s,%s)' % (str(self.argr1), str(self.argr2))
+class BlockArgr(Argr):
+    """A list of function parameters, replacing a SequentialArgr chain."""
+
+    _fields = ('argrs',)
+    __slots__ = _fields
+
+    def as_sequential(self):
+        return fold_left(SequentialArgr, self.argrs)
 
 class ArgrExpression(Expression):
-    def __init__(self, argument1, argument2):
-        self.argument1 = argument1
-        self.argument2 = argument2
+    _fields = ('argument1', 'argument2')
+    __slots__ = _fields
 
-    def __str__(self):
-        return 'ArgrExpression(%s,%s)' % (str(self.argument1), str(self.argument2))
+class BlockArgrExpression(Expression):
+    """A list of call arguments, replacing an ArgrExpression chain."""
+
+    _fields = ('arguments',)
+    __slots__ = _fields
+
+    def as_sequential(self):
+        return fold_left(ArgrExpression, self.arguments)
 
 class SequentialDeclaration(Declaration):
 
-    def __init__(self, decl1, decl2):
-        self.decl1 = decl1
-        self.decl2 = decl2
+    _fields = ('decl1', 'decl2')
+    __slots__ = _fields
 
-    def __str__(self):
-        return 'SequentialDeclaration(%s,%s)' % (str(self.decl1), str(self.decl2))
+
+class BlockDeclaration(Declaration):
+    """A sequence of declarations kept in a list, replacing a
+    SequentialDeclaration chain.
+    """
+
+    _fields = ('declarations',)
+    __slots__ = _fields
+
+    def as_sequential(self):
+        return fold_left(SequentialDeclaration, self.declarations)
 
 
 class TypeDenoter(AST):
 
-    def __init__(self, identifier):
-        self.identifier = identifier
+    _fields = ('identifier',)
+    __slots__ = _fields
+
+
+# Every node class, in the order of their kind index. Serialized trees
+# store these indices, see arena.py and astfile.py, so new classes go
+# at the end.
+KINDS = (Program,
+         AssignCommand,
+         CallCommand,
+         SequentialCommand,
+         BlockCommand,
+         IfCommand,
+         WhileCommand,
+         LetCommand,
+         ReturnCommand,
+         IntegerExpression,
+         VnameExpression,
+         CallExpression,
+         UnaryExpression,
+         BinaryExpression,
+         ArgrExpression,
+         BlockArgrExpression,
+         Vname,
+         ConstDeclaration,
+         VarDeclaration,
+         FunctionDeclaration,
+         SequentialDeclaration,
+         BlockDeclaration,
+         SingleArgr,
+         SequentialArgr,
+         BlockArgr,
+         TypeDenoter)
+
+for kind, cls in enumerate(KINDS):
+    cls.kind = kind
+del kind, cls
+
+
+def dump(tree, out, indent=None, max_depth=None):
+    """Write tree to the file-like object out as ClassName(field,...).
+
+    Nodes are written with an explicit stack straight to out, so the
+    size of the tree is limited neither by the recursion limit nor by
+    building its text in memory. The items of list fields are written
+    like separate fields.
+
+    indent: if given, nodes with children are split over several lines,
+    each child indented by this many more spaces than its parent.
+    max_depth: if given, the children of nodes this deep are written
+    as '...'.
+    """
+
+    write = out.write
+    # Items are either text to write as is or (node, depth) pairs.
+    stack = [(tree, 0)]
+    pop = stack.pop
+    push = stack.append
+    while stack:
+        item = pop()
+        if type(item) is str:
+            write(item)
+            continue
+        node, depth = item
+        if not isinstance(node, AST):
+            write(str(node))
+            continue
+
+        children = []
+        nodes = False
+        for name in node._fields:
+            value = getattr(node, name)
+            if type(value) is list:
+                children.extend(value)
+                nodes = nodes or bool(value)
+            else:
+                children.append(value)
+                nodes = nodes or isinstance(value, AST)
+        if not nodes:
+            # Leaves are written in one go.
+            write('%s(%s)' % (type(node).__name__, ','.join(map(str, children))))
+            continue
+        write(type(node).__name__)
+        if max_depth is not None and depth >= max_depth:
+            write('(...)')
+            continue
+
+        if indent is not None:
+            sep = '\n' + ' ' * (indent * (depth + 1))
+            write('(' + sep)
+            sep = ',' + sep
+            push('\n' + ' ' * (indent * depth) + ')')
+        else:
+            write('(')
+            sep = ','
+            push(')')
+        depth += 1
+        for i in xrange(len(children) - 1, 0, -1):
+            push((children[i], depth))
+            push(sep)
+        push((children[0], depth))
+
+
+def make_init(fields):
+    """Return an __init__ assigning fields from its arguments.
+
+    It does the same as AST.__init__ with one plain assignment per
+    field, which matters when building hundreds of thousands of nodes.
+    """
+
+    lines = ['def __init__(self%s):' % ''.join([', ' + name for name in fields])]
+    lines.extend(['    self.%s = %s' % (name, name) for name in fields])
+    lines.append('    self.pos = None')
+    lines.append('    self.span = None')
+    namespace = {}
+    exec '\n'.join(lines) + '\n' in namespace
+    return namespace['__init__']
+
+
+for cls in globals().values():
+    if isinstance(cls, type) and issubclass(cls, AST) and '_fields' in cls.__dict__:
+        cls.__init__ = make_init(cls._fields)
+del cls
+
+
+class Visitor(object):
+    """Base class of tree walkers that dispatch on the node class.
+
+    dispatch_table() turns a {class: method} mapping into a list indexed
+    by kind, so finding the method for a node is a single list lookup on
+    node.kind however many classes are handled, instead of a chain of
+    type() comparisons. Subclasses build their tables once, in __init__:
+
+        self.commands = self.dispatch_table({AssignCommand: self.assign,
+                                             ...}, self.bad_command)
+
+        def command(self, tree):
+            return self.commands[tree.kind](tree)
+    """
+
+    def dispatch_table(self, methods, default):
+        """Return a list mapping each kind to its method in methods, or
+        to default for the classes methods does not mention.
+        """
+
+        table = [default] * len(KINDS)
+        for cls, method in methods.iteritems():
+            table[cls.kind] = method
+        return table
+
+
+class HashConsTable(object):
+    """Shares structurally identical expression nodes.
+
+    intern() returns the one node already in the table with the same
+    class and fields, or adds the node it is given. Children must have
+    been interned first, so two subtrees are structurally equal exactly
+    when they are the same object. Every interned node gets a structural
+    hash in its hash slot, computed from its children's hashes, which
+    caches and optimizers can use as a key.
+
+    A shared node keeps the position of its first occurrence. Nodes must
+    not be changed once interned.
+    """
+
+    __slots__ = ('nodes',)
 
-    def __str__(self):
-        return 'TypeDonoter(%s)' % (str(self.identifier))
+    def __init__(self):
+        self.nodes = {}
+
+    def intern(self, node):
+        key = [type(node)]
+        hashes = [type(node).__name__]
+        for name in node._fields:
+            value = getattr(node, name)
+            if type(value) is list:
+                key.append(tuple([id(item) for item in value]))
+                hashes.append(tuple([item.hash for item in value]))
+            elif isinstance(value, AST):
+                key.append(id(value))
+                hashes.append(value.hash)
+            else:
+                key.append(value)
+                hashes.append(value)
+        key = tuple(key)
+
+        shared = self.nodes.get(key)
+        if shared is not None:
+            return shared
+        node.hash = hash(tuple(hashes))
+        self.nodes[key] = node
+        return node
+
+    def __len__(self):
+        return len(self.nodes)
 
 
 if __name__ == '__main__':
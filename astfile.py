@@ -0,0 +1,356 @@
+#!/usr/bin/env python
+#
+# Compact binary ast files and the parse cache for Mini Triangle
+
+import hashlib
+import os
+import sys
+
+import arena
+import ast
+import parser
+import scanner
+
+
+# Layout of an ast file, all numbers are unsigned varints:
+#
+#   MAGIC version
+#   value-count (type-byte length bytes)*     names, operators, literals
+#   node-count node*                          nodes in postorder
+#
+# A node is its kind tag (index in ast.KINDS, one byte) followed by
+# its position, its span start and span length (a single 0 if there is
+# no span), the index of its value if its kind has a value field, and
+# the number of items if its kind holds a list. Positions and span
+# starts are stored as the zigzag encoded difference to the previous
+# ones plus 1, 0 meaning unknown, so they mostly fit one byte. Children
+# precede their parent, so loading is a stack machine. NONE_TAG stands
+# for a missing subtree.
+#
+# VERSION changes whenever the layout or the ast classes change.
+MAGIC = 'MTAST'
+VERSION = 2
+NONE_TAG = 0xff
+
+VALUE_STR = 0
+VALUE_INT = 1
+
+
+def make_layouts():
+    """Return (class, index of the value field or -1, number of node
+    fields, holds a list) for every kind tag.
+    """
+
+    layouts = []
+    for kind, cls in enumerate(ast.KINDS):
+        value_index = -1
+        for i, name in enumerate(cls._fields):
+            if name in arena.VALUE_FIELDS:
+                value_index = i
+        layouts.append((cls, value_index, len(cls._fields) - (value_index >= 0),
+                        kind in arena.LIST_KINDS))
+    return layouts
+
+LAYOUTS = make_layouts()
+
+
+class AstFileError(Exception):
+    """ Raised when loading a malformed or incompatible ast file """
+
+    def __init__(self, msg):
+        self.msg = msg
+
+    def __str__(self):
+        return 'AstFileError: %s' % self.msg
+
+
+def write_varint(buf, n):
+    """Append the unsigned varint encoding of n to the bytearray buf."""
+
+    while n >= 0x80:
+        buf.append((n & 0x7f) | 0x80)
+        n >>= 7
+    buf.append(n)
+
+
+def zigzag(n):
+    """Map signed n to an unsigned number: 0, -1, 1, -2 ... to 0, 1, 2, 3 ..."""
+
+    if n < 0:
+        return -2 * n - 1
+    return 2 * n
+
+
+def read_varint(data, i):
+    """Return (value, next index) of the varint at data[i]."""
+
+    n = 0
+    shift = 0
+    while True:
+        b = data[i]
+        i += 1
+        n |= (b & 0x7f) << shift
+        if b < 0x80:
+            return n, i
+        shift += 7
+
+
+def dumps(tree):
+    """Return tree encoded as an ast file string."""
+
+    values = []
+    value_ids = {}
+    nodes = bytearray()
+    count = 0
+    last_pos = 0
+    last_start = 0
+
+    # (node, True once its children have been written)
+    stack = [(tree, False)]
+    while stack:
+        node, done = stack.pop()
+        if node is None:
+            nodes.append(NONE_TAG)
+            count += 1
+            continue
+        if not isinstance(node, ast.AST):
+            raise AstFileError('cannot encode %r as a node' % (node,))
+        kind = node.kind
+        cls, value_index, nchildren, is_list = LAYOUTS[kind]
+        if not done:
+            stack.append((node, True))
+            if is_list:
+                children = getattr(node, cls._fields[0])
+            else:
+                children = [getattr(node, name) for i, name in enumerate(cls._fields)
+                            if i != value_index]
+            for child in reversed(children):
+                stack.append((child, False))
+            continue
+
+        nodes.append(kind)
+        if node.pos is None:
+            nodes.append(0)
+        else:
+            write_varint(nodes, zigzag(node.pos - last_pos) + 1)
+            last_pos = node.pos
+        if node.span is None:
+            nodes.append(0)
+        else:
+            write_varint(nodes, zigzag(node.span[0] - last_start) + 1)
+            write_varint(nodes, node.span[1] - node.span[0])
+            last_start = node.span[0]
+        if value_index >= 0:
+            value = getattr(node, cls._fields[value_index])
+            key = (type(value), value)
+            sym = value_ids.get(key)
+            if sym is None:
+                sym = value_ids[key] = len(values)
+                values.append(value)
+            write_varint(nodes, sym)
+        if is_list:
+            write_varint(nodes, len(getattr(node, cls._fields[0])))
+        count += 1
+
+    buf = bytearray(MAGIC)
+    write_varint(buf, VERSION)
+    write_varint(buf, len(values))
+    for value in values:
+        if isinstance(value, (int, long)):
+            buf.append(VALUE_INT)
+            value = str(value)
+        else:
+            buf.append(VALUE_STR)
+        write_varint(buf, len(value))
+        buf.extend(value)
+    write_varint(buf, count)
+    buf.extend(nodes)
+    return str(buf)
+
+
+def loads(data):
+    """Return the tree encoded in the ast file string data."""
+
+    if data[:len(MAGIC)] != MAGIC:
+        raise AstFileError('not an ast file')
+    data = bytearray(data)
+    try:
+        version, i = read_varint(data, len(MAGIC))
+        if version != VERSION:
+            raise AstFileError('version %d, expected %d' % (version, VERSION))
+
+        nvalues, i = read_varint(data, i)
+        values = []
+        for k in xrange(nvalues):
+            tag = data[i]
+            length, i = read_varint(data, i + 1)
+            value = str(data[i:i + length])
+            i += length
+            if tag == VALUE_INT:
+                value = int(value)
+            else:
+                value = intern(value)
+            values.append(value)
+
+        count, i = read_varint(data, i)
+        stack = []
+        push = stack.append
+        layouts = LAYOUTS
+        last_pos = 0
+        last_start = 0
+        for k in xrange(count):
+            kind = data[i]
+            if kind == NONE_TAG:
+                push(None)
+                i += 1
+                continue
+            cls, value_index, nchildren, is_list = layouts[kind]
+
+            # Single byte varints are by far the most common, so they
+            # are read inline.
+            pos = data[i + 1]
+            i += 2
+            if pos >= 0x80:
+                pos, i = read_varint(data, i - 1)
+            if pos:
+                last_pos += ((pos - 1) >> 1) ^ -((pos - 1) & 1)
+            start = data[i]
+            i += 1
+            if start >= 0x80:
+                start, i = read_varint(data, i - 1)
+            if start:
+                last_start += ((start - 1) >> 1) ^ -((start - 1) & 1)
+                length, i = read_varint(data, i)
+            if value_index >= 0:
+                sym = data[i]
+                i += 1
+                if sym >= 0x80:
+                    sym, i = read_varint(data, i - 1)
+
+            if is_list:
+                n, i = read_varint(data, i)
+                items = stack[len(stack) - n:]
+                del stack[len(stack) - n:]
+                node = cls(items)
+            elif value_index < 0:
+                args = stack[-nchildren:]
+                del stack[-nchildren:]
+                node = cls(*args)
+            elif nchildren == 0:
+                node = cls(values[sym])
+            else:
+                args = stack[-nchildren:]
+                del stack[-nchildren:]
+                args.insert(value_index, values[sym])
+                node = cls(*args)
+            if pos:
+                node.pos = last_pos
+            if start:
+                node.span = (last_start, last_start + length)
+            push(node)
+    except (IndexError, TypeError, ValueError):
+        raise AstFileError('truncated or corrupt ast file')
+
+    if len(stack) != 1 or i != len(data):
+        raise AstFileError('corrupt ast file')
+    return stack[0]
+
+
+def dump(tree, f):
+    """Write tree to the file object f."""
+
+    f.write(dumps(tree))
+
+
+def load(f):
+    """Return the tree read from the file object f."""
+
+    return loads(f.read())
+
+
+class ParseCache(object):
+    """ Parsed trees stored on disk, keyed by a hash of their source.
+
+        Entries are ast files named after the SHA-1 of the source text
+        and VERSION, so an edited source or a new format never matches
+        a stale entry. Unreadable or corrupt entries count as misses and
+        failures to write are ignored; the cache is only an optimization.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def key(self, source):
+        h = hashlib.sha1('%s %d\n' % (MAGIC, VERSION))
+        h.update(source)
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.mtast')
+
+    def get(self, key):
+        """Return the cached tree for key, or None."""
+
+        try:
+            with open(self.path(key), 'rb') as f:
+                return load(f)
+        except (IOError, AstFileError):
+            return None
+
+    def put(self, key, tree):
+        """Store tree under key. A tree that cannot be encoded is just
+        not cached.
+        """
+
+        path = self.path(key)
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            with open(tmp, 'wb') as f:
+                dump(tree, f)
+            os.rename(tmp, path)
+        except (IOError, OSError, AstFileError):
+            pass
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+
+def default_cache_dir(path):
+    """Return the cache directory for the source file path, a
+    __mtcache__ directory next to it.
+    """
+
+    return os.path.join(os.path.dirname(os.path.abspath(path)), '__mtcache__')
+
+
+def parse_file(path, cache=True):
+    """Parse the source file path and return (tree, lines).
+
+    When cache is true, a tree cached for the same source text is loaded
+    instead of scanning and parsing it, and a freshly parsed tree is
+    added to the cache. lines is the scanner.LineIndex of the source.
+    Raises scanner.ScannerError or parser.ParserError.
+    """
+
+    scanner_obj = scanner.Scanner.from_file(path)
+    if cache:
+        parse_cache = ParseCache(default_cache_dir(path))
+        key = parse_cache.key(scanner_obj.input)
+        tree = parse_cache.get(key)
+        if tree is not None:
+            return tree, scanner.LineIndex.from_text(scanner_obj.input)
+
+    tree = parser.Parser(scanner_obj.iter_tokens(), scanner_obj.lines).parse()
+    if cache:
+        parse_cache.put(key, tree)
+    return tree, scanner_obj.lines
+
+
+if __name__ == '__main__':
+    for path in sys.argv[1:]:
+        tree, lines = parse_file(path, cache=False)
+        data = dumps(tree)
+        print '%s: %d bytes, %d lines' % (path, len(data), len(lines.starts))
+        print str(loads(data)) == str(tree)
@@ -0,0 +1,1035 @@
+#!/usr/bin/env python
+#
+# Benchmarks for Mini Triangle
+#
+# Usage: python bench.py [benchmark ...]
+
+import __builtin__
+import cPickle
+import cStringIO
+import os
+import sys
+import time
+
+import scanner
+import parser
+import arena
+import astfile
+import ast
+import regvm
+import resolver
+import sampler
+import vm
+evaluator = __import__('eval')
+
+
+# Functions with none, one and several parameters, for round trip checks.
+FUNCTIONS_PROGRAM = """
+let
+    var r: Integer;
+    func seven(): Integer
+        begin
+            return 7;
+        end
+    func twice(a: Integer): Integer
+        begin
+            return a * 2;
+        end
+    func abc(a: Integer, b: Integer, c: Integer): Integer
+        begin
+            return a + b + c;
+        end
+in
+    begin
+        r := twice(abc(1, 2, 3));
+        putint(r);
+    end
+"""
+
+# A function declared in another, reading its parameter.
+NESTED_PROGRAM = """
+let
+    var r: Integer;
+    func f(a: Integer): Integer
+        let
+            func g(b: Integer): Integer
+                begin
+                    return a + b;
+                end
+        in
+            begin
+                return g((a * 2));
+            end
+in
+    begin
+        r := f(5);
+        putint(r);
+    end
+"""
+
+
+def make_program(n):
+    """Return a synthetic Mini Triangle program with n commands."""
+
+    lines = ['! synthetic benchmark program',
+             'let',
+             '    var x: Integer;',
+             '    var y: Integer;',
+             '    var s: Integer;',
+             '    const c ~ 7;',
+             'in',
+             '    begin',
+             '        s := 0;']
+    for i in range(n):
+        k = i % 4
+        if k == 0:
+            lines.append('        x := %d;' % (i % 10))
+        elif k == 1:
+            lines.append('        y := x * 2 + c;')
+        elif k == 2:
+            lines.append('        if x > y then s := s + 1; else s := s - (x \\ 3);')
+        else:
+            lines.append('        while x > 0 do begin x := x - 1; end')
+    lines.append('        putint(s);')
+    lines.append('    end')
+    return '\n'.join(lines) + '\n'
+
+
+def best_of(func, repeat=3):
+    """Return the best wall clock time of repeat calls to func."""
+
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def token_tuples(tokens):
+    return [(t.type, t.val, t.pos) for t in tokens]
+
+
+def node_fields(node):
+    return [(name, getattr(node, name)) for name in ('pos', 'span') + node._fields]
+
+
+def tree_equal(tree1, tree2):
+    """Compare two ast trees without recursion, positions included."""
+
+    stack = [(tree1, tree2)]
+    while stack:
+        a, b = stack.pop()
+        if type(a) is not type(b):
+            return False
+        if type(a) is list:
+            if len(a) != len(b):
+                return False
+            stack.extend(zip(a, b))
+            continue
+        if not isinstance(a, ast.AST):
+            if a != b:
+                return False
+            continue
+        fields1 = node_fields(a)
+        fields2 = node_fields(b)
+        if [name for name, value in fields1] != [name for name, value in fields2]:
+            return False
+        stack.extend(zip([value for name, value in fields1],
+                         [value for name, value in fields2]))
+    return True
+
+
+def bench_scanner(n=20000):
+    """Compare the 'char' and 'regex' scanner engines on the same input."""
+
+    src = make_program(n)
+    print 'scanner: %d commands, %d chars' % (n, len(src))
+
+    tokens = {}
+    for engine in scanner.Scanner.engines:
+        tokens[engine] = scanner.Scanner(src, engine).scan()
+        t = best_of(lambda: scanner.Scanner(src, engine).scan())
+        print '  %-8s %8.3f s  %d tokens' % (engine, t, len(tokens[engine]))
+
+    if token_tuples(tokens['regex']) != token_tuples(tokens['char']):
+        print '  MISMATCH between scanner engines'
+
+
+class DictToken(object):
+    """Token laid out like scanner.Token before it had __slots__."""
+
+    def __init__(self, type, val, pos):
+        self.type = type
+        self.val = val
+        self.pos = pos
+
+
+def token_list_size(tokens):
+    """Return the bytes held by a list of token objects and their values.
+
+    Values shared between tokens, such as interned names, count once.
+    """
+
+    size = sys.getsizeof(tokens)
+    seen = set()
+    for t in tokens:
+        size += sys.getsizeof(t)
+        if hasattr(t, '__dict__'):
+            size += sys.getsizeof(t.__dict__)
+        if isinstance(t.val, str) and id(t.val) not in seen:
+            seen.add(id(t.val))
+            size += sys.getsizeof(t.val)
+    return size
+
+
+def bench_token_memory(n=20000):
+    """Compare the memory held by token lists and by a TokenBuffer."""
+
+    src = make_program(n)
+    tokens = scanner.Scanner(src).scan()
+    count = len(tokens)
+    print 'token memory: %d tokens (source text not counted)' % count
+
+    # Before interning every identifier token had its own copy of the name.
+    dict_tokens = [DictToken(t.type, t.val[:1] + t.val[1:] if isinstance(t.val, str) else t.val,
+                             t.pos)
+                   for t in tokens]
+    buf = scanner.Scanner(src).scan_buffer()
+    buf_size = (sys.getsizeof(buf) + sys.getsizeof(buf.types) +
+                sys.getsizeof(buf.starts) + sys.getsizeof(buf.ends) +
+                sys.getsizeof(buf.syms))
+
+    for name, size in [('dict Token', token_list_size(dict_tokens)),
+                       ('slots Token', token_list_size(tokens)),
+                       ('TokenBuffer', buf_size)]:
+        print '  %-12s %10d bytes  %6.1f bytes/token' % (name, size, float(size) / count)
+
+    t = best_of(lambda: scanner.Scanner(src).scan())
+    print '  scan()        %8.3f s' % t
+    t = best_of(lambda: scanner.Scanner(src).scan_buffer())
+    print '  scan_buffer() %8.3f s' % t
+
+    if token_tuples(buf) != token_tuples(tokens):
+        print '  MISMATCH between TokenBuffer and token list'
+
+
+def bench_rescan(n=20000, edits=200):
+    """Compare Scanner.rescan() on small edits with scanning from scratch."""
+
+    src = make_program(n)
+    s = scanner.Scanner(src)
+    tokens = s.scan()
+    print 'rescan: %d chars, %d tokens, %d edits' % (len(src), len(tokens), edits)
+
+    t = best_of(lambda: scanner.Scanner(s.input).scan())
+    print '  full scan   %10.6f s' % t
+
+    # Rename a variable back and forth near the start, in the middle and
+    # near the end of the text. The tokens after the edit are shifted,
+    # so the earlier the edit, the slower.
+    for label, at in [('start', 0), ('middle', len(src) // 2), ('end', len(src) - 200)]:
+        offset = s.input.index('y := x', at)
+        start = time.time()
+        for i in range(edits):
+            s.rescan(tokens, offset, 1, 'yz' if i % 2 == 0 else 'y')
+            s.rescan(tokens, offset, 2 if i % 2 == 0 else 1, 'y')
+        t = (time.time() - start) / (2 * edits)
+        print '  %-12s%10.6f s per edit' % ('edit ' + label, t)
+    t = best_of(lambda: scanner.shift_tokens(tokens, 0, 0))
+    print '  shift all   %10.6f s' % t
+
+    if token_tuples(tokens) != token_tuples(scanner.Scanner(s.input).scan()):
+        print '  MISMATCH between rescan and full scan'
+
+
+def bench_parser(n=20000):
+    """Compare predictive parsing with exception driven parsing."""
+
+    src = make_program(n)
+    tokens = scanner.Scanner(src).scan()
+    print 'parser: %d commands, %d tokens' % (n, len(tokens))
+
+    trees = {}
+    for predictive in [False, True]:
+        trees[predictive] = parser.Parser(tokens, predictive=predictive).parse()
+        t = best_of(lambda: parser.Parser(tokens, predictive=predictive).parse())
+        print '  %-12s %8.3f s' % (predictive and 'predictive' or 'backtracking', t)
+
+    if not tree_equal(trees[False], trees[True]):
+        print '  MISMATCH between parser modes'
+
+
+def bench_reparse(n=20000, edits=200):
+    """Compare IncrementalParser.edit() with scanning and parsing from scratch."""
+
+    src = make_program(n)
+    ip = parser.IncrementalParser(scanner.Scanner(src))
+    print 'reparse: %d commands, %d tokens, %d edits' % (n, len(ip.tokens), edits)
+
+    t = best_of(lambda: parser.Parser(scanner.Scanner(ip.scanner.input).scan()).parse())
+    print '  full parse  %10.6f s' % t
+
+    # Grow and shrink an expression in the middle of the text.
+    offset = ip.scanner.input.index('y := x', len(src) // 2) + len('y := ')
+    start = time.time()
+    for i in range(edits):
+        ip.edit(offset, 0, '1 + ')
+        ip.edit(offset, 4, '')
+    t = (time.time() - start) / (2 * edits)
+    print '  edit        %10.6f s per edit' % t
+
+    if not tree_equal(ip.tree, parser.Parser(scanner.Scanner(ip.scanner.input).scan()).parse()):
+        print '  MISMATCH between reparse and full parse'
+
+
+class DictNode(object):
+    """Node laid out like the ast classes before they had __slots__."""
+
+    def __init__(self, node):
+        for name, value in ast.iter_fields(node):
+            setattr(self, name, value)
+        self.pos = node.pos
+        self.span = node.span
+
+
+def iter_nodes(tree):
+    """Yield every node of tree, without recursion."""
+
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        yield node
+        for name, value in ast.iter_fields(node):
+            if type(value) is list:
+                stack.extend(value)
+            elif isinstance(value, ast.AST):
+                stack.append(value)
+
+
+def node_size(node):
+    size = sys.getsizeof(node)
+    if hasattr(node, '__dict__'):
+        size += sys.getsizeof(node.__dict__)
+    return size
+
+
+def bench_ast_memory(n=20000):
+    """Compare the memory held by __dict__ and __slots__ ast nodes."""
+
+    tree = parser.Parser(scanner.Scanner(make_program(n)).scan()).parse()
+    nodes = list(iter_nodes(tree))
+    # Lists and spans are the same in both layouts; names and values are shared.
+    shared = sum([sys.getsizeof(value) for node in nodes
+                  for name, value in ast.iter_fields(node) if type(value) is list])
+    shared += sum([sys.getsizeof(node.span) for node in nodes if node.span is not None])
+    print 'ast memory: %d commands, %d nodes' % (n, len(nodes))
+
+    for name, size in [('__dict__', sum([node_size(DictNode(node)) for node in nodes])),
+                       ('__slots__', sum([node_size(node) for node in nodes]))]:
+        print '  %-10s %10d bytes  %6.1f bytes/node  %10d bytes total' % (
+            name, size, float(size) / len(nodes), size + shared)
+
+
+def bench_arena(n=20000):
+    """Compare an arena.Arena with the ast tree it was built from."""
+
+    tree = parser.Parser(scanner.Scanner(make_program(n)).scan()).parse()
+    t = best_of(lambda: arena.Arena.from_ast(tree))
+    a = arena.Arena.from_ast(tree)
+    print 'arena: %d commands, %d nodes' % (n, len(a))
+    print '  from_ast     %8.3f s' % t
+    t = best_of(lambda: a.to_ast())
+    print '  to_ast       %8.3f s' % t
+
+    size = sum([sys.getsizeof(column) for column in
+                [a.kinds, a.values, a.positions, a.span_starts, a.span_stops, a.first,
+                 a.counts, a.children]])
+    print '  columns     %10d bytes  %6.1f bytes/node' % (size, float(size) / len(a))
+
+    # A whole program pass: count the uses of every variable.
+    def count_ast():
+        uses = {}
+        for node in iter_nodes(tree):
+            if type(node) is ast.Vname:
+                uses[node.identifier] = uses.get(node.identifier, 0) + 1
+        return uses
+
+    def count_arena():
+        uses = [0] * len(a.symbols)
+        vname = ast.Vname.kind
+        values = a.values
+        for h, kind in enumerate(a.kinds):
+            if kind == vname:
+                uses[values[h]] += 1
+        return dict([(a.symbols.names[sym], k) for sym, k in enumerate(uses) if k])
+
+    print '  ast walk     %8.3f s' % best_of(count_ast)
+    print '  arena scan   %8.3f s' % best_of(count_arena)
+    if count_ast() != count_arena():
+        print '  MISMATCH between ast and arena walks'
+
+    data = a.tostring()
+    print '  tostring     %8.3f s  %d bytes' % (best_of(a.tostring), len(data))
+    print '  fromstring   %8.3f s' % best_of(lambda: arena.Arena.fromstring(data))
+    if not tree_equal(tree, arena.Arena.fromstring(data).to_ast()):
+        print '  MISMATCH between parsed and arena trees'
+    tree = parser.Parser(scanner.Scanner(FUNCTIONS_PROGRAM).scan()).parse()
+    if not tree_equal(tree, arena.Arena.from_ast(tree).to_ast()):
+        print '  MISMATCH between parsed and arena trees with functions'
+
+
+def bench_hashcons(n=20000):
+    """Compare parsing with and without hash-consed expressions."""
+
+    tokens = scanner.Scanner(make_program(n)).scan()
+    print 'hashcons: %d commands' % n
+
+    trees = {}
+    for hashcons in [False, True]:
+        trees[hashcons] = parser.Parser(tokens, hashcons=hashcons).parse()
+        t = best_of(lambda: parser.Parser(tokens, hashcons=hashcons).parse())
+        nodes = dict([(id(node), node) for node in iter_nodes(trees[hashcons])]).values()
+        size = sum([node_size(node) for node in nodes])
+        print '  %-8s %8.3f s  %7d distinct nodes  %10d bytes' % (
+            hashcons and 'shared' or 'plain', t, len(nodes), size)
+
+    if str(trees[False]) != str(trees[True]):
+        print '  MISMATCH between plain and shared trees'
+
+    # Find every assignment of the expression 'x * 2 + c'.
+    def find_plain():
+        target = str(trees[False].command.command.commands[2].expression)
+        return len([cmd for cmd in trees[False].command.command.commands
+                    if type(cmd) is ast.AssignCommand and str(cmd.expression) == target])
+
+    def find_shared():
+        target = trees[True].command.command.commands[2].expression
+        return len([cmd for cmd in trees[True].command.command.commands
+                    if type(cmd) is ast.AssignCommand and cmd.expression is target])
+
+    print '  str ==     %8.3f s' % best_of(find_plain)
+    print '  is         %8.3f s' % best_of(find_shared)
+    if find_plain() != find_shared():
+        print '  MISMATCH between structural and identity equality'
+
+
+def bench_astfile(n=20000):
+    """Compare loading a tree from an ast file with scanning and parsing."""
+
+    src = make_program(n)
+    tree = parser.Parser(scanner.Scanner(src).scan()).parse()
+    data = astfile.dumps(tree)
+    print 'astfile: %d commands, %d chars source, %d bytes encoded' % (n, len(src), len(data))
+
+    t = best_of(lambda: parser.Parser(scanner.Scanner(src).iter_tokens()).parse())
+    print '  scan+parse   %8.3f s' % t
+    t = best_of(lambda: astfile.dumps(tree))
+    print '  dumps        %8.3f s' % t
+    t = best_of(lambda: astfile.loads(data))
+    print '  loads        %8.3f s' % t
+    pickled = cPickle.dumps(tree, 2)
+    t = best_of(lambda: cPickle.loads(pickled))
+    print '  cPickle      %8.3f s  %d bytes' % (t, len(pickled))
+
+    if not tree_equal(tree, astfile.loads(data)):
+        print '  MISMATCH between parsed and loaded trees'
+    tree = parser.Parser(scanner.Scanner(FUNCTIONS_PROGRAM).scan()).parse()
+    if not tree_equal(tree, astfile.loads(astfile.dumps(tree))):
+        print '  MISMATCH between parsed and loaded trees with functions'
+
+
+class ChainDispatch(object):
+    """Dispatch the way Evaluator did before it used ast.Visitor."""
+
+    def visit(self, tree):
+        if type(tree) is ast.LetCommand:
+            return self.handle(tree)
+        elif type(tree) is ast.BlockCommand:
+            return self.handle(tree)
+        elif type(tree) is ast.SequentialCommand:
+            return self.handle(tree)
+        elif type(tree) is ast.AssignCommand:
+            return self.handle(tree)
+        elif type(tree) is ast.CallCommand:
+            return self.handle(tree)
+        elif type(tree) is ast.WhileCommand:
+            return self.handle(tree)
+        elif type(tree) is ast.IfCommand:
+            return self.handle(tree)
+        elif type(tree) is ast.IntegerExpression:
+            return self.handle(tree)
+        elif type(tree) is ast.VnameExpression:
+            return self.handle(tree)
+        elif type(tree) is ast.UnaryExpression:
+            return self.handle(tree)
+        elif type(tree) is ast.BinaryExpression:
+            return self.handle(tree)
+        else:
+            return self.handle(tree)
+
+    def handle(self, tree):
+        pass
+
+
+class TableDispatch(ast.Visitor):
+
+    def __init__(self):
+        self.table = self.dispatch_table({}, self.handle)
+
+    def visit(self, tree):
+        return self.table[tree.kind](tree)
+
+    def handle(self, tree):
+        pass
+
+
+def bench_dispatch(n=20000):
+    """Compare type() chain dispatch with ast.Visitor table dispatch."""
+
+    tree = parser.Parser(scanner.Scanner(make_program(n)).scan()).parse()
+    nodes = list(iter_nodes(tree))
+    print 'dispatch: %d nodes' % len(nodes)
+
+    for name, visitor in [('type() chain', ChainDispatch()), ('kind table', TableDispatch())]:
+        visit = visitor.visit
+        t = best_of(lambda: [visit(node) for node in nodes])
+        print '  %-12s %8.3f s  %6.0f ns/node' % (name, t, t * 1e9 / len(nodes))
+
+    # Nodes late in the chain pay the most.
+    nodes = [node for node in nodes if type(node) is ast.BinaryExpression]
+    for name, visitor in [('type() chain', ChainDispatch()), ('kind table', TableDispatch())]:
+        visit = visitor.visit
+        t = best_of(lambda: [visit(node) for node in nodes])
+        print '  %-12s %8.3f s  %6.0f ns/BinaryExpression' % (name, t, t * 1e9 / len(nodes))
+
+    t = best_of(lambda: evaluator.Evaluator(tree).run(), 1)
+    print '  Evaluator    %8.3f s' % t
+
+
+def concat_str(node):
+    """The old recursive __str__: every node builds its own string."""
+
+    if not isinstance(node, ast.AST):
+        return str(node)
+    items = []
+    for name in node._fields:
+        value = getattr(node, name)
+        if type(value) is list:
+            items.extend([concat_str(item) for item in value])
+        else:
+            items.append(concat_str(value))
+    return type(node).__name__ + '(' + ','.join(items) + ')'
+
+
+def bench_dump(n=20000):
+    """Compare recursive string building with the streaming ast.dump()."""
+
+    tree = parser.Parser(scanner.Scanner(make_program(n)).scan()).parse()
+    print 'dump: %d commands, %d characters' % (n, len(str(tree)))
+
+    t = best_of(lambda: concat_str(tree))
+    print '  recursive    %8.3f s' % t
+    t = best_of(lambda: str(tree))
+    print '  dump         %8.3f s' % t
+    with open(os.devnull, 'w') as f:
+        t = best_of(lambda: ast.dump(tree, f, indent=2))
+    print '  dump indent  %8.3f s  to a file' % t
+    if concat_str(tree) != str(tree):
+        print '  MISMATCH between recursive and dump'
+
+    tree = parser.StackParser(scanner.Scanner(make_nested_program(n)).scan()).parse()
+    try:
+        concat_str(tree)
+    except RuntimeError:
+        print '  recursive    fails at nesting depth %d' % n
+    t = best_of(lambda: str(tree), 1)
+    print '  dump         %8.3f s  nesting depth %d' % (t, n)
+
+
+def make_arithmetic_program(limit, repeat):
+    """Return a program counting the primes below limit by trial division,
+    then computing 12! repeat times.
+    """
+
+    return """
+let
+    var n: Integer;
+    var d: Integer;
+    var count: Integer;
+    var prime: Integer;
+    var r: Integer;
+    var k: Integer;
+    var f: Integer;
+in
+    begin
+        count := 0;
+        n := 2;
+        while n < %d do
+            begin
+                prime := 1;
+                d := 2;
+                while d * d < n + 1 do
+                    begin
+                        if n \\ d = 0 then prime := 0; else prime := prime;
+                        d := d + 1;
+                    end
+                count := count + prime;
+                n := n + 1;
+            end
+        putint(count);
+        r := %d;
+        while r > 0 do
+            begin
+                f := 1;
+                k := 12;
+                while k > 0 do
+                    begin
+                        f := f * k;
+                        k := k - 1;
+                    end
+                r := r - 1;
+            end
+        putint(f);
+    end
+""" % (limit, repeat)
+
+
+class StringEvaluator(evaluator.Evaluator):
+    """The Evaluator as it was: literals kept as strings and operators
+    evaluated with eval() on the formatted expression.
+    """
+
+    def eval_integer_expression(self, tree):
+        return str(tree.value)
+
+    def eval_binary_expression(self, tree):
+        e1 = self.eval_expression(tree.expr1)
+        e2 = self.eval_expression(tree.expr2)
+        if tree.oper == '=':
+            return int(e1) == int(e2)
+        elif tree.oper == '\\':
+            return int(e1) % int(e2)
+        else:
+            return eval('%s %s %s' % (e1, tree.oper, e2))
+
+
+def bench_arithmetic(limit=5000, repeat=1000):
+    """Compare eval() on strings with operator table arithmetic."""
+
+    tree = parser.Parser(scanner.Scanner(make_arithmetic_program(limit, repeat)).scan()).parse()
+    print 'arithmetic: primes below %d, 12! %d times' % (limit, repeat)
+
+    for name, cls in [('eval()', StringEvaluator), ('operator', evaluator.Evaluator)]:
+        t = best_of(lambda: cls(tree).run(), 1)
+        print '  %-12s %8.3f s' % (name, t)
+
+
+def output_of(func, value=10):
+    """Return what func() prints, every getint reading value."""
+
+    saved = sys.stdout, __builtin__.input
+    sys.stdout = out = cStringIO.StringIO()
+    __builtin__.input = lambda: value
+    try:
+        func()
+    finally:
+        sys.stdout, __builtin__.input = saved
+    return out.getvalue()
+
+
+def bench_closures(n=20000, limit=5000, repeat=1000, fib_n=22, calls=100000):
+    """Compare the tree walking Evaluator with the ClosureEvaluator."""
+
+    checks = [('functions', FUNCTIONS_PROGRAM),
+              ('nested functions', NESTED_PROGRAM)] + sample_programs()
+    for label, program in checks:
+        tree = parser.Parser(scanner.Scanner(program).scan()).parse()
+        if (output_of(lambda: evaluator.Evaluator(tree).run()) !=
+            output_of(lambda: evaluator.ClosureEvaluator(tree).run())):
+            print 'closures: MISMATCH on %s' % label
+    print 'closures: output checked on %d programs' % len(checks)
+
+    programs = [('%d commands' % n, make_program(n)),
+                ('arithmetic', make_arithmetic_program(limit, repeat)),
+                ('calls', make_calls_program(fib_n, calls))]
+    for label, program in programs:
+        tree = parser.Parser(scanner.Scanner(program).scan()).parse()
+        print 'closures: %s' % label
+        t = best_of(lambda: evaluator.Evaluator(tree).run(), 1)
+        print '  Evaluator          %8.3f s' % t
+        t = best_of(lambda: evaluator.ClosureEvaluator(tree).compile(), 1)
+        print '  compile            %8.3f s' % t
+        t = best_of(lambda: evaluator.ClosureEvaluator(tree).run(), 1)
+        print '  ClosureEvaluator   %8.3f s  including compile' % t
+
+
+class DictEnvEvaluator(evaluator.Evaluator):
+    """The Evaluator as it was: a dict per let, searched innermost first
+    on every access, with [type, value] entries.
+    """
+
+    def run(self):
+        return self.eval_command(self.tree.command)
+
+    def lookup_env(self, name):
+        for e in self.env[::-1]:
+            if name in e:
+                return e[name]
+        raise NameError(name)
+
+    def eval_let_command(self, tree):
+        self.env.append({})
+        self.eval_declaration(tree.declaration)
+        self.eval_command(tree.command)
+        self.env.pop()
+
+    def eval_var_declaration(self, tree):
+        self.env[-1][tree.identifier] = [tree.type_denoter.identifier, None]
+
+    def eval_const_declaration(self, tree):
+        self.env[-1][tree.identifier] = ['Integer', self.eval_expression(tree.expression)]
+
+    def eval_assign_command(self, tree):
+        self.lookup_env(tree.variable.identifier)[1] = self.eval_expression(tree.expression)
+
+    def eval_vname_expression(self, tree):
+        return self.lookup_env(tree.variable.identifier)[1]
+
+
+def make_scopes_program(depth, n):
+    """Return a program looping n times in depth nested lets over
+    variables of the outermost one.
+    """
+
+    lines = ['let var i: Integer; var s: Integer; in begin i := %d; s := 0;' % n]
+    for d in range(depth):
+        lines.append('let var v%d: Integer; in begin v%d := %d;' % (d, d, d))
+    lines.append('while i > 0 do begin s := s + i; i := i - 1; end')
+    lines.append('end ' * depth)
+    lines.append('putint(s); end')
+    return '\n'.join(lines)
+
+
+def bench_scopes(depth=8, n=100000):
+    """Compare dict scope chains with resolved (depth, slot) frames."""
+
+    tree = parser.Parser(scanner.Scanner(make_scopes_program(depth, n)).scan()).parse()
+    print 'scopes: %d iterations %d lets deep' % (n, depth)
+
+    t = best_of(lambda: resolver.Resolver(tree).resolve())
+    print '  resolve      %8.3f s' % t
+    for name, cls in [('dict chain', DictEnvEvaluator), ('frames', evaluator.Evaluator)]:
+        t = best_of(lambda: cls(tree).run(), 1)
+        print '  %-12s %8.3f s' % (name, t)
+
+
+def fib(n):
+    a, b = 0, 1
+    for i in range(n):
+        a, b = b, a + b
+    return a
+
+
+def make_calls_program(n, repeat):
+    """Return a program computing fib(n) recursively, then calling
+    abc(1, 2, 3) repeat times as in test.mt.
+    """
+
+    return """
+let
+    var r: Integer;
+    var i: Integer;
+    func fib(k: Integer): Integer
+        begin
+            if k < 2 then return k; else return fib((k - 1)) + fib((k - 2));
+        end
+    func abc(a: Integer, b: Integer, c: Integer): Integer
+        begin
+            return a + b + c;
+        end
+in
+    begin
+        r := fib(%d);
+        putint(r);
+        i := 0;
+        r := 0;
+        while i < %d do
+            begin
+                r := r + abc(1, 2, 3);
+                i := i + 1;
+            end
+        putint(r);
+    end
+""" % (n, repeat)
+
+
+class FreshFrameEvaluator(evaluator.Evaluator):
+    """The Evaluator allocating a new parameter frame for every call."""
+
+    def call(self, decl, expr):
+        del self.pools[decl.index][:]
+        return evaluator.Evaluator.call(self, decl, expr)
+
+
+def bench_calls(n=22, repeat=100000):
+    """Compare function calls with pooled and freshly allocated frames."""
+
+    tree = parser.Parser(scanner.Scanner(make_calls_program(n, repeat)).scan()).parse()
+    calls = 2 * fib(n + 1) - 1 + repeat
+    print 'calls: fib(%d), abc(1, 2, 3) %d times, %d calls' % (n, repeat, calls)
+
+    for name, cls in [('fresh frames', FreshFrameEvaluator), ('pooled', evaluator.Evaluator)]:
+        t = best_of(lambda: cls(tree).run(), 1)
+        print '  %-12s %8.3f s  %6.0f ns/call' % (name, t, t * 1e9 / calls)
+
+
+def sample_programs():
+    """Return (label, program) of the eval.py samples and test.mt."""
+
+    programs = [('eval.py sample %d' % (i + 1), program)
+                for i, program in enumerate(evaluator.SAMPLES)]
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test.mt')) as f:
+        programs.append(('test.mt', f.read()))
+    return programs
+
+
+def run_quietly(func, runs, value=10):
+    """Return the seconds per run of runs calls to func, with putint
+    output discarded and every getint reading value.
+    """
+
+    saved = sys.stdout, __builtin__.input
+    with open(os.devnull, 'w') as f:
+        sys.stdout = f
+        __builtin__.input = lambda: value
+        try:
+            return best_of(lambda: [func() for i in xrange(runs)]) / runs
+        finally:
+            sys.stdout, __builtin__.input = saved
+
+
+def bench_vm(n=20000, limit=5000, repeat=1000, fib_n=22, calls=100000, runs=2000):
+    """Compare the Evaluator with the stack VM, compiling included.
+
+    The eval.py samples and test.mt are too small to time one run of,
+    so each is run runs times, reading 10 for getint.
+    """
+
+    for label, program in sample_programs():
+        tree = parser.Parser(scanner.Scanner(program).scan()).parse()
+        code = vm.Compiler(tree).compile()
+        print 'vm: %s, %d instructions' % (label, len(code.code) / 2)
+        t = run_quietly(lambda: evaluator.Evaluator(tree).run(), runs)
+        print '  Evaluator    %8.1f us' % (t * 1e6)
+        t = run_quietly(lambda: vm.VM(tree).run(), runs)
+        print '  VM           %8.1f us  including compile' % (t * 1e6)
+        t = run_quietly(lambda: vm.execute(code), runs)
+        print '  execute      %8.1f us' % (t * 1e6)
+
+    programs = [('%d commands' % n, make_program(n)),
+                ('arithmetic', make_arithmetic_program(limit, repeat)),
+                ('calls', make_calls_program(fib_n, calls))]
+    for label, program in programs:
+        tree = parser.Parser(scanner.Scanner(program).scan()).parse()
+        code = vm.Compiler(tree).compile()
+        print 'vm: %s, %d instructions, %d bytes serialized' % (
+            label, len(code.code) / 2, len(code.tostring()))
+        t = best_of(lambda: evaluator.Evaluator(tree).run(), 1)
+        print '  Evaluator    %8.3f s' % t
+        t = best_of(lambda: vm.Compiler(tree).compile(), 1)
+        print '  compile      %8.3f s' % t
+        t = best_of(lambda: vm.VM(tree).run(), 1)
+        print '  VM           %8.3f s' % t
+
+
+class CountingList(list):
+    """A list counting the items read from it by index, in self.reads."""
+
+    reads = 0
+
+    def __getitem__(self, i):
+        self.reads += 1
+        return list.__getitem__(self, i)
+
+
+class CountedCode(object):
+    """Stands in for a vm or regvm Code object, handing out its
+    instructions in a CountingList.
+    """
+
+    def __init__(self, code):
+        self.wrapped = code
+        self.counted = CountingList(code.instructions())
+
+    def instructions(self):
+        return self.counted
+
+    def __getattr__(self, name):
+        return getattr(self.wrapped, name)
+
+
+def count_instructions(module, code):
+    """Run code with module.execute() and return the number of
+    instructions it dispatched.
+    """
+
+    counted = CountedCode(code)
+    module.execute(counted)
+    return counted.counted.reads
+
+
+def make_statement_program(repeat):
+    """Return a program running s := x + y * z and a few like it repeat
+    times.
+    """
+
+    return """
+let
+    var s: Integer;
+    var x: Integer;
+    var y: Integer;
+    var z: Integer;
+    var i: Integer;
+in
+    begin
+        i := 0;
+        s := 0;
+        x := 3;
+        y := 5;
+        z := 7;
+        while i < %d do
+            begin
+                s := x + y * z;
+                x := s - x * 2 + y;
+                y := (x + z) \\ 1000;
+                i := i + 1;
+            end
+        putint(s);
+    end
+""" % repeat
+
+
+def bench_regvm(limit=5000, repeat=1000, fib_n=22, calls=100000):
+    """Compare instructions dispatched and run time of the stack and the
+    register VM, and the run time of the Evaluator.
+    """
+
+    programs = [('arithmetic', make_arithmetic_program(limit, repeat)),
+                ('calls', make_calls_program(fib_n, calls)),
+                ('statement', make_statement_program(repeat * 100))]
+    for label, program in programs:
+        tree = parser.Parser(scanner.Scanner(program).scan()).parse()
+        stack_code = vm.Compiler(tree).compile()
+        register_code = regvm.Compiler(tree).compile()
+        stack_count = count_instructions(vm, stack_code)
+        register_count = count_instructions(regvm, register_code)
+        print 'regvm: %s, %d / %d instructions, %d / %d dispatched (stack / register)' % (
+            label, len(stack_code.code) / 2, len(register_code.code) / 4,
+            stack_count, register_count)
+        t = best_of(lambda: evaluator.Evaluator(tree).run(), 1)
+        print '  Evaluator    %8.3f s' % t
+        t = best_of(lambda: vm.execute(stack_code), 1)
+        print '  stack VM     %8.3f s  %6.0f ns/instruction' % (t, t * 1e9 / stack_count)
+        t = best_of(lambda: regvm.execute(register_code), 1)
+        print '  register VM  %8.3f s  %6.0f ns/instruction' % (t, t * 1e9 / register_count)
+
+
+def bench_profile(limit=5000, repeat=1000, limit_rows=5):
+    """Time the Evaluator with and without profiling and show the top
+    of the profile report.
+    """
+
+    scanner_obj = scanner.Scanner(make_arithmetic_program(limit, repeat))
+    tree = parser.Parser(scanner_obj.scan()).parse()
+    t = best_of(lambda: evaluator.Evaluator(tree).run(), 1)
+    print 'profile: arithmetic'
+    print '  %-12s %8.3f s' % ('plain', t)
+    profiled = evaluator.Evaluator(tree, scanner_obj.lines, profile=True)
+    t = best_of(profiled.run, 1)
+    print '  %-12s %8.3f s' % ('profiled', t)
+    profiled.report(sys.stdout, limit_rows)
+
+
+def bench_sampler(limit=5000, repeat=1000, intervals=(0.01, 0.005, 0.001)):
+    """Time the Evaluator with and without the sampling profiler."""
+
+    scanner_obj = scanner.Scanner(make_arithmetic_program(limit, repeat))
+    tree = parser.Parser(scanner_obj.scan()).parse()
+    t = best_of(lambda: evaluator.Evaluator(tree).run(), 1)
+    print 'sampler: arithmetic'
+    print '  %-16s %8.3f s' % ('plain', t)
+    for interval in intervals:
+        sampler_obj = sampler.Sampler(scanner_obj.lines, interval=interval)
+        t = best_of(lambda: sampler_obj.run(evaluator.Evaluator(tree).run), 1)
+        print '  %-16s %8.3f s  %5d samples' % ('every %g s' % interval, t,
+                                               sum(sampler_obj.samples.itervalues()))
+
+
+def make_nested_program(depth):
+    """Return a program nesting begin, while and parentheses depth deep."""
+
+    return ('let var x: Integer; in ' + 'begin ' * depth + 'while x > 0 do ' * depth +
+            'x := ' + '(-' * depth + 'x' + ')' * depth + ';' + ' end' * depth)
+
+
+def bench_stack_parser(n=20000, depth=50000):
+    """Compare StackParser with the recursive Parser."""
+
+    tokens = scanner.Scanner(make_program(n)).scan()
+    print 'stack parser: %d commands, %d tokens' % (n, len(tokens))
+
+    t = best_of(lambda: parser.Parser(tokens).parse())
+    print '  Parser       %8.3f s' % t
+    t = best_of(lambda: parser.StackParser(tokens).parse())
+    print '  StackParser  %8.3f s' % t
+    if not tree_equal(parser.Parser(tokens).parse(), parser.StackParser(tokens).parse()):
+        print '  MISMATCH between Parser and StackParser'
+
+    tokens = scanner.Scanner(make_nested_program(depth)).scan()
+    t = best_of(lambda: parser.StackParser(tokens).parse(), 1)
+    print '  StackParser  %8.3f s  nesting depth %d' % (t, depth)
+
+
+def bench_flat_sequence(n=100000):
+    """Run a long flat command sequence through the Evaluator."""
+
+    tree = parser.Parser(scanner.Scanner(make_program(n)).scan()).parse()
+    print 'flat sequence: %d commands' % n
+
+    start = time.time()
+    evaluator.Evaluator(tree).run()
+    print '  Evaluator    %8.3f s' % (time.time() - start)
+
+
+BENCHMARKS = [('scanner', bench_scanner),
+              ('token-memory', bench_token_memory),
+              ('rescan', bench_rescan),
+              ('parser', bench_parser),
+              ('reparse', bench_reparse),
+              ('ast-memory', bench_ast_memory),
+              ('arena', bench_arena),
+              ('hashcons', bench_hashcons),
+              ('astfile', bench_astfile),
+              ('dispatch', bench_dispatch),
+              ('dump', bench_dump),
+              ('arithmetic', bench_arithmetic),
+              ('closures', bench_closures),
+              ('scopes', bench_scopes),
+              ('calls', bench_calls),
+              ('vm', bench_vm),
+              ('regvm', bench_regvm),
+              ('profile', bench_profile),
+              ('sampler', bench_sampler),
+              ('stack-parser', bench_stack_parser),
+              ('flat-sequence', bench_flat_sequence)]
+
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or [name for name, func in BENCHMARKS]
+    for name, func in BENCHMARKS:
+        if name in names:
+            print '=============='
+            func()
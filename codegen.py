@@ -7,6 +7,8 @@ import pprint
 import scanner
 import parser
 import ast
+import astfile
+import getopt
 import sys
 import os
 import struct
@@ -14,27 +16,70 @@ import time
 import marshal
 
 class CodeGenError(Exception):
-    """ Code Generator Error """
+    """ Code Generator Error
 
-    def __init__(self, ast):
+    lines: optional scanner.LineIndex used to report the line and column
+    of the ast node.
+    """
+
+    def __init__(self, ast, lines=None):
         self.ast = ast
+        self.lines = lines
 
     def __str__(self):
-        return 'Error at ast node: %s' % (str(self.ast))
-
-class CodeGen(object):
-
-    def __init__(self, tree):
+        msg = 'Error at ast node: %s' % (str(self.ast))
+        pos = getattr(self.ast, 'pos', None)
+        if self.lines is not None and pos is not None:
+            msg += ' (line %d, col %d)' % self.lines.lookup(pos)
+        return msg
+
+class CodeGen(ast.Visitor):
+    """ Generates Python bytecode for a program.
+
+        With a LineIndex, every command starts a new line number in the
+        generated code, its line in the source, and the code objects
+        carry filename, so tracebacks and profilers looking at Python
+        frames see Mini Triangle positions.
+    """
+
+    def __init__(self, tree, lines=None, filename='', firstlineno=1):
         self.tree = tree
+        self.lines = lines
+        self.filename = filename
+        # Line of the last SetLineno; line numbers in a code object can
+        # only grow.
+        self.lineno = firstlineno
         self.code = []
         self.env = {}
         self.args = []
         self.number = 0
 
+        self.commands = self.dispatch_table({
+            ast.IfCommand: self.gen_if_command,
+            ast.LetCommand: self.gen_let_command,
+            ast.CallCommand: self.gen_call_command,
+            ast.WhileCommand: self.gen_while_command,
+            ast.AssignCommand: self.gen_assign_command,
+            ast.BlockCommand: self.gen_block_command,
+            ast.SequentialCommand: self.gen_seq_command,
+            ast.ReturnCommand: self.gen_return_command}, self.gen_bad_node)
+        self.exprs = self.dispatch_table({
+            ast.VnameExpression: self.gen_vname_expr,
+            ast.IntegerExpression: self.gen_integer_expr,
+            ast.CallExpression: self.gen_call_expr,
+            ast.BlockArgrExpression: self.gen_block_argr_expr,
+            ast.ArgrExpression: self.gen_argr_expr,
+            ast.BinaryExpression: self.gen_binary_expr,
+            ast.UnaryExpression: self.gen_unary_expr}, self.gen_bad_node)
+        self.declarations = self.dispatch_table({
+            ast.BlockDeclaration: self.gen_block_declaration,
+            ast.SequentialDeclaration: self.gen_seq_declaration,
+            ast.FunctionDeclaration: self.gen_function_declaration}, self.gen_other_declaration)
+
     def generate(self):
 
         if type(self.tree) is not ast.Program:
-            raise CodeGenError(self.tree)
+            raise CodeGenError(self.tree, self.lines)
 
         self.gen_command(self.tree.command)
         self.code.append((LOAD_CONST, None))
@@ -42,174 +87,189 @@ class CodeGen(object):
 
         pprint.pprint(self.code)
 
-        code_obj = Code(self.code, [], [], False, False, False, 'gencode', '', 0, '')
+        code_obj = Code(self.code, [], [], False, False, False, 'gencode', self.filename, 1, '')
         code = code_obj.to_code()
         func = FunctionType(code, globals(), 'gencode')
         return func
 
-    def gen_command(self, tree):
-
-        if type(tree) is ast.IfCommand:
-            label1 = Label()
-            label2 = Label()
-            self.gen_expr(tree.expression)
-            self.code.append((POP_JUMP_IF_FALSE, label1))
-            self.gen_command(tree.command1)
-            self.code.append((JUMP_FORWARD,label2))
-            self.code.append((label1, None))
-            self.gen_command(tree.command2)
-            self.code.append((label2, None))
-
-        elif type(tree) is ast.LetCommand:
-            self.gen_declaration(tree.declaration)
-            self.gen_command(tree.command)
-
-        elif type(tree) is ast.CallCommand:
-
-            if tree.identifier == 'getint':
-                self.code.append((LOAD_GLOBAL, 'input'))
-                self.code.append((CALL_FUNCTION, 0))
-                self.code.append((STORE_FAST, tree.expression.variable.identifier))
-
-            elif tree.identifier == 'putint':
-#                self.code.append((LOAD_GLOBAL, 'print'))
-#                self.code.append((CALL_FUNCTION, 1))
-                self.gen_expr(tree.expression)
-                self.code.append((PRINT_ITEM, None))
-                self.code.append((PRINT_NEWLINE, None))
-            else:
-                self.code.append((LOAD_GLOBAL, tree.identifier))
-
-        elif type(tree) is ast.WhileCommand:
-            label3 = Label()
-            label4 = Label()
-            label5 = Label()
-            self.code.append((SETUP_LOOP, label5))
-            self.code.append((label3, None))
-            self.gen_expr(tree.expression)
-
-            self.code.append((POP_JUMP_IF_FALSE, label4))
-            self.gen_command(tree.command)
-            self.code.append((JUMP_ABSOLUTE, label3))
-            self.code.append((label4, None))
-            self.code.append((POP_BLOCK, None))
-            self.code.append((label5, None))
-
-        elif type(tree) is ast.AssignCommand:
-            self.gen_expr(tree.expression)
-            self.code.append((STORE_FAST, tree.variable.identifier))
+    def gen_bad_node(self, tree):
+        raise CodeGenError(tree, self.lines)
 
-        elif type(tree) is ast.SequentialCommand:
-            self.gen_command(tree.command1)
-            self.gen_command(tree.command2)
-
-        elif type(tree) is ast.ReturnCommand:
+    def gen_command(self, tree):
+        if self.lines is not None and tree.pos is not None:
+            line = self.lines.lookup(tree.pos)[0]
+            if line > self.lineno:
+                self.code.append((SetLineno, line))
+                self.lineno = line
+        self.commands[tree.kind](tree)
+
+    def gen_if_command(self, tree):
+        label1 = Label()
+        label2 = Label()
+        self.gen_expr(tree.expression)
+        self.code.append((POP_JUMP_IF_FALSE, label1))
+        self.gen_command(tree.command1)
+        self.code.append((JUMP_FORWARD,label2))
+        self.code.append((label1, None))
+        self.gen_command(tree.command2)
+        self.code.append((label2, None))
+
+    def gen_let_command(self, tree):
+        self.gen_declaration(tree.declaration)
+        self.gen_command(tree.command)
+
+    def gen_call_command(self, tree):
+
+        if tree.identifier == 'getint':
+            self.code.append((LOAD_GLOBAL, 'input'))
+            self.code.append((CALL_FUNCTION, 0))
+            self.code.append((STORE_FAST, tree.expression.variable.identifier))
+
+        elif tree.identifier == 'putint':
+#            self.code.append((LOAD_GLOBAL, 'print'))
+#            self.code.append((CALL_FUNCTION, 1))
             self.gen_expr(tree.expression)
-            self.code.append((RETURN_VALUE, None))
+            self.code.append((PRINT_ITEM, None))
+            self.code.append((PRINT_NEWLINE, None))
         else:
-            raise CodeGenError(tree)
+            self.code.append((LOAD_GLOBAL, tree.identifier))
+
+    def gen_while_command(self, tree):
+        label3 = Label()
+        label4 = Label()
+        label5 = Label()
+        self.code.append((SETUP_LOOP, label5))
+        self.code.append((label3, None))
+        self.gen_expr(tree.expression)
+
+        self.code.append((POP_JUMP_IF_FALSE, label4))
+        self.gen_command(tree.command)
+        self.code.append((JUMP_ABSOLUTE, label3))
+        self.code.append((label4, None))
+        self.code.append((POP_BLOCK, None))
+        self.code.append((label5, None))
+
+    def gen_assign_command(self, tree):
+        self.gen_expr(tree.expression)
+        self.code.append((STORE_FAST, tree.variable.identifier))
+
+    def gen_block_command(self, tree):
+        for cmd in tree.commands:
+            self.gen_command(cmd)
+
+    def gen_seq_command(self, tree):
+        self.gen_command(tree.command1)
+        self.gen_command(tree.command2)
+
+    def gen_return_command(self, tree):
+        self.gen_expr(tree.expression)
+        self.code.append((RETURN_VALUE, None))
 
     def gen_expr(self, tree):
+        self.exprs[tree.kind](tree)
 
-        if type(tree) is ast.VnameExpression:
-            self.code.append((LOAD_FAST, tree.variable.identifier))
+    def gen_vname_expr(self, tree):
+        self.code.append((LOAD_FAST, tree.variable.identifier))
 
-        elif type(tree) is ast.IntegerExpression:
-            self.code.append((LOAD_CONST, int(tree.value)))
-
-        elif type(tree) is ast.CallExpression:
-            self.code.append((LOAD_FAST, tree.identifier))
-            self.gen_expr(tree.expression)
-            self.code.append((CALL_FUNCTION, self.number))
-
-        elif type(tree) is ast.ArgrExpression:
-            self.number = 1
-            self.gen_expr(tree.argument1)
-            self.gen_expr(tree.argument2)
-            self.number += 1
-
-        elif type(tree) is ast.BinaryExpression:
-            self.gen_expr(tree.expr1)
-            self.gen_expr(tree.expr2)
-            op = tree.oper
-            if op == '+':
-                self.code.append((BINARY_ADD, None))
-            elif op == '-':
-                self.code.append((BINARY_SUBTRACT, None))
-            elif op == '*':
-                self.code.append((BINARY_MULTIPLY, None))
-            elif op == '/':
-                self.code.append((BINARY_DIVIDE, None))
-            elif op == '<':
-                self.code.append((COMPARE_OP, '<'))
-            elif op == '>':
-                self.code.append((COMPARE_OP, '>'))
-            elif op == '=':
-                self.code.append((COMPARE_OP, '=='))
-            elif op == '\\':
-                self.code.append((BINARY_MODULO, None))
-
-        elif type(tree) is ast.UnaryExpression:
-            self.gen_expr(tree.expr)
-            op = tree.oper
-            if op == '+':
-                self.code.append((BINARY_ADD, None))
-            elif op == '-':
-                self.code.append((BINARY_SUBTRACT, None))
-            elif op == '*':
-                self.code.append((BINARY_MULTIPLY, None))
-            elif op == '/':
-                self.code.append((BINARY_DIVIDE, None))
-            elif op == '<':
-                self.code.append((COMPARE_OP, '<'))
-            elif op == '>':
-                self.code.append((COMPARE_OP, '>'))
-            elif op == '=':
-                self.code.append((COMPARE_OP, '=='))
-            elif op == '\\':
-                self.code.append((BINARY_MODULO, None))
+    def gen_integer_expr(self, tree):
+        self.code.append((LOAD_CONST, tree.value))
 
+    def gen_call_expr(self, tree):
+        self.code.append((LOAD_FAST, tree.identifier))
+        self.gen_expr(tree.expression)
+        if type(tree.expression) is ast.BlockArgrExpression:
+            number = len(tree.expression.arguments)
+        elif type(tree.expression) is ast.ArgrExpression:
+            number = self.number
         else:
-            raise CodeGenError(tree)
+            number = 1
+        self.code.append((CALL_FUNCTION, number))
+
+    def gen_block_argr_expr(self, tree):
+        for argument in tree.arguments:
+            self.gen_expr(argument)
+
+    def gen_argr_expr(self, tree):
+        self.number = 1
+        self.gen_expr(tree.argument1)
+        self.gen_expr(tree.argument2)
+        self.number += 1
+
+    def gen_binary_expr(self, tree):
+        self.gen_expr(tree.expr1)
+        self.gen_expr(tree.expr2)
+        op = tree.oper
+        if op == '+':
+            self.code.append((BINARY_ADD, None))
+        elif op == '-':
+            self.code.append((BINARY_SUBTRACT, None))
+        elif op == '*':
+            self.code.append((BINARY_MULTIPLY, None))
+        elif op == '/':
+            self.code.append((BINARY_DIVIDE, None))
+        elif op == '<':
+            self.code.append((COMPARE_OP, '<'))
+        elif op == '>':
+            self.code.append((COMPARE_OP, '>'))
+        elif op == '=':
+            self.code.append((COMPARE_OP, '=='))
+        elif op == '\\':
+            self.code.append((BINARY_MODULO, None))
+
+    def gen_unary_expr(self, tree):
+        self.gen_expr(tree.expression)
+        op = tree.operator
+        if op == '-':
+            self.code.append((UNARY_NEGATIVE, None))
+        elif op == '+':
+            self.code.append((UNARY_POSITIVE, None))
+        else:
+            raise CodeGenError(tree, self.lines)
 
     def gen_arguments(self, tree):
         if type(tree) is ast.SingleArgr:
             self.args.append(tree.name)
+        elif type(tree) is ast.BlockArgr:
+            for argr in tree.argrs:
+                self.args.append(argr.name)
         elif type(tree) is ast.SequentialArgr:
             self.gen_arguments(tree.argr1)
             self.gen_arguments(tree.argr2)
 
     def gen_func(self, comm):
-        cg = CodeGen(comm.command)
+        firstlineno = 1
+        if self.lines is not None and comm.pos is not None:
+            firstlineno = self.lines.lookup(comm.pos)[0]
+        cg = CodeGen(comm.command, self.lines, self.filename, firstlineno)
         cg.gen_command(comm.command)
         self.args = []
         if comm.args != '':
             self.gen_arguments(comm.args)
-        code_obj = Code(cg.code, [], self.args, False, False, True, comm.name, '', 0, '')
+        code_obj = Code(cg.code, [], self.args, False, False, True, comm.name,
+                        self.filename, firstlineno, '')
         return code_obj
 
     def gen_declaration(self, tree):
-        if type(tree) is ast.ConstDeclaration:
-#            self.code.append((LOAD_FAST, tree.identifier))
-#            self.gen_expr(tree.expression)
-            pass
-
-        if type(tree) is ast.VarDeclaration:
-#            self.code.append((LOAD_FAST, tree.identifier))
-#            self.code.append((LOAD_FAST, tree.type_denoter))
-            pass
+        self.declarations[tree.kind](tree)
 
-        if type(tree) is ast.SequentialDeclaration:
-            self.gen_declaration(tree.decl1)
-            self.gen_declaration(tree.decl2)
+    def gen_other_declaration(self, tree):
+        # Constants and variables need no code, locals are created by
+        # their first assignment.
+        pass
 
+    def gen_block_declaration(self, tree):
+        for decl in tree.declarations:
+            self.gen_declaration(decl)
 
-        elif type(tree) is ast.FunctionDeclaration:
+    def gen_seq_declaration(self, tree):
+        self.gen_declaration(tree.decl1)
+        self.gen_declaration(tree.decl2)
 
-            func = self.gen_func(tree)
-            self.code.append((LOAD_CONST, func))
-            self.code.append((MAKE_FUNCTION, 0))
-            self.code.append((STORE_FAST, tree.name))
+    def gen_function_declaration(self, tree):
+        func = self.gen_func(tree)
+        self.code.append((LOAD_CONST, func))
+        self.code.append((MAKE_FUNCTION, 0))
+        self.code.append((STORE_FAST, tree.name))
 
 
 
@@ -227,35 +287,39 @@ def write_pyc_file(code, name):
 if __name__ == '__main__':
 
 
-    if len(sys.argv) < 2:
+    # Usage: python codegen.py [--no-cache] [--dump-tree] [--dump-depth=N] file.mt
+    opts, args = getopt.getopt(sys.argv[1:], '', ['no-cache', 'dump-tree', 'dump-depth='])
+    opts = dict(opts)
+    if len(args) < 1:
         print "============="
         exit(1)
-    fn = sys.argv[1]
+    fn = args[0]
 
     if not os.path.isfile(fn):
         print "input file not exist"
         exit(1)
-    fh = open(fn)
-    data = fh.read();
-    scan = scanner.Scanner(data)
 
     try:
-        tokens = scan.scan()
-        print tokens
+        tree, lines = astfile.parse_file(fn, cache='--no-cache' not in opts)
     except scanner.ScannerError as e:
         print e
-
-    parse = parser.Parser(tokens)
-
-    try:
-        tree = parse.parse()
-        print tree
+        exit(1)
     except parser.ParserError as e:
         print e
         print 'Not Parsed!'
+        exit(1)
+
+    if '--dump-tree' in opts or '--dump-depth' in opts:
+        depth = opts.get('--dump-depth')
+        ast.dump(tree, sys.stdout, indent=2, max_depth=depth and int(depth) or None)
+        print
 
-    cg = CodeGen(tree)
-    code = cg.generate()
+    cg = CodeGen(tree, lines, fn)
+    try:
+        code = cg.generate()
+    except CodeGenError as e:
+        print e
+        exit(1)
     print code()
     name = fn.split('.')[0]
     write_pyc_file(code, name)
\ No newline at end of file
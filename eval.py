@@ -1,114 +1,295 @@
 # calc_eval.py
 
+import gc
+import getopt
+import operator
 import sys
+import time
 
 import scanner
 import parser
 import ast
+import astfile
+import regvm
+import resolver
+import vm
+
+
+# Functions computing the Mini Triangle operators. Integer literals
+# are ints from the parser on, so operands never need converting. '/'
+# floors like Python 2 integer division, so -7 / 2 is -4, and '\'
+# takes the sign of the divisor.
+BINARY_OPERATORS = {'+' : operator.add,
+                    '-' : operator.sub,
+                    '*' : operator.mul,
+                    '/' : operator.div,
+                    '\\': operator.mod,
+                    '<' : operator.lt,
+                    '>' : operator.gt,
+                    '=' : operator.eq}
+
+UNARY_OPERATORS = {'-': operator.neg,
+                   '+': operator.pos}
+
+RETURN_KIND = ast.ReturnCommand.kind
 
 
 class EvalError(Exception):
-    """ Eval Error """
+    """ Eval Error
+
+    lines: optional scanner.LineIndex used to report the line and column
+    of the ast node.
+    """
 
-    def __init__(self, tree, expected):
+    def __init__(self, tree, expected, lines=None):
         self.tree = tree
         self.expected = expected
+        self.lines = lines
 
     def __str__(self):
-        return 'Error at ast node: %s expected: %s' % (str(self.tree), str(self.expected))
-
-class Evaluator(object):
-
-    def __init__(self, tree):
+        msg = 'Error at ast node: %s expected: %s' % (str(self.tree), str(self.expected))
+        pos = getattr(self.tree, 'pos', None)
+        if self.lines is not None and pos is not None:
+            msg += ' (line %d, col %d)' % self.lines.lookup(pos)
+        return msg
+
+class Evaluator(ast.Visitor):
+    """ Tree walking evaluator.
+
+        run() first gives every name its (depth, slot) address with
+        resolver.Resolver, so undeclared names are reported before the
+        program starts. self.env holds one fixed-size frame per active
+        let or function call, outermost first, and a name is read as
+        self.env[depth][slot].
+
+        A call puts the frame of the function's parameters at the
+        function's depth, setting aside the caller's frames from there
+        on until it returns. Parameter frames come from a pool per
+        function and go back to it after the call, so a call allocates
+        no frame once the pool holds as many as the deepest recursion
+        needed.
+
+        Commands return True after executing a return command, which
+        stores its value in self.result, so enclosing commands stop and
+        the call picks the value up.
+
+        profile: if true, every command and function call run is counted
+        and timed in self.stats, see profile_tables() and report().
+    """
+
+    def __init__(self, tree, lines=None, profile=False):
         self.tree = tree
+        self.lines = lines
         self.env = []
-
-    def add_env(self, name, type, value):
-        e = self.env[-1]
-        e[name] = [type, value]
-
-    def lookup_env(self, name):
-        for e in self.env[::-1]:
-            if name in e:
-                return e[name]
-        raise NameError(name)
-
-    def update_env(self, name, value):
-        for e in self.env[::-1]:
-            if name in e:
-                e[name][1] = value
-                return
-        raise NameError(name)
+        self.result = None
+        # Free parameter frames of each function, by index.
+        self.pools = []
+        # {node: [runs, total time, own time]} when profiling.
+        self.stats = None
+
+        self.commands = self.dispatch_table({
+            ast.LetCommand: self.eval_let_command,
+            ast.BlockCommand: self.eval_block_command,
+            ast.SequentialCommand: self.eval_seq_command,
+            ast.AssignCommand: self.eval_assign_command,
+            ast.CallCommand: self.eval_call_command,
+            ast.ReturnCommand: self.eval_return_command,
+            ast.WhileCommand: self.eval_while_command,
+            ast.IfCommand: self.eval_if_command}, self.eval_bad_command)
+        self.declarations = self.dispatch_table({
+            ast.VarDeclaration: self.eval_var_declaration,
+            ast.ConstDeclaration: self.eval_const_declaration,
+            ast.BlockDeclaration: self.eval_block_declaration,
+            ast.SequentialDeclaration: self.eval_seq_declaration}, self.eval_other_declaration)
+        self.expressions = self.dispatch_table({
+            ast.IntegerExpression: self.eval_integer_expression,
+            ast.VnameExpression: self.eval_vname_expression,
+            ast.CallExpression: self.eval_call_expression,
+            ast.UnaryExpression: self.eval_unary_expression,
+            ast.BinaryExpression: self.eval_binary_expression}, self.eval_bad_expression)
+        if profile:
+            self.profile_tables()
+
+    def profile_tables(self):
+        """Replace the command methods in the dispatch tables, and the
+        one for call expressions, with wrappers counting and timing
+        every node they run in self.stats.
+
+        Only the tables change, so an Evaluator that does not profile
+        dispatches exactly as before. A node's total time includes the
+        nodes it runs, its own time does not.
+        """
+
+        stats = self.stats = {}
+        # Total time of the nodes run so far by each active node,
+        # innermost last.
+        inner = [0.0]
+        timer = time.time
+
+        def wrap(method):
+            def profiled(tree):
+                inner.append(0.0)
+                start = timer()
+                try:
+                    return method(tree)
+                finally:
+                    elapsed = timer() - start
+                    own = elapsed - inner.pop()
+                    inner[-1] += elapsed
+                    stat = stats.get(tree)
+                    if stat is None:
+                        stats[tree] = [1, elapsed, own]
+                    else:
+                        stat[0] += 1
+                        stat[1] += elapsed
+                        stat[2] += own
+            return profiled
+
+        self.commands = map(wrap, self.commands)
+        self.expressions = list(self.expressions)
+        kind = ast.CallExpression.kind
+        self.expressions[kind] = wrap(self.expressions[kind])
+
+    def report(self, out=sys.stdout, limit=20):
+        """Write the limit nodes with the most own time in the last
+        profiled run to out, with their source positions.
+        """
+
+        roles = node_roles(self.tree)
+        out.write('%10s %10s %10s  %-9s %s\n' % ('runs', 'total s', 'own s', 'line:col', 'node'))
+        ranked = sorted(self.stats.iteritems(), key=lambda item: item[1][2], reverse=True)
+        for node, (runs, total, own) in ranked[:limit]:
+            pos = position(node)
+            if self.lines is not None and pos is not None:
+                where = '%d:%d' % self.lines.lookup(pos)
+            else:
+                where = '-'
+            out.write('%10d %10.4f %10.4f  %-9s %s\n' % (runs, total, own, where,
+                                                       roles.get(node) or describe(node)))
 
     def run(self):
         if type(self.tree) is not ast.Program:
-            raise EvalError(self.tree, ast.Program)
+            raise EvalError(self.tree, ast.Program, self.lines)
         if type(self.tree.command) is not ast.LetCommand:
-            raise EvalError(self.tree.command, ast.LetCommand)
+            raise EvalError(self.tree.command, ast.LetCommand, self.lines)
 
-        return self.eval_command(self.tree.command)
+        functions = resolver.Resolver(self.tree, self.lines).resolve_functions()
+        self.pools = [[] for decl in functions]
+        self.eval_command(self.tree.command)
 
-    def eval_command(self, tree):
+    def call(self, decl, expr):
+        """Call the function decl with the arguments in expr and return
+        its result, None if it ends without a return.
+        """
 
-        if type(tree) is ast.LetCommand:
-            return self.eval_let_command(tree)
-        elif type(tree) is ast.SequentialCommand:
-            return self.eval_seq_command(tree)
-        elif type(tree) is ast.AssignCommand:
-            return self.eval_assign_command(tree)
-        elif type(tree) is ast.CallCommand:
-            return self.eval_call_command(tree)
-        elif type(tree) is ast.WhileCommand:
-            return self.eval_while_command(tree)
-        elif type(tree) is ast.IfCommand:
-            return self.eval_if_command(tree)
+        pool = self.pools[decl.index]
+        if pool:
+            frame = pool.pop()
+        else:
+            frame = [None] * decl.size
+        if type(expr) is ast.BlockArgrExpression:
+            i = 0
+            for arg in expr.arguments:
+                frame[i] = self.eval_expression(arg)
+                i += 1
+        elif type(expr) is ast.ArgrExpression:
+            for i, arg in enumerate(resolver.arguments(expr)):
+                frame[i] = self.eval_expression(arg)
+        else:
+            frame[0] = self.eval_expression(expr)
+
+        # Frames from depth on belong to the caller. Usually there is
+        # exactly one, which is swapped without copying a slice.
+        env = self.env
+        depth = decl.depth
+        saved = None
+        if len(env) == depth + 1:
+            caller = env[depth]
+            env[depth] = frame
         else:
-            raise EvalError(tree, ast.Command)
+            saved = env[depth:]
+            del env[depth:]
+            env.append(frame)
+
+        body = decl.command
+        if body.kind == RETURN_KIND:
+            result = self.eval_expression(body.expression)
+        elif self.eval_command(body):
+            result = self.result
+        else:
+            result = None
+
+        if saved is None:
+            env[depth] = caller
+        else:
+            env[depth:] = saved
+        pool.append(frame)
+        return result
+
+    def eval_command(self, tree):
+        return self.commands[tree.kind](tree)
+
+    def eval_bad_command(self, tree):
+        raise EvalError(tree, ast.Command, self.lines)
 
     def eval_declaration(self, tree):
+        return self.declarations[tree.kind](tree)
 
-        if type(tree) is ast.VarDeclaration:
-            #self.env[tree.identifier] = [tree.type_denoter.identifier, None]
-            self.add_env(tree.identifier, tree.type_denoter.identifier, None)
-            return
+    def eval_var_declaration(self, tree):
+        # Frames start out as None.
+        pass
 
-        elif type(tree) is ast.ConstDeclaration:
-            #self.env[tree.identifier] = ['Integer', self.eval_expression(tree.expression)]
-            self.add_env(tree.identifier, 'Integer', self.eval_expression(tree.expression))
+    def eval_const_declaration(self, tree):
+        self.env[-1][tree.slot] = self.eval_expression(tree.expression)
 
+    def eval_block_declaration(self, tree):
+        for decl in tree.declarations:
+            self.eval_declaration(decl)
 
-        elif type(tree) is ast.SequentialDeclaration:
-            self.eval_declaration(tree.decl1)
-            self.eval_declaration(tree.decl2)
+    def eval_seq_declaration(self, tree):
+        self.eval_declaration(tree.decl1)
+        self.eval_declaration(tree.decl2)
+
+    def eval_other_declaration(self, tree):
+        pass
 
     def eval_let_command(self, tree):
-        self.env.append({})
+        self.env.append([None] * tree.size)
         self.eval_declaration(tree.declaration)
-        self.eval_command(tree.command)
+        returned = self.eval_command(tree.command)
         self.env.pop()
+        return returned
+
+    def eval_block_command(self, tree):
+        commands = self.commands
+        for cmd in tree.commands:
+            if commands[cmd.kind](cmd):
+                return True
 
     def eval_seq_command(self, tree):
-        self.eval_command(tree.command1)
-        self.eval_command(tree.command2)
+        return self.eval_command(tree.command1) or self.eval_command(tree.command2)
 
     def eval_assign_command(self, tree):
-        e1 = self.eval_expression(tree.expression)
-        #self.env[tree.variable.identifier][1] = e1
-        self.update_env(tree.variable.identifier, e1)
-
+        vname = tree.variable
+        self.env[vname.depth][vname.slot] = self.eval_expression(tree.expression)
 
     def eval_call_command(self, tree):
+        if tree.function is not None:
+            self.call(tree.function, tree.expression)
+            return
         e1 = self.eval_expression(tree.expression)
         func = tree.identifier
         if func == 'putint':
             print e1
         elif func == 'getint' and type(tree.expression) is ast.VnameExpression:
-            v = input()
-            name = tree.expression.variable.identifier
-            #self.env[name][1] = v
-            self.update_env(name, v)
+            vname = tree.expression.variable
+            self.env[vname.depth][vname.slot] = input()
         else:
-            raise EvalError(tree, 'putint')
+            raise EvalError(tree, 'putint', self.lines)
+
+    def eval_return_command(self, tree):
+        self.result = self.eval_expression(tree.expression)
+        return True
 
     def eval_while_command(self, tree):
         expr = tree.expression
@@ -118,7 +299,8 @@ class Evaluator(object):
             expr_val = self.eval_expression(expr)
             if not expr_val:
                 break
-            self.eval_command(cmd)
+            if self.eval_command(cmd):
+                return True
 
     def eval_if_command(self, tree):
         expr = tree.expression
@@ -128,117 +310,520 @@ class Evaluator(object):
         expr_val = self.eval_expression(expr)
 
         if expr_val:
-            self.eval_command(cmd1)
+            return self.eval_command(cmd1)
         else:
-            self.eval_command(cmd2)
+            return self.eval_command(cmd2)
 
     def eval_expression(self, tree):
+        return self.expressions[tree.kind](tree)
+
+    def eval_integer_expression(self, tree):
+        return tree.value
+
+    def eval_vname_expression(self, tree):
+        vname = tree.variable
+        return self.env[vname.depth][vname.slot]
+
+    def eval_call_expression(self, tree):
+        return self.call(tree.function, tree.expression)
+
+    def eval_unary_expression(self, tree):
+        func = UNARY_OPERATORS.get(tree.operator)
+        if func is None:
+            raise EvalError(tree, sorted(UNARY_OPERATORS), self.lines)
+        return func(self.eval_expression(tree.expression))
+
+    def eval_binary_expression(self, tree):
+        func = BINARY_OPERATORS.get(tree.oper)
+        if func is None:
+            raise EvalError(tree, sorted(BINARY_OPERATORS), self.lines)
+        return func(self.eval_expression(tree.expr1), self.eval_expression(tree.expr2))
+
+    def eval_bad_expression(self, tree):
+        raise EvalError(tree, [ast.IntegerExpression, ast.VnameExpression, ast.CallExpression,
+                               ast.UnaryExpression, ast.BinaryExpression], self.lines)
+
+
+def describe(node):
+    """Return a short description of the node for profile reports."""
+
+    if type(node) is ast.AssignCommand:
+        return 'assign %s' % node.variable.identifier
+    if type(node) in (ast.CallCommand, ast.CallExpression):
+        return 'call %s' % node.identifier
+    return type(node).__name__
+
+
+def node_roles(tree):
+    """Return {node: description} for the loop bodies, if branches and
+    function bodies of tree.
+    """
+
+    roles = {}
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if type(node) is ast.WhileCommand:
+            roles[node.command] = 'while body: %s' % describe(node.command)
+        elif type(node) is ast.IfCommand:
+            roles[node.command1] = 'then branch: %s' % describe(node.command1)
+            roles[node.command2] = 'else branch: %s' % describe(node.command2)
+        elif type(node) is ast.FunctionDeclaration:
+            roles[node.command] = 'body of %s: %s' % (node.name, describe(node.command))
+        for name in node._fields:
+            value = getattr(node, name)
+            if type(value) is list:
+                stack.extend(value)
+            elif isinstance(value, (ast.Command, ast.Declaration)):
+                stack.append(value)
+    return roles
+
+
+def position(node):
+    """Return the source position of node, or of its first descendant
+    that has one, or None.
+    """
+
+    while node is not None and node.pos is None:
+        children = []
+        for name in node._fields:
+            value = getattr(node, name)
+            if type(value) is list:
+                children.extend(value)
+            elif isinstance(value, ast.AST):
+                children.append(value)
+        node = children and children[0] or None
+    return node and node.pos
+
+
+class ClosureEvaluator(ast.Visitor):
+    """ Evaluator that compiles the tree into Python closures first.
+
+        compile() resolves the names with resolver.Resolver, then walks
+        the tree once and turns every node into a closure with
+        everything it needs bound ahead of time: its children's
+        closures, its operator function, and the index in self.values
+        of each variable it uses. Running the program is calling the
+        root closure, with no dispatch or field lookups left in loops.
+
+        Every let of the main program gets its own range of self.values
+        for its frame; it cannot be active twice at a time, so the range
+        can be fixed at compile time, and entering the let resets it.
+        A function call gets a fresh list holding its parameters and
+        the frames of the lets in its body, one range each, like the
+        locals of vm.Code. self.display[level] is the list of the latest
+        call at each level of function nesting, so a variable of a
+        function is read as display[level][index].
+
+        Command closures return True after running a return command,
+        which stores its value in self.result, so enclosing commands
+        stop and the call picks the value up. The errors the Evaluator
+        reports while running compile to closures that raise EvalError
+        when they are reached.
+    """
+
+    def __init__(self, tree, lines=None):
+        self.tree = tree
+        self.lines = lines
+        self.values = []
+        # (level, index of its first slot) of the frame of each
+        # enclosing let or function, by depth. Level 0 frames are in
+        # self.values, the others in the lists of their calls.
+        self.frames = []
+        self.display = [self.values]
+        self.result = [None]
+        # For the code being compiled: its level and the size of its
+        # call lists so far.
+        self.level = 0
+        self.nlocals = 0
+        # [body closure, call list size, level] of each function, by
+        # index, filled in as they are compiled.
+        self.functions = []
+
+        self.commands = self.dispatch_table({
+            ast.LetCommand: self.compile_let_command,
+            ast.BlockCommand: self.compile_block_command,
+            ast.SequentialCommand: self.compile_seq_command,
+            ast.AssignCommand: self.compile_assign_command,
+            ast.CallCommand: self.compile_call_command,
+            ast.ReturnCommand: self.compile_return_command,
+            ast.WhileCommand: self.compile_while_command,
+            ast.IfCommand: self.compile_if_command}, self.compile_bad_command)
+        self.declarations = self.dispatch_table({
+            ast.VarDeclaration: self.compile_var_declaration,
+            ast.ConstDeclaration: self.compile_const_declaration,
+            ast.BlockDeclaration: self.compile_block_declaration,
+            ast.SequentialDeclaration: self.compile_seq_declaration,
+            ast.FunctionDeclaration: self.compile_function_declaration},
+            self.compile_other_declaration)
+        self.expressions = self.dispatch_table({
+            ast.IntegerExpression: self.compile_integer_expression,
+            ast.VnameExpression: self.compile_vname_expression,
+            ast.CallExpression: self.compile_call_expression,
+            ast.UnaryExpression: self.compile_unary_expression,
+            ast.BinaryExpression: self.compile_binary_expression}, self.compile_bad_expression)
+
+    def compile(self):
+        """Return the closure running the program."""
 
-        if type(tree) is ast.IntegerExpression:
-            return tree.value
-        elif type(tree) is ast.VnameExpression:
-            #return self.env[tree.variable.identifier][1]
-            return self.lookup_env(tree.variable.identifier)[1]
-        elif type(tree) is ast.UnaryExpression:
-            if tree.operator == '-':
-                return -(self.eval_expression(tree.expression))
-            elif tree.operator == '+':
-                return self.eval_expression(tree.expression)
-            else:
-                raise EvalError(tree, ['-', '+'])
-        elif type(tree) is ast.BinaryExpression:
-            e1 = self.eval_expression(tree.expr1)
-            e2 = self.eval_expression(tree.expr2)
-            if tree.oper == '=':
-                return int(e1) == int(e2)
-            elif tree.oper == '\\':
-                return int(e1) % int(e2)
-            else:
-                val = eval('%s %s %s' % (e1, tree.oper, e2))
-                return val
-        else:
-            raise EvalError(tree, [ast.IntegerExpression, ast.VnameExpression,
-                                   ast.UnaryExpression, ast.BinaryExpression])
+        if type(self.tree) is not ast.Program:
+            raise EvalError(self.tree, ast.Program, self.lines)
+        if type(self.tree.command) is not ast.LetCommand:
+            raise EvalError(self.tree.command, ast.LetCommand, self.lines)
 
+        functions = resolver.Resolver(self.tree, self.lines).resolve_functions()
+        self.functions = [[None, 0, 0] for decl in functions]
 
-if __name__ == '__main__':
-    if len(sys.argv) > 1:
-        f = open(sys.argv[1], 'r')
-        prog = f.read()
-        f.close()
+        # Compiling allocates a few objects per node and no cycles; the
+        # collector would otherwise rescan the whole tree many times.
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return self.compile_command(self.tree.command)
+        finally:
+            if enabled:
+                gc.enable()
 
-        scanner_obj = scanner.Scanner(prog)
+    def run(self):
+        return self.compile()()
+
+    def address(self, depth, slot):
+        """Return (level, index) of the slot of frame depth."""
+
+        level, first = self.frames[depth]
+        return level, first + slot
+
+    def loader(self, depth, slot):
+        """Return a closure reading the slot of frame depth."""
+
+        level, index = self.address(depth, slot)
+        if level == 0:
+            values = self.values
+            return lambda: values[index]
+        display = self.display
+        return lambda: display[level][index]
+
+    def storer(self, depth, slot, expr):
+        """Return a closure storing the value of the closure expr in the
+        slot of frame depth.
+        """
+
+        level, index = self.address(depth, slot)
+        if level == 0:
+            values = self.values
+            def run():
+                values[index] = expr()
+            return run
+        display = self.display
+        def run():
+            display[level][index] = expr()
+        return run
+
+    def raises(self, error):
+        def run():
+            raise error
+        return run
+
+    def compile_command(self, tree):
+        return self.commands[tree.kind](tree)
+
+    def compile_bad_command(self, tree):
+        return self.raises(EvalError(tree, ast.Command, self.lines))
+
+    def compile_declaration(self, tree):
+        return self.declarations[tree.kind](tree)
+
+    def compile_var_declaration(self, tree):
+        return self.storer(len(self.frames) - 1, tree.slot, lambda: None)
+
+    def compile_const_declaration(self, tree):
+        expr = self.compile_expression(tree.expression)
+        return self.storer(len(self.frames) - 1, tree.slot, expr)
+
+    def compile_block_declaration(self, tree):
+        return self.sequence([self.compile_declaration(decl) for decl in tree.declarations])
+
+    def compile_seq_declaration(self, tree):
+        decl1 = self.compile_declaration(tree.decl1)
+        return self.sequence([decl1, self.compile_declaration(tree.decl2)])
+
+    def compile_other_declaration(self, tree):
+        def run():
+            pass
+        return run
+
+    def compile_function_declaration(self, tree):
+        # The body is compiled here, with the frames the declaration
+        # sees; calls find it through self.functions, so it may call
+        # itself.
+        function = self.functions[tree.index]
+        saved = self.frames, self.level, self.nlocals
+        self.level = function[2] = self.level + 1
+        self.frames = self.frames + [(self.level, 0)]
+        self.nlocals = tree.size
+        function[0] = self.compile_command(tree.command)
+        function[1] = self.nlocals
+        self.frames, self.level, self.nlocals = saved
+        return self.compile_other_declaration(tree)
+
+    def sequence(self, closures):
+        """Return a closure calling closures in order until one returns."""
+
+        closures = tuple(closures)
+        if len(closures) == 1:
+            return closures[0]
+        def run():
+            for closure in closures:
+                if closure():
+                    return True
+        return run
+
+    def compile_let_command(self, tree):
+        if self.level == 0:
+            self.frames.append((0, len(self.values)))
+            self.values.extend([None] * tree.size)
+        else:
+            self.frames.append((self.level, self.nlocals))
+            self.nlocals += tree.size
+        decl = self.compile_declaration(tree.declaration)
+        cmd = self.compile_command(tree.command)
+        self.frames.pop()
+        def run():
+            decl()
+            return cmd()
+        return run
+
+    def compile_block_command(self, tree):
+        return self.sequence([self.compile_command(cmd) for cmd in tree.commands])
+
+    def compile_seq_command(self, tree):
+        cmd1 = self.compile_command(tree.command1)
+        return self.sequence([cmd1, self.compile_command(tree.command2)])
+
+    def compile_assign_command(self, tree):
+        vname = tree.variable
+        return self.storer(vname.depth, vname.slot, self.compile_expression(tree.expression))
+
+    def compile_call_command(self, tree):
+        if tree.function is not None:
+            call = self.compile_call(tree)
+            def run():
+                call()
+            return run
+        expr = self.compile_expression(tree.expression)
+        func = tree.identifier
+        if func == 'putint':
+            def run():
+                print expr()
+            return run
+        elif func == 'getint' and type(tree.expression) is ast.VnameExpression:
+            vname = tree.expression.variable
+            return self.storer(vname.depth, vname.slot, input)
+        else:
+            error = EvalError(tree, 'putint', self.lines)
+            def run():
+                expr()
+                raise error
+            return run
+
+    def compile_return_command(self, tree):
+        result = self.result
+        expr = self.compile_expression(tree.expression)
+        def run():
+            result[0] = expr()
+            return True
+        return run
+
+    def compile_while_command(self, tree):
+        expr = self.compile_expression(tree.expression)
+        cmd = self.compile_command(tree.command)
+        def run():
+            while expr():
+                if cmd():
+                    return True
+        return run
+
+    def compile_if_command(self, tree):
+        expr = self.compile_expression(tree.expression)
+        cmd1 = self.compile_command(tree.command1)
+        cmd2 = self.compile_command(tree.command2)
+        def run():
+            if expr():
+                return cmd1()
+            return cmd2()
+        return run
+
+    def compile_expression(self, tree):
+        return self.expressions[tree.kind](tree)
+
+    def compile_integer_expression(self, tree):
+        value = tree.value
+        return lambda: value
+
+    def compile_vname_expression(self, tree):
+        vname = tree.variable
+        return self.loader(vname.depth, vname.slot)
+
+    def compile_call(self, tree):
+        """Return a closure calling the function tree calls and
+        returning its result, None if it ends without a return.
+        """
+
+        function = self.functions[tree.function.index]
+        args = tuple([self.compile_expression(arg)
+                      for arg in resolver.arguments(tree.expression)])
+        nargs = len(args)
+        level = function[2]
+        display = self.display
+        result = self.result
+        while len(display) <= level:
+            display.append(None)
+        def run():
+            frame = [arg() for arg in args]
+            frame.extend([None] * (function[1] - nargs))
+            # The caller's list at this level, if any, is set aside
+            # until the call returns.
+            saved = display[level]
+            display[level] = frame
+            if function[0]():
+                value = result[0]
+            else:
+                value = None
+            display[level] = saved
+            return value
+        return run
+
+    def compile_call_expression(self, tree):
+        return self.compile_call(tree)
+
+    def compile_unary_expression(self, tree):
+        func = UNARY_OPERATORS.get(tree.operator)
+        if func is None:
+            return self.raises(EvalError(tree, sorted(UNARY_OPERATORS), self.lines))
+        expr = self.compile_expression(tree.expression)
+        return lambda: func(expr())
+
+    def compile_binary_expression(self, tree):
+        func = BINARY_OPERATORS.get(tree.oper)
+        if func is None:
+            return self.raises(EvalError(tree, sorted(BINARY_OPERATORS), self.lines))
+        expr1 = self.compile_expression(tree.expr1)
+        expr2 = tree.expr2
+        # Literal right operands, as in x - 1, are bound as values.
+        if type(expr2) is ast.IntegerExpression:
+            value = expr2.value
+            return lambda: func(expr1(), value)
+        expr2 = self.compile_expression(expr2)
+        return lambda: func(expr1(), expr2())
+
+    def compile_bad_expression(self, tree):
+        return self.raises(EvalError(tree, [ast.IntegerExpression, ast.VnameExpression,
+                                            ast.CallExpression, ast.UnaryExpression,
+                                            ast.BinaryExpression], self.lines))
+
+
+# Sample programs run when no file is given; getint reads stdin.
+SAMPLES = ["""let
+                var x: Integer;
+                var y: Integer;
+                var z: Integer;
+              in
+                begin
+                  getint(x);
+                  y := 2;
+                  z := x + y;
+                  putint(z);
+                end
+           """,
+           """! Factorial
+              let var x: Integer;
+                  var fact: Integer;
+              in
+                begin
+                  getint(x);
+                  if x = 0 then
+                     putint(1);
+                  else
+                    begin
+                      fact := 1;
+                      while x > 0 do
+                        begin
+                          fact := fact * x;
+                          x := x - 1;
+                        end
+                      putint(fact);
+                    end
+                end
+           """,
+           """
+           let
+             var x: Integer;
+             const c ~ 7;
+           in
+             begin
+               x := 1;
+               let
+                 var x: Integer;
+               in
+                 begin
+                   x := c;
+                   putint(x);
+                 end
+               putint(x);
+             end
+           """]
+
+
+# Engines selectable with --engine on the command line.
+ENGINES = {'tree': Evaluator,
+           'closure': ClosureEvaluator,
+           'vm': vm.VM,
+           'regvm': regvm.VM}
 
+if __name__ == '__main__':
+    # Usage: python eval.py [--no-cache] [--dump-tree] [--dump-depth=N]
+    #                       [--engine=tree|closure|vm|regvm] [--profile] file.mt
+    opts, args = getopt.getopt(sys.argv[1:], '', ['no-cache', 'dump-tree', 'dump-depth=',
+                                                  'engine=', 'profile'])
+    opts = dict(opts)
+    engine = opts.get('--engine', 'tree')
+    if engine not in ENGINES:
+        print 'Unknown engine %s, expected one of %s' % (engine, ', '.join(sorted(ENGINES)))
+        sys.exit(2)
+    if '--profile' in opts and engine != 'tree':
+        print '--profile needs the tree engine'
+        sys.exit(2)
+    if args:
         try:
-            tokens = scanner_obj.scan()
+            tree, lines = astfile.parse_file(args[0], cache='--no-cache' not in opts)
         except scanner.ScannerError as e:
             print e
-            sys.exit()
-
-        parser_obj = parser.Parser(tokens)
-
-        try:
-            tree = parser_obj.parse()
+            sys.exit(1)
         except parser.ParserError as e:
             print e
             print 'Not Parsed!'
-            sys.exit()
+            sys.exit(1)
 
-        evaluator_obj = Evaluator(tree)
-        evaluator_obj.run()
-        sys.exit()
-
-    progs = [ """let
-                   var x: Integer;
-                   var y: Integer;
-                   var z: Integer
-                 in
-                   begin
-                     getint(x);
-                     y := 2;
-                     z := x + y;
-                     putint(z)
-                   end
-              """,
-              """! Factorial
-                 let var x: Integer;
-                     var fact: Integer
-                 in
-                   begin
-                     getint(x);
-                     if x = 0 then
-                        putint(1)
-                     else
-                       begin
-                         fact := 1;
-                         while x > 0 do
-                           begin
-                             fact := fact * x;
-                             x := x - 1
-                           end;
-                         putint(fact)
-                       end
-                   end
-              """,
-              """
-              let
-                var x: Integer;
-                const c ~ 7
-              in
-                begin
-                  x := 1;
-                  let
-                    var x: Integer
-                  in
-                    begin
-                      x := c;
-                      putint(x)
-                    end;
-                  putint(x)
-                end
-              """]
+        if '--dump-tree' in opts or '--dump-depth' in opts:
+            depth = opts.get('--dump-depth')
+            ast.dump(tree, sys.stdout, indent=2, max_depth=depth and int(depth) or None)
+            print
+
+        if '--profile' in opts:
+            evaluator_obj = Evaluator(tree, lines, profile=True)
+        else:
+            evaluator_obj = ENGINES[engine](tree, lines)
+        status = 0
+        try:
+            evaluator_obj.run()
+        except (EvalError, resolver.ResolveError, vm.VMError) as e:
+            print e
+            status = 1
+        if '--profile' in opts:
+            evaluator_obj.report()
+        sys.exit(status)
 
-    for prog in progs:
+    for prog in SAMPLES:
         print '=============='
         print prog
 
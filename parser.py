@@ -2,22 +2,71 @@
 #
 # Scanner for a calculator interpreter
 
+import collections
+import sys
+import types
+
 import scanner as scanner
 import ast as ast
 
 
+# FIRST and FOLLOW sets of the grammar, used by the predictive parser to
+# decide where a sequence of commands or declarations ends.
+
+FIRST_SINGLE_COMMAND = frozenset([scanner.TK_IDENTIFIER, scanner.TK_IF,
+                                  scanner.TK_WHILE, scanner.TK_LET,
+                                  scanner.TK_BEGIN, scanner.TK_RETURN])
+
+FIRST_SINGLE_DECLARATION = frozenset([scanner.TK_CONST, scanner.TK_VAR,
+                                      scanner.TK_FUNCDEF])
+
+FOLLOW_COMMAND = frozenset([scanner.TK_END, scanner.TK_EOT])
+
+FOLLOW_DECLARATION = frozenset([scanner.TK_IN])
+
+
+# Binary operators with their precedence (higher binds tighter) and
+# associativity. New operators only need an entry here.
+
+LEFT = 0
+RIGHT = 1
+
+BINARY_OPERATORS = {'<' : (1, LEFT),
+                    '=' : (1, LEFT),
+                    '>' : (1, LEFT),
+                    '+' : (2, LEFT),
+                    '-' : (2, LEFT),
+                    '*' : (3, LEFT),
+                    '/' : (3, LEFT),
+                    '\\': (3, LEFT)}
+
+
+def make_block(cls, items):
+    """Return the only node of items, or a list-backed cls node of them."""
+
+    if len(items) == 1:
+        return items[0]
+    return cls(items)
+
+
 class ParserError(Exception):
     """Parser error exception.
 
     pos: position in the input token stream where the error occurred.
     type: bad token type
+    lines: optional scanner.LineIndex used to report the line and column.
     """
 
-    def __init__(self, pos, type):
+    def __init__(self, pos, type, lines=None):
         self.pos = pos
         self.type = type
+        self.lines = lines
 
     def __str__(self):
+        if self.lines is not None:
+            line, col = self.lines.lookup(self.pos)
+            return '(Found bad token %s at %d, line %d, col %d)' % (scanner.TOKENS[self.type],
+                                                                  self.pos, line, col)
         return '(Found bad token %s at %d)' % (scanner.TOKENS[self.type], self.pos)
 
 
@@ -60,14 +109,37 @@ class Parser(object):
     Comment            ::=  ! Graphic* <eol>
     """
 
-    def __init__(self, tokens):
-        self.tokens = tokens
+    def __init__(self, tokens, lines=None, predictive=True, hashcons=False):
+        # tokens may be a list or any iterable ending with TK_EOT, such as
+        # Scanner.iter_tokens(). Tokens are pulled on demand and only a
+        # bounded lookahead window is kept around.
+        # lines is the scanner.LineIndex of the source, for error messages.
+        # predictive selects LL(1) decisions on the current token; when it
+        # is false, sequences end at the first single-Command or
+        # single-Declaration that fails to parse, as they used to.
+        # hashcons shares structurally identical expressions, see
+        # ast.HashConsTable; the table is kept in self.expressions.
+        self.tokens = iter(tokens)
+        self.lines = lines
+        self.predictive = predictive
+        self.expressions = None
+        if hashcons:
+            self.expressions = ast.HashConsTable()
+        self.window = collections.deque()
         self.curindex = 0
-        self.curtoken = tokens[0]
+        self.prevtoken = None
+        self.curtoken = next(self.tokens)
 
     def parse(self):
         return self.parse_program()
 
+    def share(self, expr):
+        """Return the shared node equal to expr when hash-consing."""
+
+        if self.expressions is None:
+            return expr
+        return self.expressions.intern(expr)
+
     def parse_program(self):
         """ Program ::=  Command EOT """
 
@@ -78,7 +150,15 @@ class Parser(object):
     def parse_command(self):
         """ Command ::=  single-Command (';' single-Command)*  """
 
-        sc1 = self.parse_single_command()
+        commands = [self.parse_single_command()]
+
+        if self.predictive:
+            while self.curtoken.type in FIRST_SINGLE_COMMAND:
+                commands.append(self.parse_single_command())
+            if self.curtoken.type not in FOLLOW_COMMAND:
+                raise ParserError(self.curtoken.pos, self.curtoken.type, self.lines)
+            return make_block(ast.BlockCommand, commands)
+
         t = True
         while t:
             try:
@@ -86,8 +166,8 @@ class Parser(object):
             except Exception, e:
                 t = False
             if t:
-                sc1 = ast.SequentialCommand(sc1, sc2)
-        return sc1
+                commands.append(sc2)
+        return make_block(ast.BlockCommand, commands)
 
     def parse_single_command(self):
         """single-Command ::=  Identifier ( ':=' Expression | '(' Expression ')')
@@ -99,6 +179,7 @@ class Parser(object):
                            |   return Expression
         """
 
+        start = self.curindex
         token = self.token_current()
 
         if token.type == scanner.TK_IDENTIFIER:
@@ -107,12 +188,16 @@ class Parser(object):
             if token_next.type == scanner.TK_BECOMES:
                 self.token_accept_any()
                 expr = self.parse_expression()
-                cmd = ast.AssignCommand(ast.Vname(token.val), expr)
+                vname = ast.Vname(token.val)
+                vname.pos = token.pos
+                cmd = ast.AssignCommand(self.share(vname), expr)
             elif token_next.type == scanner.TK_LPAREN:
                 self.token_accept_any()
                 expr = self.parse_arg_expr()
                 self.token_accept(scanner.TK_RPAREN)
                 cmd = ast.CallCommand(token.val, expr)
+            else:
+                raise ParserError(token_next.pos, token_next.type, self.lines)
             self.token_accept(scanner.TK_SEMICOLON)
         elif token.type == scanner.TK_IF:
             self.token_accept_any()
@@ -144,44 +229,37 @@ class Parser(object):
             cmd = ast.ReturnCommand(expr)
             self.token_accept(scanner.TK_SEMICOLON)
         else:
-            raise ParserError(self.curtoken.pos, self.curtoken.type)
-        return cmd
+            raise ParserError(self.curtoken.pos, self.curtoken.type, self.lines)
 
-    def parse_expression(self):
-        """ Expression ::=  primary-Expression (Operator primary-Expression)* """
-
-        e1 = self.parse_add_expression()
-        token = self.token_current()
-        while token.type == scanner.TK_OPERATOR and token.val in ['<','=','>']:
-            oper = token.val
-            self.token_accept_any()
-            e2 = self.parse_add_expression()
-            token = self.token_current()
-            e1 = ast.BinaryExpression(e1, oper, e2)
-        return e1
+        # begin ... end has no node of its own, keep the inner position.
+        if token.type != scanner.TK_BEGIN:
+            cmd.pos = token.pos
+        cmd.span = (start, self.curindex)
+        return cmd
 
-    def parse_add_expression(self):
-        e1 = self.parse_mul_expression()
-        token = self.token_current()
+    def parse_expression(self, min_prec=1):
+        """ Expression ::=  primary-Expression (Operator primary-Expression)*
 
-        while token.type == scanner.TK_OPERATOR and token.val in ['+','-']:
-            oper = token.val
-            self.token_accept_any()
-            e2 = self.parse_mul_expression()
-            token = self.token_current()
-            e1 = ast.BinaryExpression(e1, oper, e2)
-        return e1
+        Operator precedence is resolved by precedence climbing over
+        BINARY_OPERATORS; only operators with a precedence of at least
+        min_prec are consumed by this call.
+        """
 
-    def parse_mul_expression(self):
         e1 = self.parse_primary_expression()
-        token = self.token_current()
-
-        while token.type == scanner.TK_OPERATOR and token.val in ['*','/','\\']:
-            oper = token.val
+        token = self.curtoken
+        while token.type == scanner.TK_OPERATOR:
+            prec, assoc = BINARY_OPERATORS[token.val]
+            if prec < min_prec:
+                break
             self.token_accept_any()
-            e2 = self.parse_primary_expression()
-            token = self.token_current()
-            e1 = ast.BinaryExpression(e1, oper, e2)
+            if assoc == LEFT:
+                e2 = self.parse_expression(prec + 1)
+            else:
+                e2 = self.parse_expression(prec)
+            e1 = ast.BinaryExpression(e1, token.val, e2)
+            e1.pos = token.pos
+            e1 = self.share(e1)
+            token = self.curtoken
         return e1
 
     def parse_primary_expression(self):
@@ -195,7 +273,9 @@ class Parser(object):
         if token.type == scanner.TK_INTLITERAL:
 
             self.token_accept_any()
-            expr = ast.IntegerExpression(token.val)
+            expr = ast.IntegerExpression(int(token.val))
+            expr.pos = token.pos
+            expr = self.share(expr)
 
         elif token.type == scanner.TK_IDENTIFIER:
             self.token_accept_any()
@@ -207,35 +287,50 @@ class Parser(object):
                 self.token_accept(scanner.TK_RPAREN)
                 expr = ast.CallExpression(ident, expr)
             else:
-                expr = ast.VnameExpression(ast.Vname(token.val))
+                vname = ast.Vname(token.val)
+                vname.pos = token.pos
+                expr = ast.VnameExpression(self.share(vname))
+            expr.pos = token.pos
+            expr = self.share(expr)
         elif token.type == scanner.TK_OPERATOR:
             oper = token.val
             self.token_accept_any()
             expr = self.parse_primary_expression()
             expr = ast.UnaryExpression(oper, expr)
+            expr.pos = token.pos
+            expr = self.share(expr)
         elif token.type == scanner.TK_LPAREN:
             self.token_accept_any()
             expr = self.parse_expression()
             self.token_accept(scanner.TK_RPAREN)
             return expr
         else:
-            raise ParserError(self.curtoken.pos, self.curtoken.type)
+            raise ParserError(self.curtoken.pos, self.curtoken.type, self.lines)
 
         return expr
 
     def parse_arg_expr(self):
-        are1 = self.parse_primary_expression()
+        arguments = [self.parse_primary_expression()]
         while self.token_current().type == scanner.TK_COMMA:
             self.token_accept_any()
-            are2 = self.parse_primary_expression()
-            are1 = ast.ArgrExpression(are1, are2)
-        return are1
+            arguments.append(self.parse_primary_expression())
+        return self.share(make_block(ast.BlockArgrExpression, arguments))
 
     def parse_declaration(self):
         """ single-Declaration ::=  single-Declaration (';' single-Declaration)* """
-        sd1 = self.parse_single_declaration()
+        declarations = [self.parse_single_declaration()]
         if self.token_lookprev().type != scanner.TK_END:
             self.token_accept(scanner.TK_SEMICOLON)
+
+        if self.predictive:
+            while self.curtoken.type in FIRST_SINGLE_DECLARATION:
+                declarations.append(self.parse_single_declaration())
+                if self.token_lookprev().type != scanner.TK_END:
+                    self.token_accept(scanner.TK_SEMICOLON)
+            if self.curtoken.type not in FOLLOW_DECLARATION:
+                raise ParserError(self.curtoken.pos, self.curtoken.type, self.lines)
+            return make_block(ast.BlockDeclaration, declarations)
+
         t = True
         while t:
             try:
@@ -245,9 +340,9 @@ class Parser(object):
             if t:
                 if self.token_lookprev().type != scanner.TK_END:
                     self.token_accept(scanner.TK_SEMICOLON)
-                sd1 = ast.SequentialDeclaration(sd1, sd2)
+                declarations.append(sd2)
 
-        return sd1
+        return make_block(ast.BlockDeclaration, declarations)
 
     def parse_single_declaration(self):
         """ single-Declaration ::=  const Identifier ~ Expression
@@ -255,7 +350,9 @@ class Parser(object):
                                 |   func Identifier '(' Identifier ':' Type-denoter ',*)' ':' Type-denoter single-Command
         """
 
+        start = self.curindex
         token = self.token_current()
+        pos = token.pos
         if token.type == scanner.TK_CONST:
             self.token_accept_any()
             token = self.token_current()
@@ -277,10 +374,10 @@ class Parser(object):
             tk_ident = self.token_current()
             self.token_accept(scanner.TK_IDENTIFIER)
             self.token_accept(scanner.TK_LPAREN)
-            if self.token_current != scanner.TK_RPAREN :
+            if self.token_current().type != scanner.TK_RPAREN:
                 argrs = self.parse_argr()
             else:
-                argrs = ''
+                argrs = ast.BlockArgr([])
 
             self.token_accept(scanner.TK_RPAREN)
             self.token_accept(scanner.TK_COLON)
@@ -289,16 +386,17 @@ class Parser(object):
             #decl = ast.FunctionDeclaration(tk_ident.val, tk_argident.val, arg_type, func_type, command)
             decl = ast.FunctionDeclaration(tk_ident.val, argrs, func_type, command)
         else:
-            raise ParserError(self.curtoken.pos, self.curtoken.type)
+            raise ParserError(self.curtoken.pos, self.curtoken.type, self.lines)
 
+        decl.pos = pos
+        decl.span = (start, self.curindex)
         return decl
     def parse_argr(self):
-        ar1 = self.parse_single_argr()
+        argrs = [self.parse_single_argr()]
         while self.token_current().type == scanner.TK_COMMA:
             self.token_accept_any()
-            ar2 = self.parse_single_argr()
-            ar1 = ast.SequentialArgr(ar1, ar2)
-        return ar1
+            argrs.append(self.parse_single_argr())
+        return make_block(ast.BlockArgr, argrs)
 
     def parse_single_argr(self):
         tk_argident = self.token_current()
@@ -307,6 +405,7 @@ class Parser(object):
         self.token_accept(scanner.TK_COLON)
         arg_type = self.parse_type_denoter()
         tk = ast.SingleArgr(tk_argident_val, arg_type)
+        tk.pos = tk_argident.pos
         return tk
 
     def parse_type_denoter(self):
@@ -314,30 +413,454 @@ class Parser(object):
 
         token = self.token_current()
         self.token_accept(scanner.TK_IDENTIFIER)
-        return ast.TypeDenoter(token.val)
+        type_denoter = ast.TypeDenoter(token.val)
+        type_denoter.pos = token.pos
+        return type_denoter
 
     def token_current(self):
         return self.curtoken
 
     def token_lookahead(self):
-        return self.tokens[self.curindex + 1]
+        if not self.window:
+            if self.curtoken.type == scanner.TK_EOT:
+                return self.curtoken
+            self.window.append(next(self.tokens))
+        return self.window[0]
 
     def token_lookprev(self):
-        return self.tokens[self.curindex - 1]
+        return self.prevtoken
 
     def token_accept_any(self):
         # Do not increment curindex if curtoken is TK_EOT.
         if self.curtoken.type != scanner.TK_EOT:
             self.curindex += 1
-            self.curtoken = self.tokens[self.curindex]
+            self.prevtoken = self.curtoken
+            if self.window:
+                self.curtoken = self.window.popleft()
+            else:
+                self.curtoken = next(self.tokens)
 
     def token_accept(self, type):
         if self.curtoken.type != type:
-            raise ParserError(self.curtoken.pos, self.curtoken.type)
+            raise ParserError(self.curtoken.pos, self.curtoken.type, self.lines)
 
         self.token_accept_any()
 
 
+class StackParser(Parser):
+    """A Parser that keeps its own stack instead of using Python recursion.
+
+    Every production that can nest is written as a generator. To parse a
+    sub-production it yields that production's generator and receives
+    the resulting tree back as the value of the yield; when it is done
+    it yields its own tree. run() drives the generators from an explicit
+    stack of suspended generators, so the nesting depth of a program is
+    limited only by memory.
+
+    It builds the same trees as Parser and always parses predictively.
+    """
+
+    def __init__(self, tokens, lines=None, hashcons=False):
+        Parser.__init__(self, tokens, lines, predictive=True, hashcons=hashcons)
+
+    def run(self, gen):
+        """Run the production generator gen and return its tree."""
+
+        stack = [gen]
+        value = None
+        while stack:
+            result = stack[-1].send(value)
+            if type(result) is types.GeneratorType:
+                stack.append(result)
+                value = None
+            else:
+                stack.pop()
+                value = result
+        return value
+
+    def parse_program(self):
+        """ Program ::=  Command EOT """
+
+        command = self.run(self.gen_command())
+        self.token_accept(scanner.TK_EOT)
+        return ast.Program(command)
+
+    def gen_command(self):
+        """ Command ::=  single-Command (';' single-Command)*  """
+
+        commands = [(yield self.gen_single_command())]
+        while self.curtoken.type in FIRST_SINGLE_COMMAND:
+            commands.append((yield self.gen_single_command()))
+        if self.curtoken.type not in FOLLOW_COMMAND:
+            raise ParserError(self.curtoken.pos, self.curtoken.type, self.lines)
+        yield make_block(ast.BlockCommand, commands)
+
+    def gen_single_command(self):
+        """ See Parser.parse_single_command """
+
+        start = self.curindex
+        token = self.token_current()
+
+        if token.type == scanner.TK_IDENTIFIER:
+            self.token_accept_any()
+            token_next = self.token_current()
+            if token_next.type == scanner.TK_BECOMES:
+                self.token_accept_any()
+                expr = yield self.gen_expression()
+                vname = ast.Vname(token.val)
+                vname.pos = token.pos
+                cmd = ast.AssignCommand(self.share(vname), expr)
+            elif token_next.type == scanner.TK_LPAREN:
+                self.token_accept_any()
+                expr = yield self.gen_arg_expr()
+                self.token_accept(scanner.TK_RPAREN)
+                cmd = ast.CallCommand(token.val, expr)
+            else:
+                raise ParserError(token_next.pos, token_next.type, self.lines)
+            self.token_accept(scanner.TK_SEMICOLON)
+        elif token.type == scanner.TK_IF:
+            self.token_accept_any()
+            expr = yield self.gen_expression()
+            self.token_accept(scanner.TK_THEN)
+            sc1 = yield self.gen_single_command()
+            self.token_accept(scanner.TK_ELSE)
+            sc2 = yield self.gen_single_command()
+            cmd = ast.IfCommand(expr, sc1, sc2)
+        elif token.type == scanner.TK_WHILE:
+            self.token_accept_any()
+            expr = yield self.gen_expression()
+            self.token_accept(scanner.TK_DO)
+            sc1 = yield self.gen_single_command()
+            cmd = ast.WhileCommand(expr, sc1)
+        elif token.type == scanner.TK_LET:
+            self.token_accept_any()
+            decl = yield self.gen_declaration()
+            self.token_accept(scanner.TK_IN)
+            sc1 = yield self.gen_single_command()
+            cmd = ast.LetCommand(decl, sc1)
+        elif token.type == scanner.TK_BEGIN:
+            self.token_accept_any()
+            cmd = yield self.gen_command()
+            self.token_accept(scanner.TK_END)
+        elif token.type == scanner.TK_RETURN:
+            self.token_accept_any()
+            expr = yield self.gen_expression()
+            cmd = ast.ReturnCommand(expr)
+            self.token_accept(scanner.TK_SEMICOLON)
+        else:
+            raise ParserError(self.curtoken.pos, self.curtoken.type, self.lines)
+
+        # begin ... end has no node of its own, keep the inner position.
+        if token.type != scanner.TK_BEGIN:
+            cmd.pos = token.pos
+        cmd.span = (start, self.curindex)
+        yield cmd
+
+    def gen_expression(self, min_prec=1):
+        """ See Parser.parse_expression """
+
+        e1 = yield self.gen_primary_expression()
+        token = self.curtoken
+        while token.type == scanner.TK_OPERATOR:
+            prec, assoc = BINARY_OPERATORS[token.val]
+            if prec < min_prec:
+                break
+            self.token_accept_any()
+            if assoc == LEFT:
+                e2 = yield self.gen_expression(prec + 1)
+            else:
+                e2 = yield self.gen_expression(prec)
+            e1 = ast.BinaryExpression(e1, token.val, e2)
+            e1.pos = token.pos
+            e1 = self.share(e1)
+            token = self.curtoken
+        yield e1
+
+    def gen_primary_expression(self):
+        """ See Parser.parse_primary_expression """
+
+        token = self.token_current()
+        if token.type == scanner.TK_INTLITERAL:
+            self.token_accept_any()
+            expr = ast.IntegerExpression(int(token.val))
+            expr.pos = token.pos
+            expr = self.share(expr)
+        elif token.type == scanner.TK_IDENTIFIER:
+            self.token_accept_any()
+            next = self.token_current()
+            if next.type == scanner.TK_LPAREN:
+                ident = token.val
+                self.token_accept_any()
+                expr = yield self.gen_arg_expr()
+                self.token_accept(scanner.TK_RPAREN)
+                expr = ast.CallExpression(ident, expr)
+            else:
+                vname = ast.Vname(token.val)
+                vname.pos = token.pos
+                expr = ast.VnameExpression(self.share(vname))
+            expr.pos = token.pos
+            expr = self.share(expr)
+        elif token.type == scanner.TK_OPERATOR:
+            oper = token.val
+            self.token_accept_any()
+            expr = yield self.gen_primary_expression()
+            expr = ast.UnaryExpression(oper, expr)
+            expr.pos = token.pos
+            expr = self.share(expr)
+        elif token.type == scanner.TK_LPAREN:
+            self.token_accept_any()
+            expr = yield self.gen_expression()
+            self.token_accept(scanner.TK_RPAREN)
+        else:
+            raise ParserError(self.curtoken.pos, self.curtoken.type, self.lines)
+
+        yield expr
+
+    def gen_arg_expr(self):
+        """ See Parser.parse_arg_expr """
+
+        arguments = [(yield self.gen_primary_expression())]
+        while self.token_current().type == scanner.TK_COMMA:
+            self.token_accept_any()
+            arguments.append((yield self.gen_primary_expression()))
+        yield self.share(make_block(ast.BlockArgrExpression, arguments))
+
+    def gen_declaration(self):
+        """ See Parser.parse_declaration """
+
+        declarations = [(yield self.gen_single_declaration())]
+        if self.token_lookprev().type != scanner.TK_END:
+            self.token_accept(scanner.TK_SEMICOLON)
+        while self.curtoken.type in FIRST_SINGLE_DECLARATION:
+            declarations.append((yield self.gen_single_declaration()))
+            if self.token_lookprev().type != scanner.TK_END:
+                self.token_accept(scanner.TK_SEMICOLON)
+        if self.curtoken.type not in FOLLOW_DECLARATION:
+            raise ParserError(self.curtoken.pos, self.curtoken.type, self.lines)
+        yield make_block(ast.BlockDeclaration, declarations)
+
+    def gen_single_declaration(self):
+        """ See Parser.parse_single_declaration """
+
+        start = self.curindex
+        token = self.token_current()
+        pos = token.pos
+        if token.type == scanner.TK_CONST:
+            self.token_accept_any()
+            token = self.token_current()
+            self.token_accept(scanner.TK_IDENTIFIER)
+            ident = token.val
+            self.token_accept(scanner.TK_IS)
+            expr = yield self.gen_expression()
+            decl = ast.ConstDeclaration(ident, expr)
+        elif token.type == scanner.TK_VAR:
+            self.token_accept_any()
+            token = self.token_current()
+            self.token_accept(scanner.TK_IDENTIFIER)
+            ident = token.val
+            self.token_accept(scanner.TK_COLON)
+            type_denoter = self.parse_type_denoter()
+            decl = ast.VarDeclaration(ident, type_denoter)
+        elif token.type == scanner.TK_FUNCDEF:
+            self.token_accept_any()
+            tk_ident = self.token_current()
+            self.token_accept(scanner.TK_IDENTIFIER)
+            self.token_accept(scanner.TK_LPAREN)
+            if self.token_current().type != scanner.TK_RPAREN:
+                argrs = self.parse_argr()
+            else:
+                argrs = ast.BlockArgr([])
+
+            self.token_accept(scanner.TK_RPAREN)
+            self.token_accept(scanner.TK_COLON)
+            func_type = self.parse_type_denoter()
+            command = yield self.gen_single_command()
+            decl = ast.FunctionDeclaration(tk_ident.val, argrs, func_type, command)
+        else:
+            raise ParserError(self.curtoken.pos, self.curtoken.type, self.lines)
+
+        decl.pos = pos
+        decl.span = (start, self.curindex)
+        yield decl
+
+
+def node_extent(node):
+    """Return the (start, stop) token indices a node was parsed from, or
+    None for nodes that are not reparsed on their own.
+    """
+
+    if node.span is not None:
+        return node.span
+    if type(node) is ast.BlockCommand:
+        return node_extent(node.commands[0])[0], node_extent(node.commands[-1])[1]
+    if type(node) is ast.BlockDeclaration:
+        return node_extent(node.declarations[0])[0], node_extent(node.declarations[-1])[1]
+    return None
+
+
+def enclosing_path(tree, first, stop):
+    """Return the nodes enclosing the tokens first to stop - 1, outermost
+    first, as (parent, field, index, node) tuples. index is None unless the
+    field holds a list.
+
+    A node encloses the tokens if it starts at or before first and its
+    last token is after them, so that its last token is unchanged.
+    """
+
+    path = []
+    node = tree
+    while True:
+        found = None
+        for field, value in ast.iter_fields(node):
+            if type(value) is list:
+                # Sequences can be long; bisect on the start of each item.
+                lo = 0
+                hi = len(value)
+                while lo < hi:
+                    mid = (lo + hi) // 2
+                    extent = node_extent(value[mid])
+                    if extent is not None and extent[0] <= first:
+                        lo = mid + 1
+                    else:
+                        hi = mid
+                if lo > 0:
+                    extent = node_extent(value[lo - 1])
+                    if extent is not None and stop < extent[1]:
+                        found = (node, field, lo - 1, value[lo - 1])
+            elif isinstance(value, ast.AST):
+                extent = node_extent(value)
+                if extent is not None and extent[0] <= first and stop < extent[1]:
+                    found = (node, field, None, value)
+            if found is not None:
+                break
+        if found is None:
+            return path
+        path.append(found)
+        node = found[3]
+
+
+def shift_nodes(node, delta, shift):
+    """Move the spans of node and every node below it by delta tokens and
+    their positions by shift characters.
+    """
+
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if node.span is not None:
+            node.span = (node.span[0] + delta, node.span[1] + delta)
+        if node.pos is not None:
+            node.pos += shift
+        for field, value in ast.iter_fields(node):
+            if type(value) is list:
+                stack.extend(value)
+            elif isinstance(value, ast.AST):
+                stack.append(value)
+
+
+def reparse(tree, tokens, changed, shift, lines=None):
+    """Bring tree up to date after an edit of its tokens.
+
+    tokens is the token list after the edit and changed the (first,
+    old_stop, new_stop) range returned by Scanner.rescan(); shift is the
+    number of characters the edit added. The innermost single-Command or
+    single-Declaration enclosing the change is parsed again and replaces
+    the old node in place. If it does not parse to exactly the tokens
+    the old node covered, the next enclosing one is tried, and as a last
+    resort the whole program is parsed again.
+
+    Return the updated tree.
+    """
+
+    first, old_stop, new_stop = changed
+    delta = new_stop - old_stop
+    path = enclosing_path(tree, first, old_stop)
+
+    for i in range(len(path) - 1, -1, -1):
+        parent, field, index, node = path[i]
+        if node.span is None:
+            continue
+        start, stop = node.span
+
+        # Index straight into tokens; islice() would step over every
+        # token before start.
+        p = Parser((tokens[j] for j in xrange(start, len(tokens))), lines)
+        p.curindex = start
+        try:
+            if isinstance(node, ast.Declaration):
+                new = p.parse_single_declaration()
+            else:
+                new = p.parse_single_command()
+        except ParserError:
+            continue
+        if p.curindex != stop + delta:
+            continue
+
+        if index is None:
+            setattr(parent, field, new)
+        else:
+            getattr(parent, field)[index] = new
+
+        # Everything after the edit moves; the enclosing nodes grow.
+        ancestors = [tree] + [entry[3] for entry in path[:i]]
+        skip = [entry[3] for entry in path[:i]] + [new]
+        for ancestor in ancestors:
+            if ancestor.span is not None:
+                ancestor.span = (ancestor.span[0], ancestor.span[1] + delta)
+            for field, value in ast.iter_fields(ancestor):
+                if type(value) is not list:
+                    value = [value]
+                for child in value:
+                    if not isinstance(child, ast.AST) or child in skip:
+                        continue
+                    extent = node_extent(child)
+                    if extent is not None and extent[0] >= old_stop:
+                        shift_nodes(child, delta, shift)
+        return tree
+
+    return Parser(tokens, lines).parse()
+
+
+class IncrementalParser(object):
+    """Keep the tree of a source text up to date while it is edited.
+
+    Every node built by parse_single_command or parse_single_declaration
+    records in its span the token indices it was parsed from. edit()
+    rescans only the edited part of the text (see Scanner.rescan()) and
+    reparses only the enclosing single-Command or single-Declaration
+    (see reparse()); all other subtrees are reused.
+    """
+
+    def __init__(self, scanner_obj):
+        self.scanner = scanner_obj
+        self.tokens = scanner_obj.scan()
+        self.tree = Parser(self.tokens, scanner_obj.lines).parse()
+
+    def edit(self, offset, deleted, inserted):
+        """Replace the deleted characters at offset with the string
+        inserted and return the updated tree.
+
+        If the edited text does not scan or parse, the error is raised
+        and the next edit starts over from a full parse.
+        """
+
+        try:
+            if self.tree is None:
+                text = self.scanner.input
+                text = text[:offset] + inserted + text[offset + deleted:]
+                self.scanner = scanner.Scanner(text, self.scanner.engine)
+                self.tokens = self.scanner.scan()
+                self.tree = Parser(self.tokens, self.scanner.lines).parse()
+            else:
+                changed = self.scanner.rescan(self.tokens, offset, deleted, inserted)
+                self.tree = reparse(self.tree, self.tokens, changed,
+                                    len(inserted) - deleted, self.scanner.lines)
+        except (scanner.ScannerError, ParserError):
+            self.tree = None
+            raise
+        return self.tree
+
+
 if __name__ == '__main__':
     exprs = [ """
 let
@@ -374,7 +897,8 @@ in
 
         try:
             tree = p.parse()
-            print tree
+            ast.dump(tree, sys.stdout, indent=2)
+            print
         except ParserError as e:
             print e
             print 'Not Parsed!'
@@ -0,0 +1,745 @@
+#!/usr/bin/env python
+#
+# Register based virtual machine for Mini Triangle
+
+import array
+import getopt
+import heapq
+import sys
+
+import ast
+import astfile
+import parser
+import resolver
+import scanner
+import vm
+
+
+# Opcodes, roughly by how often they run; the interpreter loop tests
+# them in this order. Every instruction is (opcode, a, b, c) and r[n]
+# is register n of the running code:
+MOVE          = 0   # r[a] = r[b]
+ADD           = 1   # r[a] = r[b] + r[c]
+SUB           = 2
+MUL           = 3
+JUMP_IF_LT    = 4   # jump to a if r[b] < r[c]
+JUMP_IF_GT    = 5
+JUMP_IF_EQ    = 6
+JUMP          = 7   # jump to a
+CALL          = 8   # r[a] = functions[b] called with the registers arglists[c]
+RETURN        = 9   # return r[a] to the caller
+MOD           = 10
+DIV           = 11
+LT            = 12
+GT            = 13
+EQ            = 14
+JUMP_IF_TRUE  = 15  # jump to a if r[b]
+LOAD_GLOBAL   = 16  # r[a] = register b of the main program
+STORE_GLOBAL  = 17  # register b of the main program = r[a]
+NEG           = 18  # r[a] = -r[b]
+POS           = 19
+LOAD_OUTER    = 20  # r[a] = register c of the enclosing function at level b
+STORE_OUTER   = 21
+PRINT         = 22  # print r[a]
+READ          = 23  # r[a] = input()
+HALT          = 24
+
+OPNAMES = ['MOVE', 'ADD', 'SUB', 'MUL', 'JUMP_IF_LT', 'JUMP_IF_GT', 'JUMP_IF_EQ', 'JUMP',
+           'CALL', 'RETURN', 'MOD', 'DIV', 'LT', 'GT', 'EQ', 'JUMP_IF_TRUE', 'LOAD_GLOBAL',
+           'STORE_GLOBAL', 'NEG', 'POS', 'LOAD_OUTER', 'STORE_OUTER', 'PRINT', 'READ',
+           'HALT']
+
+BINARY_OPCODES = {'+' : ADD,
+                  '-' : SUB,
+                  '*' : MUL,
+                  '/' : DIV,
+                  '\\': MOD,
+                  '<' : LT,
+                  '>' : GT,
+                  '=' : EQ}
+
+UNARY_OPCODES = {'-': NEG,
+                 '+': POS}
+
+# Comparisons that can jump without storing their result.
+JUMP_OPCODES = {'<': JUMP_IF_LT,
+                '>': JUMP_IF_GT,
+                '=': JUMP_IF_EQ}
+
+# Operand layout of each opcode: 'r' a register of the running code,
+# 'j' a jump target, 'f' a function, 'l' an argument list, 'n' a
+# number, '-' unused.
+OPERANDS = {MOVE: 'rr', NEG: 'rr', POS: 'rr',
+            JUMP_IF_LT: 'jrr', JUMP_IF_GT: 'jrr', JUMP_IF_EQ: 'jrr',
+            JUMP: 'j', JUMP_IF_TRUE: 'jr',
+            CALL: 'rfl', RETURN: 'r', PRINT: 'r', READ: 'r', HALT: '',
+            LOAD_GLOBAL: 'rn', STORE_GLOBAL: 'rn', LOAD_OUTER: 'rnn', STORE_OUTER: 'rnn'}
+for op in BINARY_OPCODES.values():
+    OPERANDS[op] = 'rrr'
+del op
+
+
+class Code(object):
+    """ A compiled program.
+
+        code is an array('i') of instructions of four numbers each, so
+        instruction k is code[4 * k:4 * k + 4]. Jump targets and
+        function entries are instruction numbers. The main program
+        starts at 0 and ends with HALT; the functions follow it.
+
+        Every call runs on a copy of the registers of its code, given
+        as a template list: the variables and temporaries, initially
+        None, followed by the constants the code uses, so an operand is
+        always a register. functions holds (entry, number of parameters,
+        template, level) for each function, by index; its parameters
+        are its first registers. arglists holds the tuples of argument
+        registers CALL instructions refer to.
+    """
+
+    __slots__ = ('code', 'functions', 'names', 'arglists', 'registers', 'levels')
+
+    def __init__(self):
+        self.code = array.array('i')
+        self.functions = []
+        self.names = []
+        self.arglists = []
+        # The template of the main program.
+        self.registers = []
+        self.levels = 1
+
+    def instructions(self):
+        """Return the instructions as a list of (opcode, a, b, c) tuples."""
+
+        ops = self.code.tolist()
+        return zip(ops[::4], ops[1::4], ops[2::4], ops[3::4])
+
+    def disassemble(self, out=sys.stdout):
+        """Write a listing of the instructions to out."""
+
+        entries = {}
+        for i, function in enumerate(self.functions):
+            entries[function[0]] = i
+        registers = self.registers
+        for pc, instruction in enumerate(self.instructions()):
+            if pc in entries:
+                i = entries[pc]
+                entry, nargs, registers, level = self.functions[i]
+                out.write('\n%s: %d arguments, %d registers, level %d\n' %
+                          (self.names[i], nargs, len(registers), level))
+
+            def register(n):
+                if registers[n] is None:
+                    return 'r%d' % n
+                return repr(registers[n])
+
+            op = instruction[0]
+            operands = []
+            for kind, n in zip(OPERANDS[op], instruction[1:]):
+                if kind == 'r':
+                    operands.append(register(n))
+                elif kind == 'j':
+                    operands.append('to %d' % n)
+                elif kind == 'f':
+                    operands.append(self.names[n])
+                elif kind == 'l':
+                    operands.append('(%s)' % ', '.join(map(register, self.arglists[n])))
+                else:
+                    operands.append(str(n))
+            out.write(('%6d  %-14s %s' % (pc, OPNAMES[op], ', '.join(operands))).rstrip() + '\n')
+
+
+class Register(object):
+    """ A virtual register of the code being compiled.
+
+        start and end: the first and last instruction it is live at.
+        index: the register it is given by allocate().
+        reused: true if that register held something else before.
+        variable: true for constants and variables declared by the
+        program, false for temporaries and literals.
+    """
+
+    __slots__ = ('start', 'end', 'index', 'reused', 'variable')
+
+    def __init__(self, variable=False):
+        self.start = None
+        self.end = None
+        self.index = None
+        self.reused = False
+        self.variable = variable
+
+
+class Label(object):
+    """ A jump target in the code being compiled, placed by Compiler.place(). """
+
+    __slots__ = ('pos',)
+
+    def __init__(self):
+        self.pos = None
+
+
+def contains_call(tree):
+    """Return True if the expression tree calls a function."""
+
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if type(node) is ast.CallExpression:
+            return True
+        if isinstance(node, ast.Expression):
+            for name in node._fields:
+                value = getattr(node, name)
+                if type(value) is list:
+                    stack.extend(value)
+                elif isinstance(value, ast.Expression):
+                    stack.append(value)
+    return False
+
+
+class Compiler(ast.Visitor):
+    """ Compiles a program into a Code object.
+
+        The main program and every function are lowered one at a time
+        to three-address instructions over virtual registers: one per
+        variable, constant and parameter, one per literal value, and a
+        fresh one for every intermediate result. An expression assigned
+        to a variable writes its last result straight into the
+        variable's register and operands that are variables or literals
+        are read in place, so s := x + y * z takes two instructions.
+
+        allocate() then maps the virtual registers onto as few real ones
+        as it can by linear scan over their live ranges. A variable is
+        live over its whole let, a parameter over the whole function and
+        a temporary from its first to its last use; literals go after
+        all of them, in the template.
+    """
+
+    def __init__(self, tree, lines=None):
+        self.tree = tree
+        self.lines = lines
+        self.code = Code()
+        self.arglists = {}
+        # For the code being compiled: its level, instructions, virtual
+        # registers, literal registers by value, frame layout (level,
+        # register of each slot) by depth, number of enclosing while
+        # loops, and the variable resets that may be dropped.
+        self.level = 0
+        self.instructions = []
+        self.registers = []
+        self.consts = {}
+        self.frames = []
+        self.loops = 0
+        self.resets = []
+        # (FunctionDeclaration, frames, level) left to compile.
+        self.pending = []
+
+        self.commands = self.dispatch_table({
+            ast.LetCommand: self.compile_let_command,
+            ast.BlockCommand: self.compile_block_command,
+            ast.SequentialCommand: self.compile_seq_command,
+            ast.AssignCommand: self.compile_assign_command,
+            ast.CallCommand: self.compile_call_command,
+            ast.ReturnCommand: self.compile_return_command,
+            ast.WhileCommand: self.compile_while_command,
+            ast.IfCommand: self.compile_if_command}, self.compile_bad_node)
+        self.declarations = self.dispatch_table({
+            ast.VarDeclaration: self.compile_var_declaration,
+            ast.ConstDeclaration: self.compile_const_declaration,
+            ast.BlockDeclaration: self.compile_block_declaration,
+            ast.SequentialDeclaration: self.compile_seq_declaration,
+            ast.FunctionDeclaration: self.compile_function_declaration}, self.compile_bad_node)
+        self.expressions = self.dispatch_table({
+            ast.IntegerExpression: self.compile_integer_expression,
+            ast.VnameExpression: self.compile_vname_expression,
+            ast.CallExpression: self.compile_call_expression,
+            ast.UnaryExpression: self.compile_unary_expression,
+            ast.BinaryExpression: self.compile_binary_expression}, self.compile_bad_node)
+
+    def compile(self):
+        """Return the Code of the program.
+
+        Raises resolver.ResolveError or vm.VMError.
+        """
+
+        if type(self.tree) is not ast.Program:
+            self.compile_bad_node(self.tree)
+        functions = resolver.Resolver(self.tree, self.lines).resolve_functions()
+
+        code = self.code
+        code.functions = [None] * len(functions)
+        code.names = [decl.name for decl in functions]
+        self.start()
+        self.compile_command(self.tree.command)
+        self.emit(HALT)
+        code.registers = self.finish()
+
+        while self.pending:
+            decl, self.frames, self.level = self.pending.pop(0)
+            entry = len(code.code) / 4
+            self.start()
+            params = []
+            for i in xrange(decl.size):
+                reg = self.new_register(True)
+                reg.start = -1
+                params.append(reg)
+            self.frames.append((self.level, params))
+            self.compile_command(decl.command)
+            self.emit(RETURN, self.const(None))
+            for reg in params:
+                reg.end = len(self.instructions)
+            code.functions[decl.index] = (entry, decl.size, self.finish(), self.level)
+            code.levels = max(code.levels, self.level + 1)
+        return code
+
+    def start(self):
+        """Start compiling the main program or a function."""
+
+        self.instructions = []
+        self.registers = []
+        self.consts = {}
+        self.loops = 0
+        self.resets = []
+
+    def finish(self):
+        """Allocate the registers of the code compiled since start(),
+        append its instructions to the Code and return its register
+        template.
+        """
+
+        nregisters = self.allocate()
+        template = [None] * nregisters
+        for value, reg in self.consts.iteritems():
+            reg.index = len(template)
+            template.append(value)
+
+        # Drop the resets of variables whose register is still None,
+        # then number the instructions that are left.
+        dropped = set([id(ins) for ins, reg in self.resets if not reg.reused])
+        numbers = []
+        base = len(self.code.code) / 4
+        for ins in self.instructions:
+            numbers.append(base)
+            if id(ins) not in dropped:
+                base += 1
+        numbers.append(base)
+
+        emit_to = self.code.code
+        for ins in self.instructions:
+            if id(ins) in dropped:
+                continue
+            emit_to.append(ins[0])
+            for operand in ins[1:]:
+                if type(operand) is Register:
+                    operand = operand.index
+                elif type(operand) is Label:
+                    operand = numbers[operand.pos]
+                elif type(operand) is tuple:
+                    operand = self.arglist(tuple([reg.index for reg in operand]))
+                emit_to.append(operand)
+        return template
+
+    def allocate(self):
+        """Give every virtual register a register index and return the
+        number of registers used.
+        """
+
+        for pos, ins in enumerate(self.instructions):
+            for operand in ins[1:]:
+                if type(operand) is tuple:
+                    regs = operand
+                elif type(operand) is Register:
+                    regs = (operand,)
+                else:
+                    continue
+                for reg in regs:
+                    if reg.start is None or pos < reg.start:
+                        reg.start = pos
+                    if reg.end is None or pos > reg.end:
+                        reg.end = pos
+
+        # Linear scan: a register is free again once the live range
+        # holding it has ended. The lowest free one is taken first, so
+        # the parameters, starting before everything else, get the
+        # first registers in order.
+        count = 0
+        free = []
+        active = []
+        for reg in sorted(self.registers, key=lambda reg: reg.start):
+            while active and active[0][0] < reg.start:
+                heapq.heappush(free, heapq.heappop(active)[1].index)
+            if free:
+                reg.index = heapq.heappop(free)
+                reg.reused = True
+            else:
+                reg.index = count
+                count += 1
+            heapq.heappush(active, (reg.end, reg))
+        return count
+
+    def arglist(self, regs):
+        """Return the index of the argument registers regs in arglists."""
+
+        index = self.arglists.get(regs)
+        if index is None:
+            index = self.arglists[regs] = len(self.code.arglists)
+            self.code.arglists.append(regs)
+        return index
+
+    def here(self):
+        """Return the position of the next instruction."""
+
+        return len(self.instructions)
+
+    def emit(self, op, a=0, b=0, c=0):
+        """Append an instruction and return it."""
+
+        ins = [op, a, b, c]
+        self.instructions.append(ins)
+        return ins
+
+    def place(self, label):
+        """Make label the position of the next instruction."""
+
+        label.pos = self.here()
+
+    def new_register(self, variable=False):
+        reg = Register(variable)
+        self.registers.append(reg)
+        return reg
+
+    def const(self, value):
+        """Return the register holding the literal value."""
+
+        reg = self.consts.get(value)
+        if reg is None:
+            reg = self.consts[value] = Register()
+        return reg
+
+    def lookup(self, vname):
+        """Return (level, register) of the variable vname names."""
+
+        level, regs = self.frames[vname.depth]
+        return level, regs[vname.slot]
+
+    def emit_load(self, target, level, reg):
+        if level == 0:
+            self.emit(LOAD_GLOBAL, target, reg.index)
+        else:
+            self.emit(LOAD_OUTER, target, level, reg.index)
+
+    def emit_store(self, source, level, reg):
+        if level == 0:
+            self.emit(STORE_GLOBAL, source, reg.index)
+        else:
+            self.emit(STORE_OUTER, source, level, reg.index)
+
+    def compile_bad_node(self, tree, target=None):
+        msg = 'cannot compile %s' % type(tree).__name__
+        pos = getattr(tree, 'pos', None)
+        if self.lines is not None and pos is not None:
+            msg += ' (line %d, col %d)' % self.lines.lookup(pos)
+        raise vm.VMError(msg)
+
+    def compile_command(self, tree):
+        self.commands[tree.kind](tree)
+
+    def compile_let_command(self, tree):
+        start = self.here()
+        regs = [None] * tree.size
+        self.frames.append((self.level, regs))
+        self.compile_declaration(tree.declaration)
+        self.compile_command(tree.command)
+        self.frames.pop()
+        for reg in regs:
+            if reg is not None:
+                reg.start = start
+                reg.end = self.here()
+
+    def compile_block_command(self, tree):
+        for cmd in tree.commands:
+            self.compile_command(cmd)
+
+    def compile_seq_command(self, tree):
+        self.compile_command(tree.command1)
+        self.compile_command(tree.command2)
+
+    def compile_assign_command(self, tree):
+        level, reg = self.lookup(tree.variable)
+        if level == self.level:
+            self.compile_into(tree.expression, reg)
+        else:
+            self.emit_store(self.compile_operand(tree.expression), level, reg)
+
+    def compile_call_command(self, tree):
+        if tree.function is not None:
+            self.compile_call(tree, self.new_register())
+        elif tree.identifier == 'putint':
+            self.emit(PRINT, self.compile_operand(tree.expression))
+        elif tree.identifier == 'getint' and type(tree.expression) is ast.VnameExpression:
+            level, reg = self.lookup(tree.expression.variable)
+            if level == self.level:
+                self.emit(READ, reg)
+            else:
+                temp = self.new_register()
+                self.emit(READ, temp)
+                self.emit_store(temp, level, reg)
+        else:
+            self.compile_bad_node(tree)
+
+    def compile_return_command(self, tree):
+        self.emit(RETURN, self.compile_operand(tree.expression))
+
+    def compile_jump_if(self, tree, label):
+        """Emit a jump to label taken if the expression tree is true."""
+
+        if type(tree) is ast.BinaryExpression and tree.oper in JUMP_OPCODES:
+            a, b = self.compile_operands([tree.expr1, tree.expr2])
+            self.emit(JUMP_OPCODES[tree.oper], label, a, b)
+        else:
+            self.emit(JUMP_IF_TRUE, label, self.compile_operand(tree))
+
+    def compile_while_command(self, tree):
+        # The test is at the bottom, so an iteration runs one jump.
+        body = Label()
+        test = Label()
+        self.emit(JUMP, test)
+        self.place(body)
+        self.loops += 1
+        self.compile_command(tree.command)
+        self.loops -= 1
+        self.place(test)
+        self.compile_jump_if(tree.expression, body)
+
+    def compile_if_command(self, tree):
+        # The else branch comes first, so that the test jumps if true.
+        then = Label()
+        end = Label()
+        self.compile_jump_if(tree.expression, then)
+        self.compile_command(tree.command2)
+        self.emit(JUMP, end)
+        self.place(then)
+        self.compile_command(tree.command1)
+        self.place(end)
+
+    def compile_declaration(self, tree):
+        self.declarations[tree.kind](tree)
+
+    def compile_var_declaration(self, tree):
+        reg = self.frames[-1][1][tree.slot] = self.new_register(True)
+        ins = self.emit(MOVE, reg, self.const(None))
+        # Registers start out as None; finish() drops the reset unless
+        # a loop runs the let again or the register is shared.
+        if not self.loops:
+            self.resets.append((ins, reg))
+
+    def compile_const_declaration(self, tree):
+        reg = self.frames[-1][1][tree.slot] = self.new_register(True)
+        self.compile_into(tree.expression, reg)
+
+    def compile_block_declaration(self, tree):
+        for decl in tree.declarations:
+            self.compile_declaration(decl)
+
+    def compile_seq_declaration(self, tree):
+        self.compile_declaration(tree.decl1)
+        self.compile_declaration(tree.decl2)
+
+    def compile_function_declaration(self, tree):
+        # Compiled after the code declaring it, whose registers are
+        # allocated by then.
+        self.pending.append((tree, self.frames[:], self.level + 1))
+
+    def compile_operand(self, tree):
+        """Return a register holding the value of the expression tree.
+
+        Literals and variables of the running code are used in place,
+        anything else is computed into a new temporary.
+        """
+
+        if type(tree) is ast.IntegerExpression:
+            return self.const(tree.value)
+        if type(tree) is ast.VnameExpression:
+            level, reg = self.lookup(tree.variable)
+            if level == self.level:
+                return reg
+        temp = self.new_register()
+        self.compile_into(tree, temp)
+        return temp
+
+    def compile_operands(self, trees):
+        """Return registers holding the values of the expressions trees,
+        evaluated left to right.
+        """
+
+        # A function called by a later operand may assign to a variable
+        # an earlier one reads in place, so that one is copied first.
+        copy = [False] * len(trees)
+        for i in xrange(len(trees) - 2, -1, -1):
+            copy[i] = copy[i + 1] or contains_call(trees[i + 1])
+        regs = []
+        for tree, copy_variable in zip(trees, copy):
+            reg = self.compile_operand(tree)
+            if copy_variable and reg.variable:
+                temp = self.new_register()
+                self.emit(MOVE, temp, reg)
+                reg = temp
+            regs.append(reg)
+        return regs
+
+    def compile_into(self, tree, target):
+        """Emit code leaving the value of the expression tree in target."""
+
+        self.expressions[tree.kind](tree, target)
+
+    def compile_integer_expression(self, tree, target):
+        self.emit(MOVE, target, self.const(tree.value))
+
+    def compile_vname_expression(self, tree, target):
+        level, reg = self.lookup(tree.variable)
+        if level == self.level:
+            self.emit(MOVE, target, reg)
+        else:
+            self.emit_load(target, level, reg)
+
+    def compile_call(self, tree, target):
+        args = self.compile_operands(resolver.arguments(tree.expression))
+        self.emit(CALL, target, tree.function.index, tuple(args))
+
+    def compile_call_expression(self, tree, target):
+        self.compile_call(tree, target)
+
+    def compile_unary_expression(self, tree, target):
+        op = UNARY_OPCODES.get(tree.operator)
+        if op is None:
+            self.compile_bad_node(tree)
+        self.emit(op, target, self.compile_operand(tree.expression))
+
+    def compile_binary_expression(self, tree, target):
+        op = BINARY_OPCODES.get(tree.oper)
+        if op is None:
+            self.compile_bad_node(tree)
+        a, b = self.compile_operands([tree.expr1, tree.expr2])
+        self.emit(op, target, a, b)
+
+
+def execute(code):
+    """Run the Code object code."""
+
+    # As in vm.execute(), the instructions are tuples in a list and the
+    # opcodes locals.
+    instructions = code.instructions()
+    functions = code.functions
+    arglists = code.arglists
+    (move, add, sub, mul, jump_if_lt, jump_if_gt, jump_if_eq, jump, call, ret, mod, div,
+     lt, gt, eq, jump_if_true, load_global, store_global, neg, pos, load_outer,
+     store_outer, prnt, read, halt) = range(len(OPNAMES))
+
+    r = code.registers[:]
+    glob = r
+    # display[level] holds the registers of the latest call at each level.
+    display = [glob] + [None] * (code.levels - 1)
+    # (return pc, registers, level, display entry replaced, result
+    # register) for each call.
+    calls = []
+    pc = 0
+
+    while True:
+        op, a, b, c = instructions[pc]
+        pc += 1
+        if op == move:
+            r[a] = r[b]
+        elif op == add:
+            r[a] = r[b] + r[c]
+        elif op == sub:
+            r[a] = r[b] - r[c]
+        elif op == mul:
+            r[a] = r[b] * r[c]
+        elif op == jump_if_lt:
+            if r[b] < r[c]:
+                pc = a
+        elif op == jump_if_gt:
+            if r[b] > r[c]:
+                pc = a
+        elif op == jump_if_eq:
+            if r[b] == r[c]:
+                pc = a
+        elif op == jump:
+            pc = a
+        elif op == call:
+            entry, nargs, template, level = functions[b]
+            frame = template[:]
+            frame[:nargs] = [r[i] for i in arglists[c]]
+            calls.append((pc, r, level, display[level], a))
+            display[level] = r = frame
+            pc = entry
+        elif op == ret:
+            value = r[a]
+            pc, r, level, display[level], a = calls.pop()
+            r[a] = value
+        elif op == mod:
+            r[a] = r[b] % r[c]
+        elif op == div:
+            r[a] = r[b] / r[c]
+        elif op == lt:
+            r[a] = r[b] < r[c]
+        elif op == gt:
+            r[a] = r[b] > r[c]
+        elif op == eq:
+            r[a] = r[b] == r[c]
+        elif op == jump_if_true:
+            if r[b]:
+                pc = a
+        elif op == load_global:
+            r[a] = glob[b]
+        elif op == store_global:
+            glob[b] = r[a]
+        elif op == neg:
+            r[a] = -r[b]
+        elif op == pos:
+            r[a] = +r[b]
+        elif op == load_outer:
+            r[a] = display[b][c]
+        elif op == store_outer:
+            display[b][c] = r[a]
+        elif op == prnt:
+            print r[a]
+        elif op == read:
+            r[a] = input()
+        elif op == halt:
+            return
+        else:
+            raise vm.VMError('bad opcode %d at %d' % (op, pc - 1))
+
+
+class VM(object):
+    """ Evaluator interface to the register machine: run() compiles the
+        tree and executes it.
+    """
+
+    def __init__(self, tree, lines=None):
+        self.tree = tree
+        self.lines = lines
+
+    def run(self):
+        execute(Compiler(self.tree, self.lines).compile())
+
+
+if __name__ == '__main__':
+    # Usage: python regvm.py [--no-cache] [--dis] file.mt
+    opts, args = getopt.getopt(sys.argv[1:], '', ['no-cache', 'dis'])
+    opts = dict(opts)
+    if len(args) != 1:
+        print 'Usage: python regvm.py [--no-cache] [--dis] file.mt'
+        sys.exit(2)
+
+    try:
+        tree, lines = astfile.parse_file(args[0], cache='--no-cache' not in opts)
+        code = Compiler(tree, lines).compile()
+    except (IOError, scanner.ScannerError, parser.ParserError,
+            resolver.ResolveError, vm.VMError) as e:
+        print e
+        sys.exit(1)
+
+    if '--dis' in opts:
+        code.disassemble()
+    else:
+        execute(code)
@@ -0,0 +1,399 @@
+#!/usr/bin/env python
+#
+# Static scope resolution for Mini Triangle
+
+import ast
+
+
+# Procedures every program can call.
+BUILTINS = frozenset(['getint', 'putint'])
+
+
+class ResolveError(Exception):
+    """ Raised when a program uses names it does not declare, or uses
+    them wrongly
+
+    problems: (node, message) for every problem found.
+    lines: optional scanner.LineIndex used to report their line and
+    column.
+    """
+
+    def __init__(self, problems, lines=None):
+        self.problems = problems
+        self.lines = lines
+
+    def __str__(self):
+        items = []
+        for node, msg in self.problems:
+            if self.lines is not None and node.pos is not None:
+                msg += ' (line %d, col %d)' % self.lines.lookup(node.pos)
+            items.append(msg)
+        return 'ResolveError: %s' % ', '.join(items)
+
+
+def copy_node(node):
+    """Return a shallow copy of node, keeping its position, span and hash."""
+
+    copy = type(node)(*[getattr(node, name) for name in node._fields])
+    for name in ('pos', 'span', 'hash'):
+        value = getattr(node, name, None)
+        if value is not None:
+            setattr(copy, name, value)
+    return copy
+
+
+def parameters(decl):
+    """Return the parameter names of the FunctionDeclaration decl."""
+
+    names = []
+    stack = [decl.args]
+    while stack:
+        args = stack.pop()
+        if type(args) is ast.SingleArgr:
+            names.append(args.name)
+        elif type(args) is ast.BlockArgr:
+            stack.extend(reversed(args.argrs))
+        elif type(args) is ast.SequentialArgr:
+            stack.append(args.argr2)
+            stack.append(args.argr1)
+    return names
+
+
+def arguments(expr):
+    """Return the argument expressions of a call given its expression."""
+
+    if type(expr) is ast.BlockArgrExpression:
+        return expr.arguments
+    if type(expr) is ast.ArgrExpression:
+        return arguments(expr.argument1) + arguments(expr.argument2)
+    return [expr]
+
+
+class Resolver(ast.Visitor):
+    """ Gives every name in a program the static address of its declaration.
+
+        Each let command has a frame with one slot per constant and
+        variable it declares, in declaration order, and each function
+        a frame with one slot per parameter. A frame nested d frames
+        deep is frame d at run time, the outermost being 0, so a name is
+        addressed by (depth, slot). A function is visible from its own
+        declaration on, including its body. resolve() sets:
+
+            LetCommand.size                  number of slots in its frame
+            ConstDeclaration.slot,
+            VarDeclaration.slot              slot it declares
+            FunctionDeclaration.depth,
+            FunctionDeclaration.size         its parameter frame
+            FunctionDeclaration.index        its index in self.functions
+            Vname.depth, Vname.slot          address of the name
+            CallCommand.function,
+            CallExpression.function          FunctionDeclaration called
+
+        and raises ResolveError listing every undeclared name, misused
+        name, call with the wrong number of arguments and return
+        outside a function.
+
+        Hash-consed trees share one Vname or CallExpression between all
+        uses of a name, which need not all resolve alike. A node that
+        already has a different address or function is copied, together
+        with the expressions holding it, so sharing is kept wherever the
+        addresses agree.
+    """
+
+    def __init__(self, tree, lines=None):
+        self.tree = tree
+        self.lines = lines
+        # {name: slot or FunctionDeclaration} and the number of slots of
+        # each enclosing frame, outermost first.
+        self.scopes = []
+        self.sizes = []
+        self.problems = []
+        # Every FunctionDeclaration, by index.
+        self.functions = []
+        # Number of function bodies the walk is in.
+        self.nesting = 0
+
+        self.commands = self.dispatch_table({
+            ast.LetCommand: self.resolve_let_command,
+            ast.BlockCommand: self.resolve_block_command,
+            ast.SequentialCommand: self.resolve_seq_command,
+            ast.AssignCommand: self.resolve_assign_command,
+            ast.CallCommand: self.resolve_call_command,
+            ast.ReturnCommand: self.resolve_return_command,
+            ast.WhileCommand: self.resolve_while_command,
+            ast.IfCommand: self.resolve_if_command}, self.resolve_other_node)
+        self.declarations = self.dispatch_table({
+            ast.VarDeclaration: self.resolve_var_declaration,
+            ast.ConstDeclaration: self.resolve_const_declaration,
+            ast.BlockDeclaration: self.resolve_block_declaration,
+            ast.SequentialDeclaration: self.resolve_seq_declaration,
+            ast.FunctionDeclaration: self.resolve_function_declaration}, self.resolve_other_node)
+        self.expressions = self.dispatch_table({
+            ast.IntegerExpression: self.resolve_integer_expression,
+            ast.VnameExpression: self.resolve_vname_expression,
+            ast.CallExpression: self.resolve_call_expression,
+            ast.UnaryExpression: self.resolve_unary_expression,
+            ast.BinaryExpression: self.resolve_binary_expression}, self.resolve_expression_fields)
+
+    def resolve(self):
+        """Annotate the tree and return it."""
+
+        tree = self.tree
+        if type(tree) is ast.Program:
+            tree = tree.command
+        if tree is not None:
+            self.resolve_command(tree)
+        if self.problems:
+            raise ResolveError(self.problems, self.lines)
+        return self.tree
+
+    def resolve_functions(self):
+        """Annotate the tree and return its FunctionDeclarations by index."""
+
+        self.resolve()
+        return self.functions
+
+    def declare(self, name):
+        """Return a new slot for name in the innermost frame."""
+
+        slot = self.sizes[-1]
+        self.sizes[-1] += 1
+        self.scopes[-1][name] = slot
+        return slot
+
+    def lookup(self, name):
+        """Return (depth, slot or FunctionDeclaration) for name, or
+        (None, None) if it is not declared.
+        """
+
+        for depth in xrange(len(self.scopes) - 1, -1, -1):
+            binding = self.scopes[depth].get(name)
+            if binding is not None:
+                return depth, binding
+        return None, None
+
+    def resolve_function(self, tree):
+        """Return the FunctionDeclaration the call tree names, or None
+        after recording why there is none.
+        """
+
+        depth, decl = self.lookup(tree.identifier)
+        if decl is None:
+            self.problems.append((tree, 'undeclared %s' % tree.identifier))
+        elif type(decl) is not ast.FunctionDeclaration:
+            self.problems.append((tree, '%s is not a function' % tree.identifier))
+        else:
+            given = len(arguments(tree.expression))
+            if given != decl.size:
+                self.problems.append((tree, '%s takes %d arguments, %d given' %
+                                      (tree.identifier, decl.size, given)))
+            return decl
+        return None
+
+    def resolve_vname(self, vname):
+        """Return vname, or a copy of it, holding its address."""
+
+        depth, slot = self.lookup(vname.identifier)
+        if slot is None:
+            self.problems.append((vname, 'undeclared %s' % vname.identifier))
+            return vname
+        if type(slot) is not int:
+            self.problems.append((vname, '%s is a function' % vname.identifier))
+            return vname
+
+        if getattr(vname, 'depth', None) is not None:
+            if vname.depth == depth and vname.slot == slot:
+                return vname
+            vname = copy_node(vname)
+        vname.depth = depth
+        vname.slot = slot
+        return vname
+
+    def resolve_other_node(self, tree):
+        pass
+
+    def resolve_command(self, tree):
+        return self.commands[tree.kind](tree)
+
+    def resolve_let_command(self, tree):
+        self.scopes.append({})
+        self.sizes.append(0)
+        self.resolve_declaration(tree.declaration)
+        self.resolve_command(tree.command)
+        tree.size = self.sizes.pop()
+        self.scopes.pop()
+
+    def resolve_block_command(self, tree):
+        for cmd in tree.commands:
+            self.resolve_command(cmd)
+
+    def resolve_seq_command(self, tree):
+        self.resolve_command(tree.command1)
+        self.resolve_command(tree.command2)
+
+    def resolve_assign_command(self, tree):
+        tree.expression = self.resolve_expression(tree.expression)
+        tree.variable = self.resolve_vname(tree.variable)
+
+    def resolve_call_command(self, tree):
+        tree.expression = self.resolve_expression(tree.expression)
+        if tree.identifier in BUILTINS and self.lookup(tree.identifier)[1] is None:
+            tree.function = None
+        else:
+            tree.function = self.resolve_function(tree)
+
+    def resolve_return_command(self, tree):
+        tree.expression = self.resolve_expression(tree.expression)
+        if not self.nesting:
+            self.problems.append((tree, 'return outside a function'))
+
+    def resolve_while_command(self, tree):
+        tree.expression = self.resolve_expression(tree.expression)
+        self.resolve_command(tree.command)
+
+    def resolve_if_command(self, tree):
+        tree.expression = self.resolve_expression(tree.expression)
+        self.resolve_command(tree.command1)
+        self.resolve_command(tree.command2)
+
+    def resolve_declaration(self, tree):
+        return self.declarations[tree.kind](tree)
+
+    def resolve_var_declaration(self, tree):
+        tree.slot = self.declare(tree.identifier)
+
+    def resolve_const_declaration(self, tree):
+        # The value is computed before the name exists.
+        tree.expression = self.resolve_expression(tree.expression)
+        tree.slot = self.declare(tree.identifier)
+
+    def resolve_block_declaration(self, tree):
+        for decl in tree.declarations:
+            self.resolve_declaration(decl)
+
+    def resolve_seq_declaration(self, tree):
+        self.resolve_declaration(tree.decl1)
+        self.resolve_declaration(tree.decl2)
+
+    def resolve_function_declaration(self, tree):
+        # Declared first, so that the body can call it.
+        self.scopes[-1][tree.name] = tree
+        tree.index = len(self.functions)
+        self.functions.append(tree)
+
+        tree.depth = len(self.scopes)
+        self.scopes.append({})
+        self.sizes.append(0)
+        for name in parameters(tree):
+            self.declare(name)
+        tree.size = self.sizes[-1]
+        self.nesting += 1
+        self.resolve_command(tree.command)
+        self.nesting -= 1
+        self.sizes.pop()
+        self.scopes.pop()
+
+    def resolve_expression(self, tree):
+        """Return tree, or a copy of it if a name in it had to be copied."""
+
+        if tree is None:
+            return tree
+        return self.expressions[tree.kind](tree)
+
+    def resolve_integer_expression(self, tree):
+        return tree
+
+    def resolve_unary_expression(self, tree):
+        expr = self.resolve_expression(tree.expression)
+        if expr is not tree.expression:
+            tree = copy_node(tree)
+            tree.expression = expr
+        return tree
+
+    def resolve_binary_expression(self, tree):
+        expr1 = self.resolve_expression(tree.expr1)
+        expr2 = self.resolve_expression(tree.expr2)
+        if expr1 is not tree.expr1 or expr2 is not tree.expr2:
+            tree = copy_node(tree)
+            tree.expr1 = expr1
+            tree.expr2 = expr2
+        return tree
+
+    def resolve_vname_expression(self, tree):
+        vname = self.resolve_vname(tree.variable)
+        if vname is not tree.variable:
+            tree = copy_node(tree)
+            tree.variable = vname
+        return tree
+
+    def resolve_call_expression(self, tree):
+        tree = self.resolve_expression_fields(tree)
+        decl = self.resolve_function(tree)
+        if decl is not None:
+            if getattr(tree, 'function', None) not in (None, decl):
+                tree = copy_node(tree)
+            tree.function = decl
+        return tree
+
+    def resolve_expression_fields(self, tree):
+        # Arguments of calls.
+        changed = []
+        for name in tree._fields:
+            value = getattr(tree, name)
+            if type(value) is list:
+                items = [self.resolve_expression(item) for item in value]
+                if [a for a, b in zip(items, value) if a is not b]:
+                    changed.append((name, items))
+            elif isinstance(value, ast.AST):
+                item = self.resolve_expression(value)
+                if item is not value:
+                    changed.append((name, item))
+        if changed:
+            tree = copy_node(tree)
+            for name, value in changed:
+                setattr(tree, name, value)
+        return tree
+
+
+if __name__ == '__main__':
+    import parser
+    import scanner
+
+    src = """
+let
+    var x: Integer;
+    const c ~ 7;
+in
+    begin
+        x := c;
+        let
+            var y: Integer;
+            var x: Integer;
+        in
+            begin
+                x := y + c;
+                y := x;
+            end
+        putint(x);
+        putint(z);
+    end
+"""
+    scanner_obj = scanner.Scanner(src)
+    tree = parser.Parser(scanner_obj.scan(), scanner_obj.lines, hashcons=True).parse()
+    try:
+        Resolver(tree, scanner_obj.lines).resolve()
+    except ResolveError as e:
+        print e
+
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if type(node) is ast.Vname:
+            print '%-3s line %d col %2d  ->  %s' % ((node.identifier,) +
+                scanner_obj.lines.lookup(node.pos) +
+                ((getattr(node, 'depth', None), getattr(node, 'slot', None)),))
+        for name, value in reversed(list(ast.iter_fields(node))):
+            if type(value) is list:
+                stack.extend(reversed(value))
+            elif isinstance(value, ast.AST):
+                stack.append(value)
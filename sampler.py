@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+#
+# Sampling profiler for Mini Triangle programs
+
+import getopt
+import signal
+import sys
+
+import astfile
+import codegen
+import parser
+import resolver
+import scanner
+evaluator = __import__('eval')
+
+
+# Name of the main program in stacks.
+MAIN = '<main>'
+
+# Code objects of the Evaluator methods whose Python frames tell where
+# a program is: calls, the main program, and commands.
+CALL_CODE = evaluator.Evaluator.call.im_func.func_code
+RUN_CODE = evaluator.Evaluator.run.im_func.func_code
+COMMAND_CODES = frozenset([getattr(evaluator.Evaluator, name).im_func.func_code
+                           for name in dir(evaluator.Evaluator)
+                           if name.startswith('eval_') and name.endswith('_command')])
+
+
+class Sampler(object):
+    """ Records where a Mini Triangle program is every interval seconds
+        of CPU time.
+
+        start() sets an ITIMER_PROF timer whose SIGPROF handler walks
+        the Python stack of the interrupted program and turns it into a
+        Mini Triangle call stack: a tuple of (function, line, line of
+        its declaration), outermost first, line being the statement it
+        is at. Frames of an Evaluator are recognized by their code
+        objects and read the function and statement from their locals,
+        frames of CodeGen functions by their co_filename, which must be
+        filename, and give their line numbers. Nothing is changed in
+        either, so there is no cost until start() and little after.
+
+        self.samples counts the samples taken of each stack.
+    """
+
+    def __init__(self, lines=None, filename=None, interval=0.005):
+        self.lines = lines
+        self.filename = filename
+        self.interval = interval
+        self.samples = {}
+        self.previous = None
+
+    def start(self):
+        self.previous = signal.signal(signal.SIGPROF, self.sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, self.previous or signal.SIG_DFL)
+
+    def run(self, func):
+        """Call func() while sampling and return its result."""
+
+        self.start()
+        try:
+            return func()
+        finally:
+            self.stop()
+
+    def sample(self, signum, frame):
+        stack = self.stack(frame)
+        if stack:
+            self.samples[stack] = self.samples.get(stack, 0) + 1
+
+    def line(self, node, default=0):
+        """Return the source line of node, or default."""
+
+        pos = evaluator.position(node)
+        if pos is None or self.lines is None:
+            return default
+        return self.lines.lookup(pos)[0]
+
+    def stack(self, frame):
+        """Return the Mini Triangle call stack of the Python frame."""
+
+        entries = []
+        # The innermost command the Evaluator is running in the
+        # function found next.
+        node = None
+        while frame is not None:
+            code = frame.f_code
+            if code in COMMAND_CODES:
+                if node is None:
+                    node = frame.f_locals.get('tree')
+            elif code is CALL_CODE:
+                decl = frame.f_locals['decl']
+                first = self.line(decl)
+                entries.append((decl.name, self.line(node, first), first))
+                node = None
+            elif code is RUN_CODE:
+                entries.append((MAIN, self.line(node, 1), 1))
+                node = None
+            elif code.co_filename == self.filename:
+                name = code.co_name
+                if name == 'gencode':
+                    name = MAIN
+                entries.append((name, frame.f_lineno, code.co_firstlineno))
+            frame = frame.f_back
+        entries.reverse()
+        return tuple(entries)
+
+    def write_folded(self, out):
+        """Write the samples as folded stacks, the input of flamegraph.pl:
+        one line per stack, its frames function:line separated by ';',
+        then its number of samples.
+        """
+
+        lines = []
+        for stack, count in self.samples.iteritems():
+            lines.append('%s %d\n' % (';'.join(['%s:%d' % (name, line)
+                                                for name, line, first in stack]), count))
+        out.writelines(sorted(lines))
+
+    def write_callgrind(self, out):
+        """Write the samples in callgrind format, for KCachegrind.
+
+        A function's own cost is the samples it is innermost in, by line.
+        A call's cost is the samples taken under it, and its count the
+        number of those samples, as a sampler cannot count calls.
+        """
+
+        # {(function, first line): {line: own samples}} and
+        # {(caller, line, callee): samples}.
+        own = {}
+        calls = {}
+        for stack, count in self.samples.iteritems():
+            for i, (name, line, first) in enumerate(stack):
+                lines = own.setdefault((name, first), {})
+                if i == len(stack) - 1:
+                    lines[line] = lines.get(line, 0) + count
+                else:
+                    callee = stack[i + 1]
+                    key = ((name, first), line, (callee[0], callee[2]))
+                    calls[key] = calls.get(key, 0) + count
+
+        out.write('# callgrind format\nversion: 1\ncreator: mini triangle sampler\n')
+        out.write('positions: line\nevents: Samples\n')
+        out.write('summary: %d\n' % sum(self.samples.itervalues()))
+        out.write('fl=%s\n' % (self.filename or '???'))
+        for function in sorted(own):
+            out.write('\nfn=%s\n' % function[0])
+            for line, count in sorted(own[function].iteritems()):
+                if count:
+                    out.write('%d %d\n' % (line, count))
+            for (caller, line, callee), count in sorted(calls.iteritems()):
+                if caller == function:
+                    out.write('cfn=%s\ncalls=%d %d\n%d %d\n' %
+                              (callee[0], count, callee[1], line, count))
+
+
+if __name__ == '__main__':
+    # Usage: python sampler.py [--no-cache] [--engine=tree|codegen] [--interval=S]
+    #                          [--folded=file] [--callgrind=file] file.mt
+    opts, args = getopt.getopt(sys.argv[1:], '', ['no-cache', 'engine=', 'interval=',
+                                                  'folded=', 'callgrind='])
+    opts = dict(opts)
+    engine = opts.get('--engine', 'tree')
+    if len(args) != 1 or engine not in ('tree', 'codegen'):
+        print ('Usage: python sampler.py [--no-cache] [--engine=tree|codegen] [--interval=S] '
+               '[--folded=file] [--callgrind=file] file.mt')
+        sys.exit(2)
+
+    try:
+        tree, lines = astfile.parse_file(args[0], cache='--no-cache' not in opts)
+        if engine == 'codegen':
+            program = codegen.CodeGen(tree, lines, args[0]).generate()
+        else:
+            program = evaluator.Evaluator(tree, lines).run
+    except (IOError, scanner.ScannerError, parser.ParserError, codegen.CodeGenError) as e:
+        print e
+        sys.exit(1)
+
+    sampler = Sampler(lines, args[0], float(opts.get('--interval', 0.005)))
+    status = 0
+    try:
+        sampler.run(program)
+    except (evaluator.EvalError, resolver.ResolveError) as e:
+        print e
+        status = 1
+
+    if '--folded' in opts:
+        with open(opts['--folded'], 'w') as f:
+            sampler.write_folded(f)
+    if '--callgrind' in opts:
+        with open(opts['--callgrind'], 'w') as f:
+            sampler.write_callgrind(f)
+    if '--folded' not in opts and '--callgrind' not in opts:
+        sampler.write_folded(sys.stdout)
+    sys.exit(status)
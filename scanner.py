@@ -2,7 +2,12 @@
 #
 # Scanner for Mini Triangle
 
+import array
+import bisect
 import cStringIO as StringIO
+import mmap
+import os
+import re
 import string
 
 # Token Constants
@@ -57,15 +62,22 @@ TOKENS = {TK_IDENTIFIER: 'IDENTIFIER',
           TK_RETURN:     'RETURN',
           TK_COMMA:      'COMMA'}
 
+# Token types whose value is their text in the input.
+VALUED_TOKENS = frozenset([TK_IDENTIFIER, TK_INTLITERAL, TK_OPERATOR])
+
 class Token(object):
     """ A simple Token structure.
         
-        Contains the token type, value and position. 
+        Contains the token type, value and position. Identifier tokens
+        also carry the symbol ID of their name, see SymbolTable.
     """
-    def __init__(self, type, val, pos):
+    __slots__ = ('type', 'val', 'pos', 'sym')
+
+    def __init__(self, type, val, pos, sym=-1):
         self.type = type
         self.val = val
         self.pos = pos
+        self.sym = sym
 
     def __str__(self):
         return '(%s(%s) at %s)' % (TOKENS[self.type], self.val, self.pos)
@@ -74,17 +86,201 @@ class Token(object):
         return self.__str__()
 
 
+class SymbolTable(object):
+    """ Interned identifier names.
+
+        Every distinct name gets a dense integer ID, counted from 0 in
+        order of first appearance, and is stored once as an interned
+        string. names[id] maps an ID back to its name.
+    """
+    __slots__ = ('names', 'ids')
+
+    def __init__(self):
+        self.names = []
+        self.ids = {}
+
+    def intern(self, name):
+        """Return the symbol ID of name, adding it if it is new."""
+
+        sym = self.ids.get(name)
+        if sym is None:
+            name = intern(name)
+            sym = len(self.names)
+            self.names.append(name)
+            self.ids[name] = sym
+        return sym
+
+    def name(self, sym):
+        return self.names[sym]
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.ids
+
+
+class TokenBuffer(object):
+    """ A compact struct of arrays token store.
+
+        Token types and the start and end positions of each token are
+        kept in array('i') columns, along with the symbol ID of each
+        identifier. Values are not copied out of the input text; literals
+        and operators are sliced from it on demand by val(), identifier
+        names come from the SymbolTable.
+
+        Indexing or iterating a TokenBuffer builds Token objects on the
+        fly, so a Parser can consume it directly.
+    """
+    __slots__ = ('source', 'symbols', 'types', 'starts', 'ends', 'syms')
+
+    def __init__(self, source, symbols):
+        self.source = source
+        self.symbols = symbols
+        self.types = array.array('i')
+        self.starts = array.array('i')
+        self.ends = array.array('i')
+        self.syms = array.array('i')
+
+    def append(self, type, start, end, sym=-1):
+        self.types.append(type)
+        self.starts.append(start)
+        self.ends.append(end)
+        self.syms.append(sym)
+
+    def __len__(self):
+        return len(self.types)
+
+    def type(self, i):
+        return self.types[i]
+
+    def pos(self, i):
+        return self.starts[i]
+
+    def val(self, i):
+        type = self.types[i]
+        if type == TK_IDENTIFIER:
+            return self.symbols.names[self.syms[i]]
+        elif type in VALUED_TOKENS:
+            return self.source[self.starts[i]:self.ends[i]]
+        return 0
+
+    def sym(self, i):
+        return self.syms[i]
+
+    def __getitem__(self, i):
+        return Token(self.types[i], self.val(i), self.starts[i], self.syms[i])
+
+    def __iter__(self):
+        for i in xrange(len(self.types)):
+            yield self[i]
+
+    def __str__(self):
+        return str(list(self))
+
+    def __repr__(self):
+        return self.__str__()
+
+
+def bisect_tokens(tokens, pos):
+    """Return the number of tokens in the list tokens that start before pos."""
+
+    lo = 0
+    hi = len(tokens)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if tokens[mid].pos < pos:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def shift_tokens(tokens, start, delta):
+    """Add delta to the positions of tokens[start:].
+
+    Tokens hold absolute positions, so this costs one step per token
+    after start, whatever the size of the edit that moved them.
+    """
+
+    for i in xrange(start, len(tokens)):
+        tokens[i].pos += delta
+
+
+class LineIndex(object):
+    """ Start positions of the lines of an input text.
+
+        The Scanner adds the start of each new line as it scans, so
+        lookup() can turn a position into a line and column with a
+        binary search instead of rescanning the text.
+    """
+    __slots__ = ('starts',)
+
+    def __init__(self):
+        self.starts = [0]
+
+    @classmethod
+    def from_text(cls, text):
+        """Return the LineIndex of text without scanning it."""
+
+        lines = cls()
+        nl = text.find('\n')
+        while nl >= 0:
+            lines.add(nl + 1)
+            nl = text.find('\n', nl + 1)
+        return lines
+
+    def reset(self):
+        """Forget every line but the first."""
+
+        del self.starts[1:]
+
+    def add(self, pos):
+        """Record that a new line starts at pos."""
+
+        self.starts.append(pos)
+
+    def edit(self, offset, deleted, inserted):
+        """Update the line starts after the deleted characters starting
+        at offset were replaced by the string inserted.
+        """
+
+        starts = self.starts
+        end = offset + deleted
+        delta = len(inserted) - deleted
+        new = []
+        nl = inserted.find('\n')
+        while nl >= 0:
+            new.append(offset + nl + 1)
+            nl = inserted.find('\n', nl + 1)
+        lo = bisect.bisect_right(starts, offset)
+        hi = bisect.bisect_right(starts, end)
+        new.extend([start + delta for start in starts[hi:]])
+        starts[lo:] = new
+
+    def lookup(self, pos):
+        """Return the (line, column) of pos, both counted from 1."""
+
+        line = bisect.bisect_right(self.starts, pos)
+        return line, pos - self.starts[line - 1] + 1
+
+
 class ScannerError(Exception):
     """ Scanner error exception.
 
         pos: position in the input text where the error occurred.
+        lines: optional LineIndex used to report the line and column.
     """
-    def __init__(self, pos, char):
+    def __init__(self, pos, char, lines=None):
         self.pos = pos
         self.char = char
+        self.lines = lines
 
     def __str__(self):
-        return 'ScannerError at pos = %d, char = %s' % (self.pos, self.char)
+        msg = 'ScannerError at pos = %d, char = %s' % (self.pos, self.char)
+        if self.lines is not None:
+            msg += ' (line %d, col %d)' % self.lines.lookup(self.pos)
+        return msg
 
 class Scanner(object):
     """Implement a scanner for the following token grammar
@@ -98,6 +294,14 @@ class Scanner(object):
 
     operators = ['+', '-', '*', '/', '<', '>', '=', '\\']
 
+    punctuation = {':=': TK_BECOMES,
+                   ':' : TK_COLON,
+                   ';' : TK_SEMICOLON,
+                   '~' : TK_IS,
+                   '(' : TK_LPAREN,
+                   ')' : TK_RPAREN,
+                   ',' : TK_COMMA}
+
     keywords = {'begin' : TK_BEGIN,
                 'const' : TK_CONST,
                 'do'    : TK_DO,
@@ -112,13 +316,54 @@ class Scanner(object):
                 'func'  : TK_FUNCDEF,
                 'return': TK_RETURN }
 
-    def __init__(self, input):
-        # Use StringIO to treat input string like a file.
-        self.inputstr = StringIO.StringIO(input)
-        self.eot = False   # Are we at the end of the input text?
-        self.pos = 0       # Position in the input text
-        self.char = ''     # The current character from the input text
-        self.char_take()   # Fill self.char with the first character
+    # Scanning engines: 'regex' matches whole tokens with token_re over the
+    # complete input, 'char' is the original one character at a time scanner.
+    engines = ('regex', 'char')
+
+    # Master pattern for the regex engine. The number of the group that
+    # matched tells iter_regex() what kind of token was found.
+    token_re = re.compile(r"""
+          (\s+|![^\n]*\n?)          # 1: separator (blanks and comments)
+        | ([A-Za-z][A-Za-z0-9]*)    # 2: identifier or keyword
+        | ([0-9]+)                  # 3: integer literal
+        | ([-+*/<>=\\])             # 4: operator
+        | (:=|[:;~(),])             # 5: punctuation
+        | (.)                       # 6: anything else is an error
+    """, re.VERBOSE | re.DOTALL)
+
+    def __init__(self, input, engine='regex'):
+        # input is a string or a memory mapped buffer, see from_file().
+        if engine not in Scanner.engines:
+            raise ValueError('unknown scanner engine: %r' % (engine,))
+        self.input = input
+        self.engine = engine
+        self.lines = LineIndex()
+        self.symbols = SymbolTable()
+        if engine == 'char':
+            # Use StringIO to treat input string like a file.
+            self.inputstr = StringIO.StringIO(input)
+            self.eot = False   # Are we at the end of the input text?
+            self.pos = 0       # Position in the input text
+            self.char = ''     # The current character from the input text
+            self.char_take()   # Fill self.char with the first character
+
+    @classmethod
+    def from_file(cls, path, engine='regex'):
+        """Return a Scanner over the file at path.
+
+        The file is memory mapped read-only, so it is never copied into a
+        Python string as a whole.
+        """
+
+        f = open(path, 'rb')
+        try:
+            if os.fstat(f.fileno()).st_size == 0:
+                # Empty files cannot be mapped.
+                return cls('', engine)
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+        return cls(buf, engine)
 
     def scan(self):
         """Main entry point to scanner object.
@@ -126,13 +371,200 @@ class Scanner(object):
         Return a list of Tokens.
         """
 
-        self.tokens = []
+        self.tokens = list(self.iter_tokens())
+        return self.tokens
+
+    def scan_buffer(self):
+        """Scan the input text into a TokenBuffer instead of a list of
+        Token objects.
+        """
+
+        buf = TokenBuffer(self.input, self.symbols)
+
+        if self.engine != 'regex':
+            for token in self.iter_chars():
+                if token.type in VALUED_TOKENS:
+                    buf.append(token.type, token.pos, token.pos + len(token.val), token.sym)
+                else:
+                    buf.append(token.type, token.pos, token.pos)
+            return buf
+
+        input = self.input
+        lines = self.lines
+        lines.reset()
+        types = buf.types
+        starts = buf.starts
+        ends = buf.ends
+        syms = buf.syms
+        symbols = self.symbols
+        keywords = Scanner.keywords
+        punctuation = Scanner.punctuation
+
+        for m in Scanner.token_re.finditer(input):
+            group = m.lastindex
+            if group == 1:
+                start, end = m.span()
+                nl = input.find('\n', start, end)
+                while nl >= 0:
+                    lines.add(nl + 1)
+                    nl = input.find('\n', nl + 1, end)
+                continue
+            elif group == 2:
+                ident = m.group(2)
+                if ident in keywords:
+                    types.append(keywords[ident])
+                    syms.append(-1)
+                else:
+                    types.append(TK_IDENTIFIER)
+                    syms.append(symbols.intern(ident))
+            elif group == 3:
+                types.append(TK_INTLITERAL)
+                syms.append(-1)
+            elif group == 4:
+                types.append(TK_OPERATOR)
+                syms.append(-1)
+            elif group == 5:
+                types.append(punctuation[m.group(5)])
+                syms.append(-1)
+            else:
+                raise ScannerError(m.start(), m.group(6), lines)
+            start, end = m.span()
+            starts.append(start)
+            ends.append(end)
+
+        buf.append(TK_EOT, len(input), len(input))
+        return buf
+
+    def iter_tokens(self):
+        """Generate the Tokens of the input text one at a time.
+
+        The last Token generated is always TK_EOT. Nothing is kept in
+        memory besides the input text itself.
+        """
+
+        if self.engine == 'regex':
+            return self.iter_regex()
+        else:
+            return self.iter_chars()
+
+    def iter_regex(self, start=None, input=None):
+        """Generate Tokens by matching token_re over the input text, or
+        over input if given.
+
+        When start is given, scanning begins at that position and line
+        starts are not recorded.
+        """
+
+        if input is None:
+            input = self.input
+        if start is None:
+            start = 0
+            lines = self.lines
+            lines.reset()
+        else:
+            lines = None
+        symbols = self.symbols
+        keywords = Scanner.keywords
+        punctuation = Scanner.punctuation
+
+        for m in Scanner.token_re.finditer(input, start):
+            group = m.lastindex
+            if group == 1:
+                if lines is not None:
+                    sep_start, sep_end = m.span()
+                    nl = input.find('\n', sep_start, sep_end)
+                    while nl >= 0:
+                        lines.add(nl + 1)
+                        nl = input.find('\n', nl + 1, sep_end)
+                continue
+            elif group == 2:
+                ident = m.group(2)
+                if ident in keywords:
+                    yield Token(keywords[ident], 0, m.start())
+                else:
+                    sym = symbols.intern(ident)
+                    yield Token(TK_IDENTIFIER, symbols.names[sym], m.start(), sym)
+            elif group == 3:
+                yield Token(TK_INTLITERAL, m.group(3), m.start())
+            elif group == 4:
+                yield Token(TK_OPERATOR, m.group(4), m.start())
+            elif group == 5:
+                yield Token(punctuation[m.group(5)], 0, m.start())
+            else:
+                raise ScannerError(m.start(), m.group(6), lines)
+
+        yield Token(TK_EOT, 0, len(input))
+
+    def rescan(self, tokens, offset, deleted, inserted):
+        """Re-tokenize the input text after an edit.
+
+        The edit replaces the deleted characters starting at offset with
+        the string inserted. tokens must be the token list of the text
+        before the edit; it is updated in place.
+
+        Tokens before the edit only depend on the text before them, so
+        scanning restarts at the last token that starts before offset.
+        It stops as soon as a new token starts where an old token after
+        the edit now starts, because from there on the remaining text is
+        unchanged. The remaining old Tokens are kept and their positions
+        shifted. The text is always rescanned with token_re.
+
+        Scanning costs O(size of the edit), but shifting the tokens after
+        it with shift_tokens() costs O(tokens after the edit), so an edit
+        near the top of a large file is the slowest; copying the text and
+        its line starts is O(file) too, but done in C. bench.py rescan
+        measures edits at both ends and the shift alone.
+
+        Return (first, old_stop, new_stop): the old tokens[first:old_stop]
+        were replaced by the new tokens[first:new_stop].
+        """
+
+        input = self.input
+        end = offset + deleted
+        if offset < 0 or deleted < 0 or end > len(input):
+            raise ValueError('edit out of range: %d+%d' % (offset, deleted))
+        delta = len(inserted) - deleted
+
+        first = bisect_tokens(tokens, offset) - 1
+        if first < 0:
+            first = 0
+            restart = 0
+        else:
+            restart = tokens[first].pos
+
+        # The scanner only takes the new text once it has scanned
+        # without error, so a failed rescan leaves it unchanged.
+        input = input[:offset] + inserted + input[end:]
+        lines = LineIndex()
+        lines.starts = self.lines.starts[:]
+        lines.edit(offset, deleted, inserted)
+
+        new = []
+        old_stop = bisect_tokens(tokens, end)
+        for token in self.iter_regex(restart, input):
+            while tokens[old_stop].pos + delta < token.pos:
+                old_stop += 1
+            if tokens[old_stop].pos + delta == token.pos:
+                break
+            new.append(token)
+
+        self.input = input
+        self.lines.starts[:] = lines.starts
+
+        shift_tokens(tokens, old_stop, delta)
+        tokens[first:old_stop] = new
+        return first, old_stop, first + len(new)
+
+    def iter_chars(self):
+        """Generate Tokens by reading the input text one character at
+        a time.
+        """
+
         while True:
             token = self.scan_token()
-            self.tokens.append(token)
+            yield token
             if token.type == TK_EOT:
                 break
-        return self.tokens
 
     def scan_token(self):
         """Scan a single token from input text."""
@@ -147,9 +579,10 @@ class Scanner(object):
                 continue
             elif c == '!':
                 self.char_take()
-                while self.char_current() != '\n':
+                while self.char_current() != '\n' and not self.char_eot():
+                    self.char_take()
+                if not self.char_eot():
                     self.char_take()
-                self.char_take()
                 c = self.char_current()
                 continue
             elif c.isalpha():
@@ -191,8 +624,8 @@ class Scanner(object):
                 token = Token(TK_COMMA, 0, self.char_pos())
                 self.char_take()
                 break
-
-            return token
+            else:
+                raise ScannerError(self.char_pos(), c, self.lines)
 
         if token is not None:
             return token
@@ -210,7 +643,8 @@ class Scanner(object):
         if ident in Scanner.keywords:
             return Token(Scanner.keywords[ident], 0, pos)
         else:
-            return Token(TK_IDENTIFIER, ident, pos)
+            sym = self.symbols.intern(ident)
+            return Token(TK_IDENTIFIER, self.symbols.names[sym], pos, sym)
 
     def scan_intliteral(self):
         pos = self.char_pos()
@@ -231,7 +665,7 @@ class Scanner(object):
         """Consume the current character and read the next character 
         from the input text.
 
-        Update self.char, self.eot, and self.pos
+        Update self.char, self.eot, self.pos and self.lines
         """
 
         char_prev = self.char
@@ -241,6 +675,8 @@ class Scanner(object):
             self.eot = True
 
         self.pos += 1
+        if char_prev == '\n':
+            self.lines.add(self.pos - 1)
 
         return char_prev
 
@@ -0,0 +1,643 @@
+#!/usr/bin/env python
+#
+# Stack based virtual machine for Mini Triangle
+
+import array
+import getopt
+import struct
+import sys
+
+import ast
+import astfile
+import parser
+import resolver
+import scanner
+
+
+# Opcodes, roughly by how often they run; the interpreter loop tests
+# them in this order.
+LOAD_FAST     = 0   # push locals[arg]
+LOAD_CONST    = 1   # push consts[arg]
+STORE_FAST    = 2   # locals[arg] = pop()
+ADD           = 3
+ADD_CONST     = 4   # add consts[arg] to the top of the stack
+SUB_CONST     = 5
+JUMP_IF_LT    = 6   # pop b and a, jump to arg if a < b
+JUMP_IF_GT    = 7
+JUMP_IF_EQ    = 8
+MUL           = 9
+SUB           = 10
+MOD           = 11
+JUMP          = 12  # jump to arg
+CALL          = 13  # call functions[arg], its arguments on the stack
+RETURN        = 14  # return pop() to the caller
+LOAD_GLOBAL   = 15  # push the main program's locals[arg]
+STORE_GLOBAL  = 16
+DIV           = 17
+LT            = 18
+GT            = 19
+EQ            = 20
+JUMP_IF_TRUE  = 21  # jump to arg if pop() is true
+NEG           = 22
+POS           = 23
+LOAD_OUTER    = 24  # push locals[arg & 0xffff] of the enclosing function
+                    # at level arg >> 16
+STORE_OUTER   = 25
+LOAD_NONE     = 26
+PRINT         = 27  # print pop()
+READ          = 28  # push input()
+POP           = 29
+HALT          = 30
+
+OPNAMES = ['LOAD_FAST', 'LOAD_CONST', 'STORE_FAST', 'ADD', 'ADD_CONST', 'SUB_CONST',
+           'JUMP_IF_LT', 'JUMP_IF_GT', 'JUMP_IF_EQ', 'MUL', 'SUB', 'MOD', 'JUMP', 'CALL',
+           'RETURN', 'LOAD_GLOBAL', 'STORE_GLOBAL', 'DIV', 'LT', 'GT', 'EQ', 'JUMP_IF_TRUE',
+           'NEG', 'POS', 'LOAD_OUTER', 'STORE_OUTER', 'LOAD_NONE', 'PRINT', 'READ', 'POP',
+           'HALT']
+
+JUMPS = frozenset([JUMP_IF_LT, JUMP_IF_GT, JUMP_IF_EQ, JUMP, JUMP_IF_TRUE])
+
+BINARY_OPCODES = {'+' : ADD,
+                  '-' : SUB,
+                  '*' : MUL,
+                  '/' : DIV,
+                  '\\': MOD,
+                  '<' : LT,
+                  '>' : GT,
+                  '=' : EQ}
+
+UNARY_OPCODES = {'-': NEG,
+                 '+': POS}
+
+# Binary operators taking a literal right operand from consts.
+CONST_OPCODES = {'+': ADD_CONST,
+                 '-': SUB_CONST}
+
+# Comparisons that can jump without pushing their result.
+JUMP_OPCODES = {'<': JUMP_IF_LT,
+                '>': JUMP_IF_GT,
+                '=': JUMP_IF_EQ}
+
+# Serialized header: magic, version, byte order, code, constant,
+# function and main locals counts, number of levels and size of the
+# function names.
+MAGIC = 'MTVM'
+VERSION = 1
+HEADER = struct.Struct('<4sBBxxIIIIII')
+
+
+class VMError(Exception):
+    """ Raised when a program cannot be compiled, or a code file loaded """
+
+    def __init__(self, msg):
+        self.msg = msg
+
+    def __str__(self):
+        return 'VMError: %s' % self.msg
+
+
+class Code(object):
+    """ A compiled program.
+
+        code is an array('i') of instructions, each an opcode and an
+        operand, so instruction k is code[2 * k:2 * k + 2]. Jump targets
+        and function entries are instruction numbers. The main program
+        starts at 0 and ends with HALT; the functions follow it.
+
+        functions holds (entry, number of parameters, number of locals,
+        level) for each function, by index. Locals are flat per call:
+        the parameters first, then the constants and variables of every
+        let in the body, each let having its own range. The level of the
+        main program is 0 and that of a function one more than that of
+        the code declaring it.
+    """
+
+    __slots__ = ('code', 'consts', 'functions', 'names', 'nlocals', 'levels')
+
+    def __init__(self):
+        self.code = array.array('i')
+        self.consts = []
+        self.functions = []
+        self.names = []
+        self.nlocals = 0
+        self.levels = 1
+
+    def tostring(self):
+        """Return the code serialized as one string."""
+
+        names = '\0'.join(self.names)
+        functions = array.array('i')
+        for function in self.functions:
+            functions.extend(function)
+        header = HEADER.pack(MAGIC, VERSION, sys.byteorder == 'little', len(self.code),
+                             len(self.consts), len(self.functions), self.nlocals,
+                             self.levels, len(names))
+        try:
+            consts = struct.pack('<%dq' % len(self.consts), *self.consts)
+        except struct.error:
+            raise VMError('constant does not fit 64 bits')
+        return ''.join([header, self.code.tostring(), consts, functions.tostring(), names])
+
+    @classmethod
+    def fromstring(cls, data):
+        """Return the Code serialized in the string data."""
+
+        if len(data) < HEADER.size:
+            raise VMError('truncated header')
+        (magic, version, little, ncode, nconsts, nfunctions,
+         nlocals, levels, nnames) = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise VMError('not a version %d code file' % VERSION)
+        itemsize = array.array('i').itemsize
+        if len(data) != HEADER.size + (ncode + 4 * nfunctions) * itemsize + 8 * nconsts + nnames:
+            raise VMError('size mismatch')
+
+        code = cls()
+        code.nlocals = nlocals
+        code.levels = levels
+        offset = HEADER.size
+        code.code.fromstring(data[offset:offset + ncode * itemsize])
+        offset += ncode * itemsize
+        code.consts = list(struct.unpack_from('<%dq' % nconsts, data, offset))
+        offset += 8 * nconsts
+        functions = array.array('i', data[offset:offset + 4 * nfunctions * itemsize])
+        offset += 4 * nfunctions * itemsize
+        if bool(little) != (sys.byteorder == 'little'):
+            code.code.byteswap()
+            functions.byteswap()
+        code.functions = [tuple(functions[i:i + 4]) for i in xrange(0, len(functions), 4)]
+        if nnames:
+            code.names = data[offset:].split('\0')
+        return code
+
+    def dump(self, f):
+        f.write(self.tostring())
+
+    @classmethod
+    def load(cls, f):
+        return cls.fromstring(f.read())
+
+    def instructions(self):
+        """Return the instructions as a list of (opcode, operand) pairs."""
+
+        ops = self.code.tolist()
+        return zip(ops[::2], ops[1::2])
+
+    def disassemble(self, out=sys.stdout):
+        """Write a listing of the instructions to out."""
+
+        entries = {}
+        for i, function in enumerate(self.functions):
+            entries[function[0]] = i
+        code = self.code
+        for pc in xrange(len(code) / 2):
+            if pc in entries:
+                i = entries[pc]
+                entry, nargs, nlocals, level = self.functions[i]
+                out.write('\n%s: %d arguments, %d locals, level %d\n' %
+                          (self.names[i], nargs, nlocals, level))
+            op = code[2 * pc]
+            arg = code[2 * pc + 1]
+            if op in (LOAD_CONST, ADD_CONST, SUB_CONST):
+                note = '(%r)' % self.consts[arg]
+            elif op == CALL:
+                note = '(%s)' % self.names[arg]
+            elif op in JUMPS:
+                note = '(to %d)' % arg
+            elif op in (LOAD_OUTER, STORE_OUTER):
+                note = '(level %d, local %d)' % (arg >> 16, arg & 0xffff)
+            elif op in (LOAD_FAST, STORE_FAST, LOAD_GLOBAL, STORE_GLOBAL):
+                note = ''
+            else:
+                out.write('%6d  %s\n' % (pc, OPNAMES[op]))
+                continue
+            out.write(('%6d  %-14s %5d %s' % (pc, OPNAMES[op], arg, note)).rstrip() + '\n')
+
+
+class Compiler(ast.Visitor):
+    """ Compiles a program into a Code object.
+
+        The names are resolved first with resolver.Resolver. Its
+        frames map onto the flat locals of the code they belong to:
+        self.frames gives (level, index of its first slot) for each
+        frame by depth, so a name's (depth, slot) becomes a local index.
+    """
+
+    def __init__(self, tree, lines=None):
+        self.tree = tree
+        self.lines = lines
+        self.code = Code()
+        self.emit_to = self.code.code
+        self.consts = {}
+        # For the code being compiled: its level, number of locals so
+        # far, frame layout, and number of enclosing while loops.
+        self.level = 0
+        self.nlocals = 0
+        self.frames = []
+        self.loops = 0
+        # (FunctionDeclaration, frames, level) left to compile.
+        self.pending = []
+
+        self.commands = self.dispatch_table({
+            ast.LetCommand: self.compile_let_command,
+            ast.BlockCommand: self.compile_block_command,
+            ast.SequentialCommand: self.compile_seq_command,
+            ast.AssignCommand: self.compile_assign_command,
+            ast.CallCommand: self.compile_call_command,
+            ast.ReturnCommand: self.compile_return_command,
+            ast.WhileCommand: self.compile_while_command,
+            ast.IfCommand: self.compile_if_command}, self.compile_bad_node)
+        self.declarations = self.dispatch_table({
+            ast.VarDeclaration: self.compile_var_declaration,
+            ast.ConstDeclaration: self.compile_const_declaration,
+            ast.BlockDeclaration: self.compile_block_declaration,
+            ast.SequentialDeclaration: self.compile_seq_declaration,
+            ast.FunctionDeclaration: self.compile_function_declaration}, self.compile_bad_node)
+        self.expressions = self.dispatch_table({
+            ast.IntegerExpression: self.compile_integer_expression,
+            ast.VnameExpression: self.compile_vname_expression,
+            ast.CallExpression: self.compile_call_expression,
+            ast.UnaryExpression: self.compile_unary_expression,
+            ast.BinaryExpression: self.compile_binary_expression}, self.compile_bad_node)
+
+    def compile(self):
+        """Return the Code of the program.
+
+        Raises resolver.ResolveError or VMError.
+        """
+
+        if type(self.tree) is not ast.Program:
+            self.compile_bad_node(self.tree)
+        functions = resolver.Resolver(self.tree, self.lines).resolve_functions()
+
+        code = self.code
+        code.functions = [None] * len(functions)
+        code.names = [decl.name for decl in functions]
+        self.compile_command(self.tree.command)
+        self.emit(HALT)
+        code.nlocals = self.nlocals
+
+        while self.pending:
+            decl, self.frames, self.level = self.pending.pop(0)
+            self.frames.append((self.level, 0))
+            self.nlocals = decl.size
+            self.loops = 0
+            entry = self.here()
+            self.compile_command(decl.command)
+            self.emit(LOAD_NONE)
+            self.emit(RETURN)
+            code.functions[decl.index] = (entry, decl.size, self.nlocals, self.level)
+            code.levels = max(code.levels, self.level + 1)
+        return code
+
+    def here(self):
+        """Return the number of the next instruction."""
+
+        return len(self.emit_to) / 2
+
+    def emit(self, op, arg=0):
+        """Append an instruction and return its number."""
+
+        pc = self.here()
+        self.emit_to.append(op)
+        self.emit_to.append(arg)
+        return pc
+
+    def patch(self, pc, target):
+        """Make the jump at pc go to target."""
+
+        self.emit_to[2 * pc + 1] = target
+
+    def const(self, value):
+        """Return the index of value in the constants pool."""
+
+        index = self.consts.get(value)
+        if index is None:
+            index = self.consts[value] = len(self.code.consts)
+            self.code.consts.append(value)
+        return index
+
+    def local(self, depth, slot):
+        """Return (level, local index) of the slot of frame depth."""
+
+        level, first = self.frames[depth]
+        index = first + slot
+        if index > 0xffff:
+            raise VMError('more than %d locals' % 0xffff)
+        return level, index
+
+    def emit_access(self, ops, depth, slot):
+        """Emit the fast, global or outer op of ops for a slot."""
+
+        level, index = self.local(depth, slot)
+        fast, glob, outer = ops
+        if level == self.level:
+            self.emit(fast, index)
+        elif level == 0:
+            self.emit(glob, index)
+        else:
+            self.emit(outer, level << 16 | index)
+
+    def emit_load(self, vname):
+        self.emit_access((LOAD_FAST, LOAD_GLOBAL, LOAD_OUTER), vname.depth, vname.slot)
+
+    def emit_store(self, vname):
+        self.emit_access((STORE_FAST, STORE_GLOBAL, STORE_OUTER), vname.depth, vname.slot)
+
+    def compile_bad_node(self, tree):
+        msg = 'cannot compile %s' % type(tree).__name__
+        pos = getattr(tree, 'pos', None)
+        if self.lines is not None and pos is not None:
+            msg += ' (line %d, col %d)' % self.lines.lookup(pos)
+        raise VMError(msg)
+
+    def compile_command(self, tree):
+        self.commands[tree.kind](tree)
+
+    def compile_let_command(self, tree):
+        self.frames.append((self.level, self.nlocals))
+        self.nlocals += tree.size
+        self.compile_declaration(tree.declaration)
+        self.compile_command(tree.command)
+        self.frames.pop()
+
+    def compile_block_command(self, tree):
+        for cmd in tree.commands:
+            self.compile_command(cmd)
+
+    def compile_seq_command(self, tree):
+        self.compile_command(tree.command1)
+        self.compile_command(tree.command2)
+
+    def compile_assign_command(self, tree):
+        self.compile_expression(tree.expression)
+        self.emit_store(tree.variable)
+
+    def compile_call_command(self, tree):
+        if tree.function is not None:
+            self.compile_call(tree)
+            self.emit(POP)
+        elif tree.identifier == 'putint':
+            self.compile_expression(tree.expression)
+            self.emit(PRINT)
+        elif tree.identifier == 'getint' and type(tree.expression) is ast.VnameExpression:
+            self.emit(READ)
+            self.emit_store(tree.expression.variable)
+        else:
+            self.compile_bad_node(tree)
+
+    def compile_return_command(self, tree):
+        self.compile_expression(tree.expression)
+        self.emit(RETURN)
+
+    def compile_jump_if(self, tree):
+        """Emit a jump taken if the expression tree is true and return
+        its number, for patching.
+        """
+
+        if type(tree) is ast.BinaryExpression and tree.oper in JUMP_OPCODES:
+            self.compile_expression(tree.expr1)
+            self.compile_expression(tree.expr2)
+            return self.emit(JUMP_OPCODES[tree.oper])
+        self.compile_expression(tree)
+        return self.emit(JUMP_IF_TRUE)
+
+    def compile_while_command(self, tree):
+        # The test is at the bottom, so an iteration runs one jump.
+        start = self.emit(JUMP)
+        self.loops += 1
+        self.compile_command(tree.command)
+        self.loops -= 1
+        self.patch(start, self.here())
+        self.patch(self.compile_jump_if(tree.expression), start + 1)
+
+    def compile_if_command(self, tree):
+        # The else branch comes first, so that the test jumps if true.
+        jump_then = self.compile_jump_if(tree.expression)
+        self.compile_command(tree.command2)
+        jump_end = self.emit(JUMP)
+        self.patch(jump_then, self.here())
+        self.compile_command(tree.command1)
+        self.patch(jump_end, self.here())
+
+    def compile_declaration(self, tree):
+        self.declarations[tree.kind](tree)
+
+    def compile_var_declaration(self, tree):
+        # Locals start out as None; only a let run again by a loop
+        # needs to reset them.
+        if self.loops:
+            self.emit(LOAD_NONE)
+            self.emit_access((STORE_FAST, STORE_GLOBAL, STORE_OUTER),
+                             len(self.frames) - 1, tree.slot)
+
+    def compile_const_declaration(self, tree):
+        self.compile_expression(tree.expression)
+        self.emit_access((STORE_FAST, STORE_GLOBAL, STORE_OUTER),
+                         len(self.frames) - 1, tree.slot)
+
+    def compile_block_declaration(self, tree):
+        for decl in tree.declarations:
+            self.compile_declaration(decl)
+
+    def compile_seq_declaration(self, tree):
+        self.compile_declaration(tree.decl1)
+        self.compile_declaration(tree.decl2)
+
+    def compile_function_declaration(self, tree):
+        # Compiled after the code declaring it, with the frames it sees.
+        self.pending.append((tree, self.frames[:], self.level + 1))
+
+    def compile_expression(self, tree):
+        self.expressions[tree.kind](tree)
+
+    def compile_integer_expression(self, tree):
+        self.emit(LOAD_CONST, self.const(tree.value))
+
+    def compile_vname_expression(self, tree):
+        self.emit_load(tree.variable)
+
+    def compile_call(self, tree):
+        for arg in resolver.arguments(tree.expression):
+            self.compile_expression(arg)
+        self.emit(CALL, tree.function.index)
+
+    def compile_call_expression(self, tree):
+        self.compile_call(tree)
+
+    def compile_unary_expression(self, tree):
+        op = UNARY_OPCODES.get(tree.operator)
+        if op is None:
+            self.compile_bad_node(tree)
+        self.compile_expression(tree.expression)
+        self.emit(op)
+
+    def compile_binary_expression(self, tree):
+        op = BINARY_OPCODES.get(tree.oper)
+        if op is None:
+            self.compile_bad_node(tree)
+        self.compile_expression(tree.expr1)
+        if type(tree.expr2) is ast.IntegerExpression and tree.oper in CONST_OPCODES:
+            self.emit(CONST_OPCODES[tree.oper], self.const(tree.expr2.value))
+            return
+        self.compile_expression(tree.expr2)
+        self.emit(op)
+
+
+def execute(code):
+    """Run the Code object code."""
+
+    # The loop reads (opcode, operand) pairs from a list, which is
+    # faster than indexing the array twice, and the opcodes are locals,
+    # which are faster to read than globals.
+    instructions = code.instructions()
+    consts = code.consts
+    functions = code.functions
+    (load_fast, load_const, store_fast, add, add_const, sub_const, jump_if_lt, jump_if_gt,
+     jump_if_eq, mul, sub, mod, jump, call, ret, load_global, store_global, div, lt, gt, eq,
+     jump_if_true, neg, pos, load_outer, store_outer, load_none, prnt, read, pop_top,
+     halt) = range(len(OPNAMES))
+
+    stack = []
+    push = stack.append
+    pop = stack.pop
+    locals_ = [None] * code.nlocals
+    glob = locals_
+    # display[level] holds the locals of the latest call at each level.
+    display = [glob] + [None] * (code.levels - 1)
+    # (return pc, locals, level, display entry replaced) for each call.
+    calls = []
+    pc = 0
+
+    while True:
+        op, arg = instructions[pc]
+        pc += 1
+        if op == load_fast:
+            push(locals_[arg])
+        elif op == load_const:
+            push(consts[arg])
+        elif op == store_fast:
+            locals_[arg] = pop()
+        elif op == add:
+            b = pop()
+            stack[-1] = stack[-1] + b
+        elif op == add_const:
+            stack[-1] = stack[-1] + consts[arg]
+        elif op == sub_const:
+            stack[-1] = stack[-1] - consts[arg]
+        elif op == jump_if_lt:
+            b = pop()
+            if pop() < b:
+                pc = arg
+        elif op == jump_if_gt:
+            b = pop()
+            if pop() > b:
+                pc = arg
+        elif op == jump_if_eq:
+            b = pop()
+            if pop() == b:
+                pc = arg
+        elif op == mul:
+            b = pop()
+            stack[-1] = stack[-1] * b
+        elif op == sub:
+            b = pop()
+            stack[-1] = stack[-1] - b
+        elif op == mod:
+            b = pop()
+            stack[-1] = stack[-1] % b
+        elif op == jump:
+            pc = arg
+        elif op == call:
+            entry, nargs, nlocals, level = functions[arg]
+            frame = [None] * nlocals
+            if nargs:
+                frame[:nargs] = stack[-nargs:]
+                del stack[-nargs:]
+            calls.append((pc, locals_, level, display[level]))
+            display[level] = locals_ = frame
+            pc = entry
+        elif op == ret:
+            pc, locals_, level, display[level] = calls.pop()
+        elif op == load_global:
+            push(glob[arg])
+        elif op == store_global:
+            glob[arg] = pop()
+        elif op == div:
+            b = pop()
+            stack[-1] = stack[-1] / b
+        elif op == lt:
+            b = pop()
+            stack[-1] = stack[-1] < b
+        elif op == gt:
+            b = pop()
+            stack[-1] = stack[-1] > b
+        elif op == eq:
+            b = pop()
+            stack[-1] = stack[-1] == b
+        elif op == jump_if_true:
+            if pop():
+                pc = arg
+        elif op == neg:
+            stack[-1] = -stack[-1]
+        elif op == pos:
+            stack[-1] = +stack[-1]
+        elif op == load_outer:
+            push(display[arg >> 16][arg & 0xffff])
+        elif op == store_outer:
+            display[arg >> 16][arg & 0xffff] = pop()
+        elif op == load_none:
+            push(None)
+        elif op == prnt:
+            print pop()
+        elif op == read:
+            push(input())
+        elif op == pop_top:
+            pop()
+        elif op == halt:
+            return
+        else:
+            raise VMError('bad opcode %d at %d' % (op, pc - 1))
+
+
+class VM(object):
+    """ Evaluator interface to the virtual machine: run() compiles the
+        tree and executes it.
+    """
+
+    def __init__(self, tree, lines=None):
+        self.tree = tree
+        self.lines = lines
+
+    def run(self):
+        execute(Compiler(self.tree, self.lines).compile())
+
+
+if __name__ == '__main__':
+    # Usage: python vm.py [--no-cache] [--dis] [--output=file.mtc] file.mt
+    #        python vm.py [--dis] file.mtc
+    opts, args = getopt.getopt(sys.argv[1:], '', ['no-cache', 'dis', 'output='])
+    opts = dict(opts)
+    if len(args) != 1:
+        print 'Usage: python vm.py [--no-cache] [--dis] [--output=file.mtc] file.mt'
+        sys.exit(2)
+
+    try:
+        if args[0].endswith('.mtc'):
+            with open(args[0], 'rb') as f:
+                code = Code.load(f)
+        else:
+            tree, lines = astfile.parse_file(args[0], cache='--no-cache' not in opts)
+            code = Compiler(tree, lines).compile()
+    except (IOError, scanner.ScannerError, parser.ParserError,
+            resolver.ResolveError, VMError) as e:
+        print e
+        sys.exit(1)
+
+    if '--output' in opts:
+        with open(opts['--output'], 'wb') as f:
+            code.dump(f)
+    if '--dis' in opts:
+        code.disassemble()
+    else:
+        execute(code)